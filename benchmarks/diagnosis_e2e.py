@@ -0,0 +1,172 @@
+"""Бенчмарк: сквозная диагностика КИ на заглушке LLM.
+
+Создает N синтетических заявок с отчетами трех БКИ (уникальные PDF,
+чтобы кэши не влияли на замер), поднимает в том же процессе заглушку
+chat-completions (benchmarks.llm_stub) и прогоняет заявки через
+ApplicationService.start_diagnosis с заданной параллельностью.
+
+Печатает время по этапам (БД, чтение файлов, извлечение текста, LLM,
+разбор ответа, сохранение), пропускную способность и p50/p95/p99
+времени диагностики одной заявки.
+
+Запуск: python -m benchmarks.diagnosis_e2e --applications 20 --concurrency 4
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional
+
+workdir = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}")
+
+from database.database import init_db, close_db
+from database.models import DocumentType
+from services.user_service import UserService
+from services.application_service import ApplicationService
+from services.document_service import DocumentService
+from services.gpt_diagnosis_service import GPTDiagnosisService
+from services.pdf_extractor import pdf_extractor
+from services.openai_client import openai_client, TokenBucket
+from benchmarks.llm_stub import LLMStub, start_stub
+from benchmarks.pdf_extraction import make_report
+
+STAGES = ["db", "read", "extract", "llm", "parse", "save"]
+
+# Время этапов текущей заявки; подзадачи (gather) видят тот же словарь
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("timings", default=None)
+
+def instrument(owner, name: str, stage: str):
+    """Обернуть метод, добавляя время вызова к этапу текущей заявки"""
+    original = getattr(owner, name)
+
+    @wraps(original)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            timings = _timings.get()
+            if timings is not None:
+                timings[stage] += time.perf_counter() - started
+
+    setattr(owner, name, timed)
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+async def create_applications(count: int, pages: int) -> List[int]:
+    """Заявки с тремя отчетами БКИ каждая (подготовка, в замер не входит)"""
+    user_service = UserService()
+    application_service = ApplicationService()
+    document_service = DocumentService()
+
+    application_ids = []
+    for index in range(count):
+        user = await user_service.create_user(10 ** 9 + index, first_name=f"Bench {index}")
+        application = await application_service.create_application(user)
+        for document_type in [
+            DocumentType.CREDIT_REPORT_NBKI,
+            DocumentType.CREDIT_REPORT_OKB,
+            DocumentType.CREDIT_REPORT_EQUIFAX
+        ]:
+            await document_service.save_document(
+                user=user,
+                file_data=make_report(pages, tag=f"{index}-{document_type.value}-"),
+                file_name=f"{document_type.value}.pdf",
+                file_type=document_type,
+                application_id=application.id
+            )
+        application_ids.append(application.id)
+    return application_ids
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--applications", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=10, help="страниц в каждом отчете")
+    parser.add_argument("--latency", type=float, default=0.5, help="секунд до первого токена заглушки")
+    parser.add_argument("--per-1k", type=float, default=0.02)
+    parser.add_argument("--output-tps", type=float, default=400.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true", help="потоковые ответы, как с показом хода")
+    parser.add_argument("--rpm", type=int, default=10 ** 6, help="лимит клиента, по умолчанию не мешает замеру")
+    parser.add_argument("--tpm", type=int, default=10 ** 9)
+    args = parser.parse_args()
+
+    # Документы и логи анализа пишутся относительно текущего каталога
+    os.chdir(workdir)
+
+    stub = LLMStub(args.latency, args.per_1k, args.output_tps, args.error_rate)
+    runner, base_url = await start_stub(stub)
+    openai_client.api_key = "stub"
+    openai_client.base_url = base_url
+    openai_client.requests_bucket = TokenBucket(args.rpm)
+    openai_client.tokens_bucket = TokenBucket(args.tpm)
+
+    await init_db()
+    application_ids = await create_applications(args.applications, args.pages)
+    print(f"Заявок: {len(application_ids)}, страниц в отчете: {args.pages}, параллельно: {args.concurrency}")
+
+    for method in ["get_application_by_id", "check_documents_ready_for_diagnosis", "update_application_status"]:
+        instrument(ApplicationService, method, "db")
+    instrument(GPTDiagnosisService, "_get_bki_documents", "db")
+    instrument(DocumentService, "get_file_data", "read")
+    instrument(pdf_extractor, "extract_pages", "extract")
+    instrument(GPTDiagnosisService, "_analyze_chunks", "llm")
+    instrument(GPTDiagnosisService, "_parse_gpt_response", "parse")
+    instrument(GPTDiagnosisService, "_save_analysis_result", "save")
+
+    application_service = ApplicationService()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def diagnose(application_id: int):
+        async with semaphore:
+            timings = {stage: 0.0 for stage in STAGES}
+            _timings.set(timings)
+            started = time.perf_counter()
+            success = await application_service.start_diagnosis(
+                application_id,
+                on_block=(lambda *event: None) if args.stream else None
+            )
+            results.append((success, time.perf_counter() - started, timings))
+
+    # Прогрев пула извлечения PDF
+    await pdf_extractor.extract_text(make_report(1), "warmup.pdf")
+
+    started = time.perf_counter()
+    await asyncio.gather(*[diagnose(application_id) for application_id in application_ids])
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for _, latency, _ in results]
+    succeeded = sum(1 for success, _, _ in results if success)
+
+    print(f"\nУспешно: {succeeded}/{len(results)} за {elapsed:.2f} с, "
+          f"{len(results) / elapsed:.2f} заявок/с")
+    print(f"Время заявки: p50 {percentile(latencies, 50):.2f} с | "
+          f"p95 {percentile(latencies, 95):.2f} с | p99 {percentile(latencies, 99):.2f} с")
+
+    print("\nЭтап       среднее, с    p95, с    доля")
+    total = sum(sum(timings.values()) for _, _, timings in results) or 1
+    for stage in STAGES:
+        values = [timings[stage] for _, _, timings in results]
+        print(f"{stage:<10} {statistics.mean(values):10.3f} {percentile(values, 95):9.3f} "
+              f"{sum(values) / total:7.1%}")
+
+    print(f"\nЗаглушка: запросов {stub.requests}, токенов {stub.prompt_tokens} + {stub.completion_tokens}")
+    print(f"Клиент OpenAI: {openai_client.stats()}")
+
+    pdf_extractor.stop()
+    await openai_client.close()
+    await close_db()
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
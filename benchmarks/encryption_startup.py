@@ -0,0 +1,47 @@
+"""Бенчмарк старта: сколько стоит создание сервисов шифрования.
+
+При импорте хэндлеров и middleware создается около 15 экземпляров
+UserService, каждый из которых строит EncryptionService. Скрипт сравнивает
+вывод ключа на каждый экземпляр (как было) с общим keyring.
+
+Запуск: python -m benchmarks.encryption_startup [--instances 15]
+"""
+import argparse
+import time
+
+from cryptography.fernet import Fernet
+
+from config.settings import get_settings
+from services.encryption_service import EncryptionService, derive_key, keyring
+
+def bench_uncached(instances: int) -> float:
+    """Вывод ключа PBKDF2 для каждого экземпляра"""
+    password = get_settings().ENCRYPTION_KEY.encode()
+    start = time.perf_counter()
+    for _ in range(instances):
+        Fernet(derive_key(password))
+    return time.perf_counter() - start
+
+def bench_cached(instances: int) -> float:
+    """Создание EncryptionService через процессный keyring"""
+    keyring.clear()
+    start = time.perf_counter()
+    for _ in range(instances):
+        EncryptionService()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instances", type=int, default=15)
+    args = parser.parse_args()
+    
+    uncached = bench_uncached(args.instances)
+    cached = bench_cached(args.instances)
+    
+    print(f"Экземпляров EncryptionService: {args.instances}")
+    print(f"Без кэша:  {uncached * 1000:.1f} мс")
+    print(f"С keyring: {cached * 1000:.1f} мс (выводов ключа: {keyring.derivations})")
+    print(f"Экономия:  {(uncached - cached) * 1000:.1f} мс")
+
+if __name__ == "__main__":
+    main()
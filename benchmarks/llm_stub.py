@@ -0,0 +1,209 @@
+"""Локальная заглушка OpenAI chat-completions для бенчмарков без оплаты API.
+
+Отвечает на POST /v1/chat/completions готовым отчетом из 12 блоков
+в формате промпта КИ-Аналитика: JSON по схеме, если запрошен
+response_format, иначе текстом. Задержка моделируется как
+latency + per_1k * (тысяч входных токенов) до первого токена и
+output_tps токенов в секунду на генерацию ответа; поддерживается
+stream=true (SSE). Можно включить долю ответов 429/500 для проверки
+повторов клиента; тесты задают ошибки точно через failures (ответы
+следующих запросов) и abort_streams (обрыв потока после
+abort_after_lines строк). Ответ длиннее max_tokens запроса обрезается
+с finish_reason "length", как у настоящей модели.
+
+Запуск: python -m benchmarks.llm_stub --port 8089
+Бот: OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+from aiohttp import web
+
+from services.chunk_planner import BLOCK_TITLES, estimate_tokens, render_report
+
+def canned_report(seed: int, as_json: bool = True) -> str:
+    """Ответ из 12 блоков; критичность детерминированно зависит от seed"""
+    rng = random.Random(seed)
+    report = {}
+    for number, title in BLOCK_TITLES.items():
+        severity = rng.choice(["🟥", "🟨", "🟩", "🟩"])
+        if severity == "🟩":
+            findings = ["ошибок не выявлено"]
+        else:
+            findings = [
+                f"НБКИ, договор №{rng.randint(10000, 99999)} от 12.03.2021: "
+                f"расхождение в сумме задолженности ({rng.randint(1, 900)} 000 руб.)"
+            ]
+        report[number] = (title, severity, findings)
+
+    if not as_json:
+        return render_report(report)
+    # По блоку на строку: поток отдается построчно
+    blocks = [
+        json.dumps({"number": number, "title": title, "severity": severity, "findings": findings},
+                   ensure_ascii=False)
+        for number, (title, severity, findings) in report.items()
+    ]
+    return '{"blocks": [\n' + ",\n".join(blocks) + "\n]}"
+
+class LLMStub:
+    def __init__(
+        self,
+        latency: float = 0.5,
+        per_1k: float = 0.02,
+        output_tps: float = 200.0,
+        error_rate: float = 0.0
+    ):
+        self.latency = latency
+        self.per_1k = per_1k
+        self.output_tps = output_tps
+        self.error_rate = error_rate
+
+        # Ответы следующих запросов: (статус, retry-after)
+        self.failures: List[Tuple[int, Optional[str]]] = []
+        # Сколько следующих потоков оборвать и после скольких строк
+        self.abort_streams = 0
+        self.abort_after_lines = 1
+
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await self._chat_completions(request)
+        finally:
+            self.in_flight -= 1
+
+    async def _chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+
+        if self.failures:
+            status, retry_after = self.failures.pop(0)
+            return web.json_response(
+                {"error": {"message": "stub error", "type": "stub", "code": status}},
+                status=status,
+                headers={"retry-after": retry_after} if retry_after else None
+            )
+
+        if self.error_rate and random.random() < self.error_rate:
+            status = random.choice([429, 500])
+            return web.json_response(
+                {"error": {"message": "stub error", "type": "stub", "code": status}},
+                status=status,
+                headers={"retry-after": "0.1"} if status == 429 else None
+            )
+
+        prompt = "\n".join(message["content"] for message in body["messages"])
+        prompt_tokens = estimate_tokens(prompt)
+        content = canned_report(zlib.crc32(prompt.encode("utf-8")), as_json="response_format" in body)
+        completion_tokens = estimate_tokens(content)
+        finish_reason = "stop"
+        max_tokens = body.get("max_tokens")
+        if max_tokens and completion_tokens > max_tokens:
+            content = content[:len(content) * max_tokens // completion_tokens]
+            completion_tokens = max_tokens
+            finish_reason = "length"
+
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+        # Время до первого токена растет с длиной входа
+        await asyncio.sleep(self.latency + self.per_1k * prompt_tokens / 1000)
+
+        created = int(time.time())
+        model = body.get("model", "stub")
+
+        if not body.get("stream"):
+            await asyncio.sleep(completion_tokens / self.output_tps)
+            return web.json_response({
+                "id": f"stub-{self.requests}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": finish_reason
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        abort = self.abort_streams > 0
+        if abort:
+            self.abort_streams -= 1
+
+        # Отдаем ответ построчно с темпом output_tps
+        for index, line in enumerate(content.splitlines(keepends=True)):
+            if abort and index == self.abort_after_lines:
+                # Соединение рвется посреди ответа
+                request.transport.close()
+                return response
+            await asyncio.sleep(estimate_tokens(line) / self.output_tps)
+            chunk = {
+                "id": f"stub-{self.requests}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": line}, "finish_reason": None}]
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        chunk = {
+            "id": f"stub-{self.requests}",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]
+        }
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        return app
+
+async def start_stub(stub: LLMStub, host: str = "127.0.0.1", port: int = 0):
+    """Запустить заглушку в текущем event loop; возвращает (runner, base_url)"""
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="секунд до первого токена")
+    parser.add_argument("--per-1k", type=float, default=0.02, help="секунд на 1000 входных токенов")
+    parser.add_argument("--output-tps", type=float, default=200.0, help="токенов ответа в секунду")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429/500")
+    args = parser.parse_args()
+
+    stub = LLMStub(args.latency, args.per_1k, args.output_tps, args.error_rate)
+    print(f"Заглушка LLM: http://{args.host}:{args.port}/v1")
+    web.run_app(stub.app(), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Бенчмарк: один запрос с обрезкой текста против map-reduce по частям.
+
+Генерирует синтетические отчеты трех БКИ и прогоняет их через
+GPTDiagnosisService с подмененным вызовом модели, время ответа которой
+растет с длиной входа (как у реального API). Сравнивает прежнюю схему
+(обрезка до 120 000 символов и один запрос) с разбиением на части,
+которые анализируются параллельно и затем сводятся в 12 блоков.
+
+Запуск: python -m benchmarks.map_reduce --chars 80000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import types
+import uuid
+
+db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+
+from database.database import init_db, close_db
+from services.gpt_diagnosis_service import GPTDiagnosisService
+from services.chunk_planner import estimate_tokens, plan_chunks, merge_block_reports
+from services.openai_client import openai_client
+
+LEGACY_LIMIT = 120000
+
+class StubModel:
+    """Модель-заглушка: задержка = base + per_1k * тысяч входных токенов"""
+
+    base = 0.5
+    per_1k = 0.05
+
+    @classmethod
+    async def chat(cls, model, messages, **params):
+        text = messages[-1]["content"]
+        await asyncio.sleep(cls.base + cls.per_1k * estimate_tokens(text) / 1000)
+        blocks = "\n".join(
+            f"Блок {n}. Заглушка\nКритичность: {'🟥' if n % 4 == 0 else '🟩'}\n"
+            f"Найдено в части длиной {len(text)} символов"
+            for n in range(1, 13)
+        )
+        return blocks, estimate_tokens(text)
+
+def make_bureau_text(name: str, chars: int) -> str:
+    # Уникальная метка, чтобы кэш ответов не влиял на замер
+    run = uuid.uuid4().hex
+    lines = []
+    row = 0
+    while sum(len(line) + 1 for line in lines) < chars:
+        lines.append(
+            f"{name} {run} договор {row}: кредитор Банк {row % 9}, лимит {row * 1000} руб., "
+            f"платежи 0000011110000XXXX, статус открыт"
+        )
+        row += 1
+    return "\n".join(lines)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chars", type=int, default=80000, help="символов в отчете каждого БКИ")
+    args = parser.parse_args()
+
+    openai_client.api_key = "stub"
+    openai_client.chat = StubModel.chat
+    await init_db()
+    service = GPTDiagnosisService()
+
+    def texts():
+        return {name: make_bureau_text(name, args.chars) for name in ["НБКИ", "ОКБ", "Эквифакс"]}
+
+    # Прежняя схема: один объединенный текст, обрезанный до лимита
+    combined = service._format_bki_blocks(service._order_bki_blocks(texts()))
+    truncated = max(0, len(combined) - LEGACY_LIMIT)
+    started = time.perf_counter()
+    await service._send_to_gpt(combined[:LEGACY_LIMIT] + "\n[ТЕКСТ ОБРЕЗАН]")
+    legacy = time.perf_counter() - started
+    print(f"обрезка      время {legacy:6.2f} с | частей 1 | потеряно символов {truncated}")
+
+    # Map-reduce по частям
+    extracted = texts()
+    started = time.perf_counter()
+    chunks = plan_chunks(service._order_bki_blocks(extracted), service.settings.GPT_CHUNK_MAX_TOKENS)
+    chunk_texts = [
+        service._format_bki_blocks(chunk, part=i, parts=len(chunks))
+        for i, chunk in enumerate(chunks, start=1)
+    ]
+    result = await service._analyze_chunks(chunk_texts)
+    merge_block_reports(
+        [", ".join(n for n, _ in c) for c in chunks],
+        [await service._parse_gpt_response(response) for response in result["responses"]]
+    )
+    mapped = time.perf_counter() - started
+    print(f"map-reduce   время {mapped:6.2f} с | частей {len(chunks)} | потеряно символов 0")
+
+    await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""Бенчмарк: блокировка event loop при извлечении текста из PDF.
+
+Генерирует синтетический отчет БКИ на заданное число страниц и разбирает
+его двумя способами: синхронно в event loop (как раньше) и через пул
+процессов PdfExtractor. Параллельно работает «тикер», который раз в 10 мс
+отмечается в цикле, - максимальная задержка тика показывает, насколько
+долго остальные апдейты ждали бы обработки.
+
+Запуск: python -m benchmarks.pdf_extraction --pages 60 --documents 3
+"""
+import argparse
+import asyncio
+import time
+
+import fitz
+
+from services.pdf_extractor import PdfExtractor, _extract_page_range
+
+TICK_SECONDS = 0.01
+
+def make_report(pages: int, tag: str = "") -> bytes:
+    """Синтетический многостраничный отчет с плотным текстом (tag делает его уникальным)"""
+    document = fitz.open()
+    for page_num in range(pages):
+        page = document.new_page()
+        lines = [
+            f"Договор {tag}{page_num}-{row}: Bank {row % 7}, limit {row * 1000} RUB, "
+            f"payments 0000000011110000XXXX, status open"
+            for row in range(60)
+        ]
+        page.insert_text((36, 36), "\n".join(lines), fontsize=6)
+    data = document.tobytes()
+    document.close()
+    return data
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+async def measure(name: str, extract, documents: list) -> None:
+    stop = asyncio.Event()
+    lags = []
+    tick_task = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(TICK_SECONDS * 3)
+
+    started = time.perf_counter()
+    texts = await extract(documents)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await tick_task
+    chars = sum(len(text) for text in texts)
+    print(
+        f"{name:<12} время {elapsed * 1000:8.1f} мс | "
+        f"макс. задержка цикла {max(lags) * 1000:8.1f} мс | символов {chars}"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--pages-per-task", type=int, default=16)
+    args = parser.parse_args()
+
+    documents = [make_report(args.pages) for _ in range(args.documents)]
+    print(f"Документов: {args.documents}, страниц в каждом: {args.pages}")
+
+    async def inline(docs):
+        # Прежнее поведение: разбор прямо в event loop, документ за документом
+        return ["\n".join(_extract_page_range(data, 0, None)[0]) for data in docs]
+
+    extractor = PdfExtractor(workers=args.workers, pages_per_task=args.pages_per_task, timeout=120)
+
+    async def pooled(docs):
+        return await asyncio.gather(
+            *[extractor.extract_text(data, f"report_{i}.pdf") for i, data in enumerate(docs)]
+        )
+
+    # Прогрев: запуск процессов пула не должен попасть в замер
+    await extractor.extract_text(documents[0], "warmup.pdf")
+
+    await measure("в цикле", inline, documents)
+    await measure("пул", pooled, documents)
+    extractor.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""Бенчмарк: расчет кредитной нагрузки (ПДН) по записям о кредитах.
+
+Генерирует клиентов с заданным числом договоров, каждый из которых
+есть в трех БКИ с немного разными остатками, и считает нагрузку:
+отдельно ядро на массивах NumPy (debt_load) и полный расчет от
+DataFrame (calculate_debt_load) с нормализацией номеров договоров.
+Печатает время на одного клиента в микросекундах.
+
+Запуск: python -m benchmarks.pdn --clients 2000 --accounts 15
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from services.pdn_calculator import debt_load, calculate_debt_load
+from services.tradeline_parser import tradelines_frame
+
+BUREAUS = ["НБКИ", "ОКБ", "Эквифакс"]
+
+def make_client(accounts: int, rng: random.Random):
+    columns = {name: [] for name in [
+        "bureau", "creditor", "contract_number", "opened", "closed",
+        "credit_limit", "balance", "overdue", "payment_string", "page"
+    ]}
+    for account in range(accounts):
+        limit = rng.randint(10, 900) * 1000.0
+        balance = limit * rng.random()
+        closed = f"20{rng.randint(15, 23)}-0{rng.randint(1, 9)}-15" if account % 4 == 0 else None
+        for bureau in BUREAUS:
+            columns["bureau"].append(bureau)
+            columns["creditor"].append(f"Банк {account % 9}")
+            columns["contract_number"].append(f"№ {account:04d}" if bureau == "ОКБ" else f"{account:04d}")
+            columns["opened"].append("2014-03-01")
+            columns["closed"].append(closed)
+            columns["credit_limit"].append(limit)
+            columns["balance"].append(round(balance * rng.uniform(0.95, 1.0), 2))
+            columns["overdue"].append(0.0 if account % 5 else 1000.0)
+            columns["payment_string"].append(rng.choice("1A234") + "1" * 23)
+            columns["page"].append(1)
+    return tradelines_frame(columns)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--accounts", type=int, default=15, help="договоров у клиента")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    clients = [make_client(args.accounts, rng) for _ in range(min(args.clients, 200))]
+    print(f"Клиентов: {args.clients}, договоров у клиента: {args.accounts} (записей: {args.accounts * 3})")
+
+    # Ядро на готовых массивах
+    arrays = []
+    for frame in clients:
+        keys = frame["contract_number"].str[-4:].astype(int).to_numpy()
+        arrays.append((
+            keys,
+            frame["closed"].isna().to_numpy(),
+            frame["balance"].to_numpy(),
+            frame["credit_limit"].to_numpy(),
+            frame["overdue"].to_numpy(),
+            np.zeros(len(frame), dtype=np.int64)
+        ))
+
+    started = time.perf_counter()
+    for index in range(args.clients):
+        debt_load(*arrays[index % len(arrays)], 500000.0, 150000.0, 0.2, 60)
+    core = (time.perf_counter() - started) / args.clients
+
+    started = time.perf_counter()
+    for index in range(args.clients):
+        result = calculate_debt_load(clients[index % len(clients)], 500000.0, 150000.0, 0.2, 60)
+    full = (time.perf_counter() - started) / args.clients
+
+    print(f"Ядро NumPy:          {core * 1e6:8.1f} мкс на клиента")
+    print(f"Полный расчет от DF: {full * 1e6:8.1f} мкс на клиента")
+    print(f"\nПример: {result}")
+
+if __name__ == "__main__":
+    main()
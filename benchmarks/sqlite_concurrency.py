@@ -0,0 +1,110 @@
+"""Бенчмарк конкурентной работы с SQLite: прежняя настройка движка против продакшен-профиля.
+
+Каждая задача моделирует апдейт: в одной транзакции читает пользователя,
+пишет лог действия и обновляет пользователя. При прежней настройке
+(rollback-журнал, несколько соединений-писателей) такие транзакции
+конфликтуют при повышении блокировки и падают с "database is locked".
+
+Запуск: python -m benchmarks.sqlite_concurrency [--tasks 200] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import database.database as db
+from database.models import Base, User, UserLog
+
+async def run_update(session_maker, user_id: int, stats: dict):
+    start = time.perf_counter()
+    try:
+        async with session_maker() as session:
+            user = (await session.execute(select(User).where(User.id == user_id))).scalars().first()
+            session.add(UserLog(user_id=user.id, action="bench", details="{}"))
+            await session.execute(
+                update(User).where(User.id == user_id).values(last_activity=datetime.utcnow())
+            )
+            await session.commit()
+        stats["ok"] += 1
+    except OperationalError as e:
+        if "locked" in str(e):
+            stats["locked"] += 1
+        else:
+            raise
+    stats["latencies"].append(time.perf_counter() - start)
+
+async def run_load(session_maker, tasks: int, concurrency: int, users: int) -> dict:
+    stats = {"ok": 0, "locked": 0, "latencies": []}
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def worker(i: int):
+        async with semaphore:
+            await run_update(session_maker, i % users + 1, stats)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(tasks)))
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
+
+async def seed(session_maker, users: int):
+    async with session_maker() as session:
+        session.add_all([User(telegram_id=100000 + i) for i in range(users)])
+        await session.commit()
+
+def report(name: str, stats: dict):
+    latencies = sorted(stats["latencies"])
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(
+        f"{name:<22} успешно {stats['ok']:>5}, locked {stats['locked']:>4}, "
+        f"{stats['ok'] / stats['elapsed']:>7.1f} апд/с, p95 {p95 * 1000:.0f} мс"
+    )
+
+async def bench_legacy(path: str, args) -> dict:
+    """Настройка init_db до продакшен-профиля"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=args.concurrency,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        connect_args={"timeout": args.busy_timeout},
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await seed(session_maker, args.users)
+    stats = await run_load(session_maker, args.tasks, args.concurrency, args.users)
+    await engine.dispose()
+    return stats
+
+async def bench_profile(path: str, args) -> dict:
+    """Продакшен-профиль из database.database"""
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    os.environ["SQLITE_BUSY_TIMEOUT_MS"] = str(int(args.busy_timeout * 1000))
+    await db.init_db()
+    await seed(db.async_session_maker, args.users)
+    stats = await run_load(db.async_session_maker, args.tasks, args.concurrency, args.users)
+    await db.close_db()
+    return stats
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--busy-timeout", type=float, default=5.0)
+    args = parser.parse_args()
+    
+    tmp = tempfile.mkdtemp()
+    report("Прежняя настройка", await bench_legacy(os.path.join(tmp, "legacy.db"), args))
+    report("SQLite-профиль", await bench_profile(os.path.join(tmp, "profile.db"), args))
+
+if __name__ == "__main__":
+    asyncio.run(main())
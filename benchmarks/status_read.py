@@ -0,0 +1,168 @@
+"""Бенчмарк: сколько байт читает из базы проверка статуса заявки.
+
+Создает на временной SQLite заявки с завершенной диагностикой
+(diagnosis_result с текстом отчета, ПДН и находками по платежным
+строкам, длинные рекомендации) и документами, затем выполняет запрос
+экрана статуса (get_user_application) в трех вариантах:
+
+- «до»: все колонки заявки загружаются, результаты хранятся несжатыми;
+- «после»: результаты отложены (deferred) и сжаты миграцией 7;
+- экран результатов: те же заявки с with_results (читаются сжатые данные).
+
+Байты считаются по значениям колонок, загруженных в объекты заявок,
+документов и истории статусов; для колонок результатов - по размеру,
+в котором они хранятся в базе.
+
+Запуск: python -m benchmarks.status_read --applications 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import event, func, select, type_coerce, update, Text, LargeBinary, inspect
+
+db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+
+from database import database
+from database.database import init_db, close_db, get_db_session
+from database.migrations import _compress_application_results
+from database.models import Application, ApplicationStatus, Document, DocumentType, StatusHistory
+from services.application_service import ApplicationService
+from services.chunk_planner import parse_json_report
+from services.gpt_diagnosis_service import GPTDiagnosisService
+from services.user_service import UserService
+from benchmarks.llm_stub import canned_report
+
+RESULT_COLUMNS = ("diagnosis_result", "recommendations")
+
+# Размер хранимых значений колонок результатов: id заявки -> колонка -> байт
+stored_sizes = {}
+loaded_bytes = [0]
+
+def _size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(str(value).encode("utf-8"))
+
+@event.listens_for(Application, "load")
+@event.listens_for(Document, "load")
+@event.listens_for(StatusHistory, "load")
+def _count_loaded(target, context):
+    state = inspect(target)
+    for attr in state.mapper.column_attrs:
+        if attr.key not in state.dict:
+            continue
+        if isinstance(target, Application) and attr.key in RESULT_COLUMNS:
+            loaded_bytes[0] += stored_sizes[target.id][attr.key]
+        else:
+            loaded_bytes[0] += _size(state.dict[attr.key])
+
+def make_result(seed: int) -> str:
+    """diagnosis_result в том виде, в каком его сохраняет GPTDiagnosisService"""
+    rng = random.Random(seed)
+    report = parse_json_report(canned_report(seed))
+    report = {
+        number: (title, severity, findings * rng.randint(3, 6))
+        for number, (title, severity, findings) in report.items()
+    }
+    result = GPTDiagnosisService()._build_analysis_result(report)
+    result["debt_load"] = {"accounts": 14, "total_exposure": 1834500.0, "pdn": 0.47}
+    result["payment_discipline"] = [
+        {
+            "type": "overdue_episode", "severity": "🟨", "bureau": "НБКИ",
+            "contract_number": f"{seed}-{index:04d}", "creditor": f"Банк {index % 9}",
+            "months": [3, 4, 5],
+            "text": f"НБКИ, договор № {seed}-{index:04d} (Банк {index % 9}): эпизодов просрочки 1, "
+                    f"максимальная 1-29 дн., месяцы назад: 3, 4, 5",
+        }
+        for index in range(rng.randint(10, 40))
+    ]
+    return json.dumps(result, ensure_ascii=False)
+
+async def create_applications(count: int):
+    user_service = UserService()
+    application_service = ApplicationService()
+    for index in range(count):
+        user = await user_service.create_user(50000 + index)
+        application = await application_service.create_application(user)
+        async with get_db_session() as session:
+            for document_type in (DocumentType.CREDIT_REPORT_NBKI, DocumentType.CREDIT_REPORT_OKB):
+                session.add(Document(
+                    user_id=user.id, application_id=application.id, file_name=f"report_{index}.pdf",
+                    file_type=document_type, file_size=1_500_000, file_path=f"documents/{index}.pdf"
+                ))
+            # Как до сжатия: значения без обработки CompressedText
+            await session.execute(
+                update(Application)
+                .where(Application.id == application.id)
+                .values(
+                    status=ApplicationStatus.DIAGNOSIS_COMPLETED,
+                    diagnosis_result=type_coerce(make_result(index), Text),
+                    recommendations=type_coerce("\n".join(
+                        f"Рекомендация {n}: оспорить сведения по договору в БКИ и приложить справку банка"
+                        for n in range(30)
+                    ), Text)
+                )
+            )
+    return count
+
+async def measure_stored_sizes():
+    stored_sizes.clear()
+    async with get_db_session() as session:
+        table = Application.__table__
+        rows = await session.execute(select(
+            table.c.id,
+            # CAST AS BLOB: length() в байтах, а не в символах
+            func.length(type_coerce(table.c.diagnosis_result, Text).cast(LargeBinary)),
+            func.length(type_coerce(table.c.recommendations, Text).cast(LargeBinary)),
+        ))
+        for application_id, result_size, recommendations_size in rows.all():
+            stored_sizes[application_id] = {
+                "diagnosis_result": result_size or 0,
+                "recommendations": recommendations_size or 0,
+            }
+
+async def status_checks(user_ids, with_results: bool):
+    application_service = ApplicationService()
+    loaded_bytes[0] = 0
+    started = time.perf_counter()
+    for user_id in user_ids:
+        await application_service.get_user_application(user_id, with_results=with_results)
+    elapsed = time.perf_counter() - started
+    return loaded_bytes[0] / len(user_ids), elapsed / len(user_ids)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--applications", type=int, default=200)
+    args = parser.parse_args()
+
+    await init_db()
+    await create_applications(args.applications)
+    async with get_db_session() as session:
+        user_ids = list((await session.execute(select(Application.user_id))).scalars())
+
+    await measure_stored_sizes()
+    before, before_time = await status_checks(user_ids, with_results=True)
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(_compress_application_results)
+    await measure_stored_sizes()
+    after, after_time = await status_checks(user_ids, with_results=False)
+    results, results_time = await status_checks(user_ids, with_results=True)
+
+    print(f"Заявок: {args.applications}")
+    print(f"Проверка статуса до:    {before / 1024:8.1f} КБ на запрос, {before_time * 1000:6.2f} мс")
+    print(f"Проверка статуса после: {after / 1024:8.1f} КБ на запрос, {after_time * 1000:6.2f} мс")
+    print(f"Экран результатов:      {results / 1024:8.1f} КБ на запрос, {results_time * 1000:6.2f} мс")
+
+    await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main())
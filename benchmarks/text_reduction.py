@@ -0,0 +1,102 @@
+"""Бенчмарк: сокращение текста отчетов БКИ перед отправкой в GPT.
+
+Генерирует тексты страниц отчетов (как их возвращает PyMuPDF: ячейка
+таблицы - строка) с шапкой и подвалом на каждой странице, юридической
+оговоркой, легендой статусов, заполнителями и страницами приложений без
+договоров. Печатает долю оставшихся символов, оценку сэкономленных
+токенов и время на документ, а также проверяет, что в тексте остались
+все значения записей о кредитах: номера договоров, даты, суммы и
+платежные строки. Оговорка и легенда повторяются во всех отчетах бюро
+и с третьего отчета удаляются полностью.
+
+Запуск: python -m benchmarks.text_reduction --documents 6 --pages 20
+"""
+import argparse
+import random
+import time
+
+from services.chunk_planner import estimate_tokens
+from services.text_reducer import TextReducer
+
+DISCLAIMER = (
+    "Настоящий кредитный отчет предоставлен в соответствии с Федеральным законом "
+    "от 30.12.2004 № 218-ФЗ «О кредитных историях» и не может быть передан третьим лицам"
+)
+LEGEND = (
+    "Статусы платежной дисциплины: 0 - без просрочки, 1 - просрочка 1-29 дней, "
+    "2 - 30-59 дней, 3 - 60-89 дней, 4 - 90-119 дней, 5 - более 120 дней, 9 - списан"
+)
+COLUMNS = ["Кредитор", "Номер договора", "Дата открытия", "Остаток, руб.", "Платежная дисциплина"]
+
+def make_pages(pages: int, rows_per_page: int, client: int, rng: random.Random):
+    """Тексты страниц отчета, номера договоров и все значения записей о кредитах"""
+    texts = []
+    contracts = []
+    values = []
+    for page_num in range(pages):
+        lines = [
+            "КРЕДИТНЫЙ ОТЧЕТ ДЛЯ СУБЪЕКТА",
+            f"Сформирован {rng.randint(1, 28):02d}.03.2024 для клиента {client}",
+            "Раздел «Сведения о договорах» ............................",
+        ]
+        # Последние страницы - приложения без договоров
+        if page_num < pages - 2:
+            lines += COLUMNS
+            for row in range(rows_per_page):
+                number = f"{client:03d}-{page_num:02d}{row:02d}/{rng.randint(10, 99)}"
+                contracts.append(number)
+                row_values = [
+                    f"Банк {rng.randint(1, 30)}",
+                    number,
+                    f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.20{rng.randint(10, 23)}",
+                    f"{rng.randint(0, 900000):,}".replace(",", " ") + ",00",
+                    "".join(rng.choice("0000000001") for _ in range(24)),
+                ]
+                values += row_values
+                lines += row_values
+            lines += [LEGEND, "_" * 60]
+        else:
+            lines += ["Порядок оспаривания сведений кредитной истории", DISCLAIMER.upper(), LEGEND.lower()]
+        lines += [DISCLAIMER, f"Страница {page_num + 1} из {pages}"]
+        texts.append("\n".join(lines))
+    return texts, contracts, values
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=6)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=12, help="договоров на странице")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    reducer = TextReducer(min_page_share=0.5, min_documents=3)
+    print(f"Отчетов: {args.documents}, страниц: {args.pages}, договоров на странице: {args.rows}\n")
+
+    tokens_in = tokens_out = 0
+    for client in range(args.documents):
+        pages, contracts, values = make_pages(args.pages, args.rows, client, rng)
+        raw = "\n".join(pages)
+
+        started = time.perf_counter()
+        text = reducer.reduce(pages, "НБКИ", f"report_{client}.pdf")
+        elapsed = time.perf_counter() - started
+
+        lost = [number for number in contracts if number not in text]
+        kept_lines = set(text.split("\n"))
+        lost_values = [value for value in values if value not in kept_lines]
+        tokens_in += estimate_tokens(raw)
+        tokens_out += estimate_tokens(text)
+        print(
+            f"Отчет {client}: символов {len(raw):7d} -> {len(text):7d} ({len(text) / len(raw):5.1%}) | "
+            f"токенов ~{estimate_tokens(raw) - estimate_tokens(text):6d} сэкономлено | "
+            f"{elapsed * 1000:6.1f} мс | потеряно договоров: {len(lost)}, значений записей: {len(lost_values)}"
+        )
+
+    stats = reducer.stats()
+    print(
+        f"\nИтого: {stats['chars_in']} -> {stats['chars_out']} символов ({stats['ratio']:.1%}), "
+        f"токенов ~{tokens_in} -> ~{tokens_out}, пропущено страниц {stats['pages_skipped']} из {stats['pages']}"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Бенчмарк: пропускная способность разбора таблиц договоров отчетов БКИ.
+
+Генерирует синтетические отчеты с разлинованной таблицей договоров
+(заголовок только на первой странице, дальше таблица продолжается)
+и разбирает их pdfplumber: последовательно прямо в event loop и через
+TradelineParser в пуле процессов. Печатает страниц и записей в секунду,
+максимальную задержку event loop (как в benchmarks.pdf_extraction)
+и проверяет полноту и типы разобранных записей.
+
+Запуск: python -m benchmarks.tradeline_parse --documents 6 --rows 200
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import fitz
+
+from benchmarks.pdf_extraction import ticker, TICK_SECONDS
+from services.pdf_extractor import PdfExtractor
+from services import tradeline_parser as tradeline_module
+from services.tradeline_parser import TradelineParser, _parse_tradelines, tradelines_frame
+
+HEADERS = [
+    "Кредитор", "Номер договора", "Дата открытия", "Дата закрытия",
+    "Лимит, руб.", "Остаток, руб.", "Просрочено", "Платежная дисциплина"
+]
+WIDTHS = [80, 60, 55, 55, 60, 60, 60, 140]
+ROW_HEIGHT = 14
+LEFT, TOP = 12, 40
+
+def _amount(value: int) -> str:
+    return f"{value:,}".replace(",", " ") + ",00"
+
+def make_tradeline_report(rows: int, rows_per_page: int = 45, seed: int = 0) -> bytes:
+    """Отчет с таблицей из rows договоров (шрифт china-s содержит кириллицу)"""
+    rng = random.Random(seed)
+    document = fitz.open()
+
+    for start in range(0, rows, rows_per_page):
+        page = document.new_page()
+        table = [HEADERS] if start == 0 else []
+        for row in range(start, min(rows, start + rows_per_page)):
+            table.append([
+                f"ПАО Банк {row % 17}",
+                f"{seed}-{row:06d}",
+                f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.20{rng.randint(10, 23)}",
+                "" if row % 3 else f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2024",
+                _amount(rng.randint(10, 900) * 1000),
+                _amount(rng.randint(0, 500) * 1000),
+                _amount(0 if row % 5 else rng.randint(1, 90) * 1000),
+                "".join(rng.choice("0000000001AX") for _ in range(24)),
+            ])
+
+        y = TOP
+        for cells in table:
+            x = LEFT
+            for cell, width in zip(cells, WIDTHS):
+                page.insert_text((x + 2, y + ROW_HEIGHT - 4), cell, fontname="china-s", fontsize=4)
+                x += width
+            y += ROW_HEIGHT
+
+        # Сетка таблицы: по ней pdfplumber находит ячейки
+        right = LEFT + sum(WIDTHS)
+        for line in range(len(table) + 1):
+            page.draw_line((LEFT, TOP + line * ROW_HEIGHT), (right, TOP + line * ROW_HEIGHT), width=0.5)
+        x = LEFT
+        for width in [0] + WIDTHS:
+            x += width
+            page.draw_line((x, TOP), (x, y), width=0.5)
+
+    data = document.tobytes()
+    document.close()
+    return data
+
+async def measure(name: str, parse, documents: list, pages: int) -> list:
+    stop = asyncio.Event()
+    lags = []
+    tick_task = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(TICK_SECONDS * 3)
+
+    started = time.perf_counter()
+    frames = await parse(documents)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await tick_task
+    rows = sum(len(frame) for frame in frames)
+    print(
+        f"{name:<10} время {elapsed:6.2f} с | {pages / elapsed:6.1f} стр/с | "
+        f"{rows / elapsed:7.1f} записей/с | макс. задержка цикла {max(lags) * 1000:7.1f} мс"
+    )
+    return frames
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=6)
+    parser.add_argument("--rows", type=int, default=200, help="договоров в каждом отчете")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    documents = [make_tradeline_report(args.rows, seed=index) for index in range(args.documents)]
+    pages = sum(fitz.open(stream=data, filetype="pdf").page_count for data in documents)
+    print(f"Документов: {args.documents}, договоров в каждом: {args.rows}, страниц всего: {pages}")
+
+    async def inline(docs):
+        return [tradelines_frame(_parse_tradelines(data, "НБКИ")) for data in docs]
+
+    extractor = PdfExtractor(workers=args.workers, pages_per_task=16, timeout=600)
+    tradeline_module.pdf_extractor = extractor
+    tradeline_parser = TradelineParser()
+
+    async def pooled(docs):
+        return await asyncio.gather(
+            *[tradeline_parser.parse(data, f"report_{i}.pdf", "НБКИ") for i, data in enumerate(docs)]
+        )
+
+    # Прогрев: запуск процессов пула не должен попасть в замер
+    await extractor.run(_parse_tradelines, make_tradeline_report(1), "warmup")
+
+    await measure("в цикле", inline, documents, pages)
+    frames = await measure("пул", pooled, documents, pages)
+    extractor.stop()
+
+    # Проверка полноты и типов разбора
+    frame = frames[0]
+    missing = args.rows - len(frame)
+    print(f"\nПропущено записей: {missing}, без даты открытия: {frame['opened'].isna().sum()}, "
+          f"закрытых: {frame['closed'].notna().sum()}, с просрочкой: {(frame['overdue'] > 0).sum()}")
+    print(frame.dtypes.to_string())
+
+if __name__ == "__main__":
+    asyncio.run(main())
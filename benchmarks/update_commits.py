@@ -0,0 +1,145 @@
+"""Бенчмарк: коммиты одного апдейта Telegram и удержание соединения записи.
+
+Моделирует апдейт загрузки документа (поиск пользователя, last_activity,
+сообщение «обрабатываю», создание заявки, запись лога, ответ) на
+временной SQLite. Запросы к Telegram идут через настоящую сессию бота
+aiogram с задержкой вместо сети. Режимы:
+
+- сессия на вызов: без DbSessionMiddleware, каждый вызов сервиса
+  коммитит сам;
+- unit of work: одна транзакция на апдейт, коммит в конце;
+- unit of work + CommitBeforeRequestMiddleware: коммит перед каждым
+  запросом к Telegram.
+
+Для каждого режима печатаются транзакции соединений (чтение и запись
+в SQLite идут через разные пулы), коммиты, точки сохранения вложенных
+get_db_session() и время, которое единственное соединение записи было
+занято. Все режимы выполняют текущий код сервисов; цифры исходного кода
+дает тот же сценарий, запущенный на дереве до изменения.
+
+Запуск: python -m benchmarks.update_commits --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+
+from database import database
+from database.database import init_db, close_db, get_db_session
+from bot.middlewares.db_session_middleware import CommitBeforeRequestMiddleware
+from services.user_service import UserService
+from services.application_service import ApplicationService
+
+counters = {"commits": 0, "transactions": 0, "savepoints": 0, "writer_busy": 0.0}
+_checked_out = {}
+
+# Транзакции и коммиты соединений; точки сохранения вложенных блоков - отдельно
+@event.listens_for(Engine, "begin")
+def _count_transaction(conn):
+    counters["transactions"] += 1
+
+@event.listens_for(Engine, "commit")
+def _count_commit(conn):
+    counters["commits"] += 1
+
+@event.listens_for(Engine, "savepoint")
+def _count_savepoint(conn, name):
+    counters["savepoints"] += 1
+
+class DelayedTelegramSession(BaseSession):
+    """Сессия бота без сети: каждый запрос просто ждет latency секунд"""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    async def make_request(self, bot, method, timeout=None):
+        await asyncio.sleep(self.latency)
+        return None
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+def _watch_writer():
+    """Время, пока соединение записи выдано из пула"""
+    pool = database.engine.sync_engine.pool
+
+    @event.listens_for(pool, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        _checked_out[id(connection_record)] = time.perf_counter()
+
+    @event.listens_for(pool, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        started = _checked_out.pop(id(connection_record), None)
+        if started is not None:
+            counters["writer_busy"] += time.perf_counter() - started
+
+@asynccontextmanager
+async def no_unit_of_work():
+    yield
+
+async def simulate_update(bot: Bot, telegram_id: int, unit_of_work) -> dict:
+    """Один апдейт: те же вызовы, что делают middleware и хэндлер загрузки"""
+    user_service = UserService()
+    application_service = ApplicationService()
+
+    counters.update(commits=0, transactions=0, savepoints=0, writer_busy=0.0)
+    async with unit_of_work():
+        user = await user_service.get_user_by_telegram_id(telegram_id)
+        await user_service.update_last_activity(user.id)
+        await bot(SendMessage(chat_id=telegram_id, text="⏳ Обрабатываю документ..."))
+        if not await application_service.get_user_application(user.id):
+            await application_service.create_application(user)
+        await user_service.log_user_action(user.id, "document_uploaded", {"bench": True})
+        await bot(SendMessage(chat_id=telegram_id, text="✅ Документ загружен"))
+        await user_service.log_user_action(user.id, "message_document", {"bench": True})
+    return dict(counters)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка запроса к Telegram, с")
+    args = parser.parse_args()
+
+    await init_db()
+    _watch_writer()
+    user_service = UserService()
+    for telegram_id in (1001, 1002, 1003):
+        await user_service.create_user(telegram_id)
+
+    bot = Bot("123456:bench", session=DelayedTelegramSession(args.latency))
+    separate = await simulate_update(bot, 1001, no_unit_of_work)
+    held = await simulate_update(bot, 1002, get_db_session)
+    bot.session.middleware(CommitBeforeRequestMiddleware())
+    committed = await simulate_update(bot, 1003, get_db_session)
+
+    print(f"Апдейт загрузки документа (2 запроса к Telegram по {args.latency * 1000:.0f} мс):")
+    for label, result in (
+        ("Сессия на вызов:              ", separate),
+        ("Unit of work:                 ", held),
+        ("Unit of work + коммит до сети:", committed),
+    ):
+        print(
+            f"  {label} транзакций {result['transactions']}, коммитов {result['commits']}, "
+            f"точек сохранения {result['savepoints']}, "
+            f"соединение записи занято {result['writer_busy'] * 1000:6.1f} мс"
+        )
+
+    await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main())
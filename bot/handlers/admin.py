@@ -3,15 +3,28 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.filters import Command
 import logging
 
-from database.models import User, UserRole
+from database.models import User, UserRole, BlockSeverity
 from services.broker_auth_service import BrokerAuthService
 from services.user_service import UserService
+from services.application_service import ApplicationService
+from services.chunk_planner import BLOCK_TITLES
+from services.user_cache import user_cache
+from database.database import call_after_commit
+from services.activity_tracker import activity_tracker
+from services.log_sink import log_sink
+from services.diagnosis_queue import diagnosis_queue
+from services.pdf_extractor import pdf_extractor
+from services.tradeline_parser import tradeline_parser
+from services.text_reducer import text_reducer
+from services.llm_cache import llm_cache
+from services.openai_client import openai_client
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 broker_auth_service = BrokerAuthService()
 user_service = UserService()
+application_service = ApplicationService()
 
 # Список админов (можно вынести в конфиг)
 ADMIN_TELEGRAM_IDS = [762169219]  # Добавляем для тестирования
@@ -46,7 +59,8 @@ async def admin_menu(message: Message, user: User):
 • `/applications` - Список заявок брокеров
 • `/codes` - Создать инвайт-код вручную
 • `/make_admin @username` - Сделать пользователя админом
-• `/stats` - Общая статистика"""
+• `/stats` - Общая статистика
+• `/perf` - Показатели кэшей и очередей"""
 
     await message.answer(text)
 
@@ -280,6 +294,93 @@ async def make_user_admin(message: Message, user: User):
 2. Добавить ID в список ADMIN_TELEGRAM_IDS в коде"""
     )
 
+@router.message(Command("stats"))
+async def show_diagnosis_stats(message: Message, user: User):
+    """Сводка по блокам выполненных диагностик"""
+    
+    if not is_admin(user):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    stats = await application_service.get_block_statistics()
+    if not stats:
+        await message.answer("📊 Диагностик пока нет")
+        return
+    
+    text = "📊 БЛОКИ ДИАГНОСТИК (заявок: 🟥 / 🟨 / 🟩 / нет данных)\n"
+    for number in sorted(stats):
+        counts = stats[number]
+        text += (
+            f"\n{number}. {BLOCK_TITLES.get(number, '')}: "
+            f"{counts.get(BlockSeverity.CRITICAL, 0)} / {counts.get(BlockSeverity.WARNING, 0)} / "
+            f"{counts.get(BlockSeverity.OK, 0)} / {counts.get(None, 0)}"
+        )
+    
+    await message.answer(text)
+
+@router.message(Command("perf"))
+async def show_performance_stats(message: Message, user: User):
+    """Показатели кэшей и очередей"""
+    
+    if not is_admin(user):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    cache_stats = user_cache.stats()
+    activity_stats = activity_tracker.stats()
+    log_stats = log_sink.stats()
+    queue_stats = await diagnosis_queue.stats()
+    pdf_stats = pdf_extractor.stats()
+    tradeline_stats = tradeline_parser.stats()
+    reducer_stats = text_reducer.stats()
+    llm_stats = llm_cache.stats()
+    openai_stats = openai_client.stats()
+    
+    text = f"""📈 ПОКАЗАТЕЛИ ПРОИЗВОДИТЕЛЬНОСТИ
+
+👤 Кэш пользователей:
+• Записей: {cache_stats['size']} / {cache_stats['max_size']}
+• TTL: {cache_stats['ttl_seconds']} с
+• Попадания: {cache_stats['hits']}
+• Промахи: {cache_stats['misses']}
+• Вытеснения: {cache_stats['evictions']}
+• Hit rate: {cache_stats['hit_rate']:.1%}
+
+🕐 Запись last_activity:
+• В очереди: {activity_stats['pending']}
+• Отметок: {activity_stats['touches']} (пропущено: {activity_stats['skipped']})
+• Сбросов: {activity_stats['flushes']}, строк записано: {activity_stats['rows_written']}
+
+📝 Очередь логов:
+• В очереди: {log_stats['queued']}
+• Принято: {log_stats['accepted']}, отброшено: {log_stats['dropped']}
+• Записано: {log_stats['written']} ({log_stats['batches']} пачек), ошибок: {log_stats['failed']}
+
+🤖 Очередь диагностики:
+• Воркеров: {queue_stats['workers']}
+• Ожидают: {queue_stats['by_status'].get('pending', 0)}, выполняются: {queue_stats['by_status'].get('running', 0)}
+• Готово: {queue_stats['completed']}, повторов: {queue_stats['retried']}, ошибок: {queue_stats['failed']}
+• Слито загрузок: {queue_stats['debounced']}, вытеснено анализов: {queue_stats['superseded']}
+
+📄 Извлечение PDF:
+• Процессов: {pdf_stats['workers']} ({'запущен' if pdf_stats['running'] else 'не запущен'})
+• Документов: {pdf_stats['documents']}, страниц: {pdf_stats['pages']}
+• Таймаутов: {pdf_stats['timeouts']}, ошибок: {pdf_stats['failures']}
+• Таблиц договоров разобрано: {tradeline_stats['documents']} документов, {tradeline_stats['rows']} записей, ошибок: {tradeline_stats['failures']}
+• Сокращение текста для GPT: {reducer_stats['chars_in']} -> {reducer_stats['chars_out']} символов ({reducer_stats['ratio']:.0%}), пропущено страниц: {reducer_stats['pages_skipped']} из {reducer_stats['pages']}
+
+🧠 Кэш ответов GPT:
+• Попадания: {llm_stats['hits']}, промахи: {llm_stats['misses']}
+• Hit rate: {llm_stats['hit_rate']:.1%}, сэкономлено токенов: {llm_stats['tokens_saved']}
+• Сохранено: {llm_stats['stores']}, вытеснено: {llm_stats['evictions']}
+
+🌐 Клиент OpenAI:
+• Запросов: {openai_stats['requests']}, повторов: {openai_stats['retries']}, ошибок: {openai_stats['errors']}
+• Обрезано лимитом токенов: {openai_stats['truncated']}
+• Ожидание лимитов RPM/TPM: {openai_stats['throttled_seconds']:.1f} с"""
+    
+    await message.answer(text)
+
 @router.message(Command("reset_role"))
 async def reset_user_role(message: Message, user: User):
     """Сбросить роль пользователя для тестирования"""
@@ -318,7 +419,9 @@ async def reset_user_role(message: Message, user: User):
                 .where(UserModel.telegram_id == target_telegram_id)
                 .values(role=UserRole.CLIENT)
             )
-            await session.commit()
+            await session.flush()
+        
+        call_after_commit(lambda: user_cache.invalidate(target_telegram_id))
         
         await message.answer(
             f"""✅ Роль сброшена!
@@ -357,7 +460,9 @@ async def reset_my_role(message: Message, user: User):
                 .where(UserModel.telegram_id == user.telegram_id)
                 .values(role=UserRole.CLIENT)
             )
-            await session.commit()
+            await session.flush()
+        
+        call_after_commit(lambda: user_cache.invalidate(user.telegram_id))
         
         await message.answer(
             """✅ Ваша роль сброшена на "клиент"!
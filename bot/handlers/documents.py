@@ -1,3 +1,4 @@
+from typing import Optional
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import StateFilter
@@ -10,6 +11,8 @@ from database.models import User, DocumentType
 from services.document_service import DocumentService
 from services.user_service import UserService
 from services.application_service import ApplicationService
+from services.diagnosis_queue import diagnosis_queue
+from services.tradeline_parser import parse_amount
 from bot.keyboards.inline import (
     get_document_upload_keyboard, 
     get_back_button,
@@ -23,6 +26,11 @@ router = Router()
 class DocumentStates(StatesGroup):
     waiting_for_document = State()
     selecting_bank = State()
+    waiting_for_income = State()
+    waiting_for_loan_amount = State()
+
+# Верхняя граница для сумм, вводимых пользователем (отсекает опечатки)
+MAX_AMOUNT_RUB = 1_000_000_000
 
 document_service = DocumentService()
 user_service = UserService()
@@ -209,12 +217,19 @@ async def handle_document_upload(message: Message, state: FSMContext, user: User
         file_info = await bot.get_file(document.file_id)
         file_data = await bot.download_file(file_info.file_path)
         
+        # Получаем или создаем заявку: документ привязывается к ней,
+        # иначе проверка готовности к диагностике его не увидит
+        application = await application_service.get_user_application(user.id)
+        if not application:
+            application = await application_service.create_application(user)
+        
         # Сохраняем документ
         saved_document = await document_service.save_document(
             user=user,
             file_data=file_data.read(),
             file_name=document.file_name,
-            file_type=document_type
+            file_type=document_type,
+            application_id=application.id
         )
         
         # Логируем действие
@@ -230,46 +245,40 @@ async def handle_document_upload(message: Message, state: FSMContext, user: User
         )
         
         # Проверяем возможность автозапуска диагностики
-        diagnosis_started = False
+        diagnosis_queued = False
         diagnosis_status = ""
         
         try:
-            # Получаем или создаем заявку
-            application = await application_service.get_user_application(user.id)
-            if not application:
-                # Создаем новую заявку
-                application = await application_service.create_application(user)
-            
             # Проверяем готовность для диагностики
             if await application_service.check_documents_ready_for_diagnosis(application.id):
                 logger.info(f"Автозапуск диагностики для пользователя {user.id}")
                 
-                # Запускаем диагностику
-                diagnosis_started = await application_service.start_diagnosis(application.id)
-                
-                if diagnosis_started:
-                    diagnosis_status = "\n\n🤖 GPT диагностика запущена автоматически!"
-                else:
-                    diagnosis_status = "\n\n⚠️ Документы готовы, но диагностика не запустилась. Попробуйте позже."
+                # Диагностика идет минуты: ставим ее в очередь, воркер подхватит
+                # задачу после окна ожидания и пришлет уведомление с результатом.
+                # Новый отчет БКИ делает идущий анализ устаревшим
+                await diagnosis_queue.enqueue(
+                    application.id,
+                    supersede=document_type.value.startswith("credit_report_")
+                )
+                diagnosis_queued = True
             else:
                 diagnosis_status = "\n\n📋 Загрузите остальные отчеты БКИ для запуска диагностики."
                 
         except Exception as e:
-            logger.error(f"Ошибка автозапуска диагностики: {e}")
+            logger.error(f"Ошибка постановки диагностики в очередь: {e}")
             diagnosis_status = "\n\n⚠️ Документ загружен, но возникла ошибка при запуске диагностики."
         
         await progress_msg.delete()
         
         # Формируем сообщение в зависимости от результата
-        if diagnosis_started:
-            message_text = f"""✅ Документ загружен! 🤖 Диагностика запущена!
-
-📄 Файл: {document.file_name}
-📊 Размер: {round(document.file_size / (1024 * 1024), 2)} МБ
-📋 Тип: {document_type.value}
-
-🔍 GPT анализирует вашу кредитную историю...
-⏱️ Результаты будут готовы через 2-5 минут!"""
+        if diagnosis_queued:
+            message_text = MESSAGES["diagnosis_queued"].format(
+                file_name=document.file_name,
+                size=round(document.file_size / (1024 * 1024), 2),
+                file_type=document_type.value
+            )
+            if application.monthly_income is None:
+                message_text += MESSAGES["add_income_hint"]
         else:
             message_text = f"""✅ Документ успешно загружен!
             
@@ -284,6 +293,10 @@ async def handle_document_upload(message: Message, state: FSMContext, user: User
                     text="📋 Загрузить еще документы",
                     callback_data="start_diagnosis"
                 )],
+                [InlineKeyboardButton(
+                    text="💰 Доход и сумма кредита",
+                    callback_data="set_loan_parameters"
+                )],
                 [InlineKeyboardButton(
                     text="📊 Проверить статус",
                     callback_data="check_status"
@@ -313,6 +326,93 @@ async def handle_wrong_document_type(message: Message):
         "Если хотите отменить загрузку, нажмите кнопку \"Отмена\" выше."
     )
 
+def parse_rubles(text: str) -> Optional[float]:
+    """Сумма, введенная пользователем: «85 000», «85000 руб.», «85 тыс» -> 85000.0"""
+    amount = parse_amount(text)
+    if amount is None or amount < 0:
+        return None
+    if "тыс" in text.lower():
+        amount *= 1000
+    return amount if amount <= MAX_AMOUNT_RUB else None
+
+@router.callback_query(F.data == "set_loan_parameters")
+async def ask_monthly_income(callback: CallbackQuery, state: FSMContext, user: User):
+    """Запросить доход и сумму кредита для расчета ПДН"""
+    
+    if not user:
+        await callback.answer("❌ Необходимо зарегистрироваться", show_alert=True)
+        return
+    
+    await state.set_state(DocumentStates.waiting_for_income)
+    await callback.message.edit_text(
+        MESSAGES["ask_monthly_income"],
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(
+                text="❌ Отмена",
+                callback_data="back_to_menu"
+            )]
+        ])
+    )
+    await callback.answer()
+
+@router.message(F.text, StateFilter(DocumentStates.waiting_for_income))
+async def handle_monthly_income(message: Message, state: FSMContext):
+    """Доход клиента"""
+    
+    monthly_income = parse_rubles(message.text)
+    if not monthly_income:
+        await message.answer(MESSAGES["error_wrong_amount"])
+        return
+    
+    await state.update_data(monthly_income=monthly_income)
+    await state.set_state(DocumentStates.waiting_for_loan_amount)
+    await message.answer(MESSAGES["ask_loan_amount"])
+
+@router.message(F.text, StateFilter(DocumentStates.waiting_for_loan_amount))
+async def handle_loan_amount(message: Message, state: FSMContext, user: User):
+    """Сумма запрашиваемого кредита; доход и сумма сохраняются в заявку"""
+    
+    loan_amount = parse_rubles(message.text)
+    if loan_amount is None:
+        await message.answer(MESSAGES["error_wrong_amount"])
+        return
+    
+    state_data = await state.get_data()
+    monthly_income = state_data["monthly_income"]
+    
+    application = await application_service.get_user_application(user.id)
+    if not application:
+        application = await application_service.create_application(user)
+    await application_service.update_loan_parameters(application.id, monthly_income, loan_amount or None)
+    
+    # ПДН считается при диагностике: если отчеты уже есть, пересчитываем ее
+    diagnosis_note = "📋 Загрузите отчеты БКИ - ПДН будет рассчитан при диагностике."
+    try:
+        if await application_service.check_documents_ready_for_diagnosis(application.id):
+            await diagnosis_queue.enqueue(application.id)
+            diagnosis_note = "🔍 Диагностика будет выполнена с учетом этих данных, мы пришлем уведомление."
+    except Exception as e:
+        logger.error(f"Ошибка постановки диагностики в очередь: {e}")
+    
+    await state.clear()
+    await message.answer(
+        MESSAGES["loan_parameters_saved"].format(
+            monthly_income=f"{monthly_income:,.0f}".replace(",", " "),
+            loan_amount=f"{loan_amount:,.0f} ₽".replace(",", " ") if loan_amount else "не планируется",
+            diagnosis_note=diagnosis_note
+        ),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(
+                text="📊 Проверить статус",
+                callback_data="check_status"
+            )],
+            [InlineKeyboardButton(
+                text="🏠 Главное меню",
+                callback_data="back_to_menu"
+            )]
+        ])
+    )
+
 @router.callback_query(F.data.startswith("view_doc_"))
 async def view_document_details(callback: CallbackQuery, user: User):
     """Просмотр деталей документа"""
@@ -1,10 +1,9 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 import logging
-import json
 from datetime import datetime
 
-from database.models import User, ApplicationStatus
+from database.models import User, ApplicationStatus, BlockSeverity
 from services.application_service import ApplicationService
 from services.user_service import UserService
 from bot.keyboards.inline import get_status_keyboard, get_back_button
@@ -76,13 +75,13 @@ async def check_application_status(callback: CallbackQuery, user: User):
             text += f"\n🏦 Целевой банк: {application.target_bank}"
         
         # Добавляем информацию о результатах диагностики
-        if application.status == ApplicationStatus.DIAGNOSIS_COMPLETED and application.diagnosis_result:
+        if application.status == ApplicationStatus.DIAGNOSIS_COMPLETED and application.has_diagnosis_result:
             text += "\n\n✅ GPT диагностика завершена! Результаты готовы к просмотру."
         
         # Передаем информацию о наличии результатов диагностики
         has_diagnosis_results = (
             application.status == ApplicationStatus.DIAGNOSIS_COMPLETED and 
-            application.diagnosis_result is not None
+            application.has_diagnosis_result
         )
         keyboard = get_status_keyboard(has_diagnosis_results)
     
@@ -123,7 +122,7 @@ async def show_detailed_status(callback: CallbackQuery, user: User):
         await callback.answer("❌ Необходимо зарегистрироваться", show_alert=True)
         return
     
-    application = await application_service.get_user_application(user.id)
+    application = await application_service.get_user_application(user.id, with_results=True)
     
     if not application:
         await callback.answer("❌ Активная заявка не найдена", show_alert=True)
@@ -152,7 +151,7 @@ async def show_detailed_status(callback: CallbackQuery, user: User):
     
     # Показываем результаты диагностики если есть
     if (application.status == ApplicationStatus.DIAGNOSIS_COMPLETED and 
-        application.diagnosis_result):
+        application.has_diagnosis_result):
         text += "\n\n✅ Результаты диагностики готовы!"
         
         if application.recommendations:
@@ -190,7 +189,7 @@ async def view_diagnosis_results(callback: CallbackQuery, user: User):
         await callback.answer("❌ Необходимо зарегистрироваться", show_alert=True)
         return
     
-    application = await application_service.get_user_application(user.id)
+    application = await application_service.get_user_application(user.id, with_results=True)
     
     if not application or application.status != ApplicationStatus.DIAGNOSIS_COMPLETED:
         await callback.answer("❌ Результаты диагностики не готовы", show_alert=True)
@@ -312,7 +311,8 @@ async def confirm_submit_applications(callback: CallbackQuery, user: User):
         application.id,
         ApplicationStatus.APPLICATIONS_SENT,
         "Заявления поданы в БКИ пользователем",
-        "user"
+        "user",
+        expected_version=application.version
     )
     
     if success:
@@ -369,45 +369,34 @@ async def view_gpt_diagnosis_results(callback: CallbackQuery, user: User):
     
     application = await application_service.get_user_application(user.id)
     
-    if not application or not application.diagnosis_result:
+    if not application or not application.has_diagnosis_result:
         await callback.answer("❌ Результаты диагностики не найдены", show_alert=True)
         return
     
     try:
-        # Парсим результаты диагностики
-        diagnosis_data = json.loads(application.diagnosis_result)
+        # Блоки диагностики - небольшие строки таблицы, без разбора всего результата
+        blocks = await application_service.get_diagnosis_blocks(application.id)
         
         # Формируем красивое сообщение
         text = "🤖 **РЕЗУЛЬТАТЫ GPT ДИАГНОСТИКИ**\n\n"
         
-        # Добавляем информацию о блоках
-        blocks = diagnosis_data.get("blocks", {})
+        # Добавляем информацию о блоках с ошибками
+        problems = [
+            block for block in blocks
+            if block.severity in (BlockSeverity.CRITICAL, BlockSeverity.WARNING)
+        ]
         
-        if blocks:
+        if problems:
             text += "📋 **НАЙДЕННЫЕ ОШИБКИ:**\n\n"
             
-            for block_name, block_content in blocks.items():
-                if "ошибок не выявлено" not in block_content.lower():
-                    # Определяем критичность
-                    if "🟥" in block_content:
-                        criticality = "🟥 КРИТИЧНО"
-                    elif "🟨" in block_content:
-                        criticality = "🟨 ВАЖНО"
-                    else:
-                        criticality = "🟩 НЕЗНАЧИТЕЛЬНО"
-                    
-                    text += f"▫️ {block_name}\n"
-                    text += f"   {criticality}\n\n"
+            for block in problems:
+                criticality = "🟥 КРИТИЧНО" if block.severity == BlockSeverity.CRITICAL else "🟨 ВАЖНО"
+                text += f"▫️ Блок {block.block_number}. {block.title}\n"
+                text += f"   {criticality}\n\n"
         
         # Добавляем дату анализа
-        parsed_at = diagnosis_data.get("parsed_at", "")
-        if parsed_at:
-            try:
-                date_obj = datetime.fromisoformat(parsed_at.replace('Z', '+00:00'))
-                formatted_date = date_obj.strftime("%d.%m.%Y %H:%M")
-                text += f"🕐 Анализ: {formatted_date}\n\n"
-            except:
-                pass
+        if blocks:
+            text += f"🕐 Анализ: {blocks[0].created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
         
         # Добавляем призыв к действию
         text += "💼 **Нужна помощь в исправлении ошибок?**\n"
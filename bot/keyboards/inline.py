@@ -99,6 +99,12 @@ def get_document_upload_keyboard() -> InlineKeyboardMarkup:
                 callback_data="upload_other"
             )
         ],
+        [
+            InlineKeyboardButton(
+                text="💰 Доход и сумма кредита", 
+                callback_data="set_loan_parameters"
+            )
+        ],
         [
             InlineKeyboardButton(
                 text="🔙 Назад в меню", 
@@ -4,6 +4,7 @@ from aiogram.types import TelegramObject, Message, CallbackQuery
 import logging
 
 from services.user_service import UserService
+from services.activity_tracker import activity_tracker
 
 logger = logging.getLogger(__name__)
 
@@ -27,15 +28,15 @@ class AuthMiddleware(BaseMiddleware):
             user_id = event.from_user.id
         
         if user_id:
-            # Получаем пользователя из БД
-            user = await self.user_service.get_user_by_telegram_id(user_id)
+            # Получаем пользователя (через кэш, при промахе - из БД)
+            user = await self.user_service.get_cached_user_by_telegram_id(user_id)
             
             # Добавляем пользователя в контекст
             data["user"] = user
             
-            # Если пользователь существует, обновляем время последней активности
+            # Если пользователь существует, отмечаем активность (запишется пачкой)
             if user:
-                await self.user_service.update_last_activity(user.id)
+                activity_tracker.touch(user.id)
                 
                 # Проверяем, активен ли пользователь
                 if not user.is_active:
@@ -0,0 +1,57 @@
+"""Границы транзакций апдейта Telegram
+
+DbSessionMiddleware открывает одну unit of work на апдейт, а
+CommitBeforeRequestMiddleware коммитит ее перед каждым запросом к Telegram.
+Это осознанный компромисс: атомарен не весь апдейт, а каждый участок
+хэндлера между запросами к Telegram. Если хэндлер упал после отправки
+сообщения, изменения, записанные до этой отправки, остаются в базе
+(пользователь уже видел ответ о них), откатывается только хвост после
+последнего запроса. Взамен единственное соединение записи SQLite не
+удерживается на время сетевых вызовов. Хэндлеры, которым нужна
+атомарность нескольких записей, делают их без запросов к Telegram между ними.
+"""
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod, Response
+from aiogram.types import TelegramObject
+import logging
+
+from database.database import get_db_session, commit_unit_of_work
+
+logger = logging.getLogger(__name__)
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Middleware: одна сессия БД (unit of work) на весь апдейт"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        
+        # Все get_db_session() внутри апдейта используют эту сессию; коммит
+        # по завершении обработки и перед каждым запросом к Telegram
+        async with get_db_session() as session:
+            data["db_session"] = session
+            return await handler(event, data)
+
+class CommitBeforeRequestMiddleware(BaseRequestMiddleware):
+    """Middleware запросов к Telegram: коммит unit of work перед сетевым вызовом
+    
+    Иначе транзакция апдейта (а в SQLite - единственное соединение записи)
+    удерживается, пока идет запрос к Telegram, и пользователь получает
+    ответ раньше, чем изменения записаны. Цена - апдейт коммитится
+    частями, см. описание модуля.
+    """
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Response:
+        
+        await commit_unit_of_work()
+        return await make_request(bot, method)
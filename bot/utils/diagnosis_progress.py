@@ -0,0 +1,118 @@
+import asyncio
+from typing import Optional, Dict, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from services.chunk_planner import BLOCK_TITLES, SEVERITY
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DiagnosisProgress:
+    """Одно сообщение с ходом диагностики, которое дополняется по мере ответа GPT
+    
+    Обновления блоков приходят из потока модели часто, а Telegram
+    ограничивает частоту правок сообщения, поэтому правки сливаются:
+    не чаще одной за min_interval, в сообщение попадает последнее состояние.
+    """
+    
+    def __init__(self, bot: Bot, chat_id: int, min_interval: float):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        
+        self.blocks: Dict[int, Tuple[str, Optional[str]]] = {}
+        self.finished = False
+        self.superseded = False
+        
+        self._message_id: Optional[int] = None
+        self._rendered: Optional[str] = None
+        self._last_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        self.edits = 0
+        self.coalesced = 0
+    
+    def _render(self) -> str:
+        if self.superseded:
+            header = "🔄 Загружены новые документы, диагностика начнется заново"
+        elif self.finished:
+            header = "✅ Анализ завершен"
+        else:
+            header = "🔍 Идет диагностика кредитной истории..."
+        lines = [header, "", f"Готово блоков: {len(self.blocks)} из {len(BLOCK_TITLES)}", ""]
+        
+        for number in sorted(set(BLOCK_TITLES) | set(self.blocks)):
+            if number in self.blocks:
+                title, severity = self.blocks[number]
+                lines.append(f"{severity or '⬜'} Блок {number}. {title}")
+            else:
+                lines.append(f"⏳ Блок {number}. {BLOCK_TITLES.get(number, '')}")
+        
+        return "\n".join(lines)
+    
+    async def start(self):
+        """Отправить сообщение о ходе диагностики"""
+        text = self._render()
+        message = await self.bot.send_message(self.chat_id, text)
+        self._message_id = message.message_id
+        self._rendered = text
+        self._last_edit = asyncio.get_running_loop().time()
+    
+    def on_block(self, number: int, title: str, severity: Optional[str]):
+        """Блок готов в одной из частей анализа; берем самую высокую критичность"""
+        previous = self.blocks.get(number)
+        if previous and previous[1] and (not severity or SEVERITY.index(previous[1]) < SEVERITY.index(severity)):
+            severity = previous[1]
+        
+        self.blocks[number] = (BLOCK_TITLES.get(number) or title, severity)
+        self._schedule()
+    
+    def _schedule(self):
+        if self._message_id is None:
+            return
+        if self._flush_task and not self._flush_task.done():
+            # Правка уже запланирована и покажет последнее состояние
+            self.coalesced += 1
+            return
+        self._flush_task = asyncio.create_task(self._flush())
+    
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            await asyncio.sleep(max(0.0, self._last_edit + self.min_interval - loop.time()))
+            
+            text = self._render()
+            if text == self._rendered:
+                return
+            
+            try:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self._message_id)
+            except TelegramRetryAfter as e:
+                # Telegram сам сообщает, сколько ждать до следующей правки
+                self._last_edit = loop.time() + e.retry_after
+                continue
+            except TelegramBadRequest as e:
+                # Например, сообщение удалено пользователем
+                logger.warning(f"Не удалось обновить ход диагностики: {e}")
+                return
+            
+            self._rendered = text
+            self._last_edit = loop.time()
+            self.edits += 1
+    
+    async def supersede(self):
+        """Анализ прерван новой загрузкой: его результат больше не нужен"""
+        self.superseded = True
+        await self.finish()
+    
+    async def finish(self):
+        """Показать итоговое состояние, дождавшись запланированной правки"""
+        self.finished = True
+        if self._message_id is None:
+            return
+        if not self._flush_task or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        await self._flush_task
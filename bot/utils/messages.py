@@ -163,6 +163,51 @@ MESSAGES = {
 
 💯 Гарантируем конфиденциальность!""",
 
+    # Диагностика
+    "diagnosis_queued": """✅ Документ загружен! 🤖 Диагностика поставлена в очередь!
+
+📄 Файл: {file_name}
+📊 Размер: {size} МБ
+📋 Тип: {file_type}
+
+🔍 GPT проанализирует вашу кредитную историю.
+📊 Ход анализа по блокам появится отдельным сообщением.
+🔔 Мы пришлем уведомление, как только результаты будут готовы.""",
+
+    "ask_monthly_income": """💰 ДОХОД И СУММА КРЕДИТА
+
+По этим данным рассчитывается показатель долговой нагрузки (ПДН),
+который банки проверяют при выдаче кредита.
+
+Введите ваш ежемесячный доход после налогов в рублях, например: 85000""",
+
+    "ask_loan_amount": """💳 Введите сумму кредита, который вы планируете получить, в рублях.
+
+Если новый кредит не планируется, отправьте 0.""",
+
+    "loan_parameters_saved": """✅ Данные сохранены
+
+💰 Доход: {monthly_income} ₽ в месяц
+💳 Сумма кредита: {loan_amount}
+
+{diagnosis_note}""",
+
+    "add_income_hint": "\n\n💰 Укажите доход и сумму кредита, чтобы диагностика рассчитала долговую нагрузку (ПДН).",
+
+    "error_wrong_amount": "❌ Не удалось распознать сумму. Отправьте число в рублях, например: 85000",
+
+    "diagnosis_ready": """🎉 Диагностика кредитной истории завершена!
+
+📋 Заявка #{application_id}
+📄 Проанализировано отчетов: {documents}
+
+Результаты уже доступны для просмотра.""",
+
+    "diagnosis_failed": """😔 Не удалось выполнить диагностику по заявке #{application_id}.
+
+Мы уже знаем о проблеме. Попробуйте загрузить отчеты еще раз
+или обратитесь в поддержку.""",
+
     # Ошибки
     "error_no_permission": """❌ Недостаточно прав для выполнения действия.
 
@@ -19,6 +19,21 @@ class Settings:
     # База данных
     DATABASE_URL: str = "sqlite+aiosqlite:///bot.db"
     
+    # SQLite (продакшен-профиль: WAL, пул чтения, одно соединение записи)
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_MMAP_SIZE_MB: int = 256
+    SQLITE_CACHE_SIZE_MB: int = 64
+    SQLITE_READ_POOL_SIZE: int = 5
+    SQLITE_WRITE_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    
+    # PostgreSQL (asyncpg)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_STATEMENT_TIMEOUT_MS: int = 30000
+    DB_IDLE_IN_TRANSACTION_TIMEOUT_MS: int = 60000
+    
     # AmoCRM
     AMOCRM_SUBDOMAIN: str = ""
     AMOCRM_CLIENT_ID: str = ""
@@ -36,6 +51,14 @@ class Settings:
     
     # OpenAI GPT
     OPENAI_API_KEY: Optional[str] = None
+    OPENAI_BASE_URL: Optional[str] = None
+    OPENAI_TIMEOUT_SECONDS: float = 120.0
+    OPENAI_MAX_RETRIES: int = 5
+    OPENAI_RETRY_BACKOFF_SECONDS: float = 1.0
+    OPENAI_RPM_LIMIT: int = 500
+    OPENAI_TPM_LIMIT: int = 150000
+    OPENAI_MAX_CONCURRENCY: int = 8
+    OPENAI_MAX_CONNECTIONS: int = 20
     
     # Безопасность
     ENCRYPTION_KEY: str = "your-secret-key-here"
@@ -44,10 +67,56 @@ class Settings:
     LOG_LEVEL: str = "INFO"
     LOG_FILE: str = "bot.log"
     
+    # Очередь диагностики
+    DIAGNOSIS_WORKERS: int = 2
+    DIAGNOSIS_POLL_INTERVAL_SECONDS: float = 5.0
+    DIAGNOSIS_VISIBILITY_TIMEOUT_SECONDS: float = 300.0
+    DIAGNOSIS_MAX_ATTEMPTS: int = 3
+    DIAGNOSIS_RETRY_BACKOFF_SECONDS: float = 30.0
+    DIAGNOSIS_DEBOUNCE_SECONDS: float = 20.0
+    
+    # Извлечение текста из PDF
+    PDF_WORKERS: int = 2
+    PDF_PAGES_PER_TASK: int = 16
+    PDF_EXTRACT_TIMEOUT_SECONDS: float = 60.0
+    
+    # Удаление шаблонного текста отчетов перед GPT
+    BOILERPLATE_MIN_PAGE_SHARE: float = 0.5
+    BOILERPLATE_MIN_DOCUMENTS: int = 3
+    
+    # Кэш ответов GPT
+    LLM_CACHE_TTL_HOURS: float = 24.0
+    LLM_CACHE_MAX_ENTRIES: int = 1000
+    
+    # Разбиение отчетов на части для GPT
+    GPT_CHUNK_MAX_TOKENS: int = 20000
+    GPT_MAX_CONCURRENCY: int = 3
+    
+    # Потоковый ответ GPT и ход диагностики в Telegram
+    GPT_STREAMING: bool = True
+    PROGRESS_EDIT_INTERVAL_SECONDS: float = 3.0
+    
+    # Оценка платежей для расчета ПДН
+    PDN_ANNUAL_RATE: float = 0.2
+    PDN_TERM_MONTHS: int = 60
+    
     # Настройки бота
     MAX_FILE_SIZE_MB: int = 20
     SESSION_TIMEOUT_HOURS: int = 24
     
+    # Кэш пользователей в AuthMiddleware
+    USER_CACHE_MAX_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: int = 60
+    
+    # Отложенная запись last_activity
+    ACTIVITY_FLUSH_INTERVAL_SECONDS: float = 30.0
+    ACTIVITY_MAX_STALENESS_SECONDS: float = 60.0
+    
+    # Очередь записи логов действий (UserLog)
+    LOG_SINK_QUEUE_SIZE: int = 10000
+    LOG_SINK_BATCH_SIZE: int = 200
+    LOG_SINK_FLUSH_INTERVAL_SECONDS: float = 1.0
+    
     @classmethod
     def from_env(cls) -> 'Settings':
         """Загрузка настроек из переменных окружения"""
@@ -57,6 +126,17 @@ class Settings:
             
             # База данных
             DATABASE_URL=os.getenv("DATABASE_URL", "sqlite+aiosqlite:///bot.db"),
+            SQLITE_BUSY_TIMEOUT_MS=int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+            SQLITE_MMAP_SIZE_MB=int(os.getenv("SQLITE_MMAP_SIZE_MB", "256")),
+            SQLITE_CACHE_SIZE_MB=int(os.getenv("SQLITE_CACHE_SIZE_MB", "64")),
+            SQLITE_READ_POOL_SIZE=int(os.getenv("SQLITE_READ_POOL_SIZE", "5")),
+            SQLITE_WRITE_QUEUE_TIMEOUT_SECONDS=float(os.getenv("SQLITE_WRITE_QUEUE_TIMEOUT_SECONDS", "30")),
+            DB_POOL_SIZE=int(os.getenv("DB_POOL_SIZE", "10")),
+            DB_MAX_OVERFLOW=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            DB_POOL_TIMEOUT_SECONDS=float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30")),
+            DB_STATEMENT_CACHE_SIZE=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+            DB_STATEMENT_TIMEOUT_MS=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000")),
+            DB_IDLE_IN_TRANSACTION_TIMEOUT_MS=int(os.getenv("DB_IDLE_IN_TRANSACTION_TIMEOUT_MS", "60000")),
             
             # AmoCRM
             AMOCRM_SUBDOMAIN=os.getenv("AMOCRM_SUBDOMAIN", ""),
@@ -75,15 +155,69 @@ class Settings:
             
             # OpenAI
             OPENAI_API_KEY=os.getenv("OPENAI_API_KEY"),
+            OPENAI_BASE_URL=os.getenv("OPENAI_BASE_URL") or None,
+            OPENAI_TIMEOUT_SECONDS=float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120")),
+            OPENAI_MAX_RETRIES=int(os.getenv("OPENAI_MAX_RETRIES", "5")),
+            OPENAI_RETRY_BACKOFF_SECONDS=float(os.getenv("OPENAI_RETRY_BACKOFF_SECONDS", "1")),
+            OPENAI_RPM_LIMIT=int(os.getenv("OPENAI_RPM_LIMIT", "500")),
+            OPENAI_TPM_LIMIT=int(os.getenv("OPENAI_TPM_LIMIT", "150000")),
+            OPENAI_MAX_CONCURRENCY=int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")),
+            OPENAI_MAX_CONNECTIONS=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
             
             # Безопасность
             ENCRYPTION_KEY=os.getenv("ENCRYPTION_KEY", "your-secret-key-here"),
             
+            # Очередь диагностики
+            DIAGNOSIS_WORKERS=int(os.getenv("DIAGNOSIS_WORKERS", "2")),
+            DIAGNOSIS_POLL_INTERVAL_SECONDS=float(os.getenv("DIAGNOSIS_POLL_INTERVAL_SECONDS", "5")),
+            DIAGNOSIS_VISIBILITY_TIMEOUT_SECONDS=float(os.getenv("DIAGNOSIS_VISIBILITY_TIMEOUT_SECONDS", "300")),
+            DIAGNOSIS_MAX_ATTEMPTS=int(os.getenv("DIAGNOSIS_MAX_ATTEMPTS", "3")),
+            DIAGNOSIS_RETRY_BACKOFF_SECONDS=float(os.getenv("DIAGNOSIS_RETRY_BACKOFF_SECONDS", "30")),
+            DIAGNOSIS_DEBOUNCE_SECONDS=float(os.getenv("DIAGNOSIS_DEBOUNCE_SECONDS", "20")),
+            
+            # Извлечение текста из PDF
+            PDF_WORKERS=int(os.getenv("PDF_WORKERS", "2")),
+            PDF_PAGES_PER_TASK=int(os.getenv("PDF_PAGES_PER_TASK", "16")),
+            PDF_EXTRACT_TIMEOUT_SECONDS=float(os.getenv("PDF_EXTRACT_TIMEOUT_SECONDS", "60")),
+            
+            # Удаление шаблонного текста отчетов перед GPT
+            BOILERPLATE_MIN_PAGE_SHARE=float(os.getenv("BOILERPLATE_MIN_PAGE_SHARE", "0.5")),
+            BOILERPLATE_MIN_DOCUMENTS=int(os.getenv("BOILERPLATE_MIN_DOCUMENTS", "3")),
+            
+            # Кэш ответов GPT
+            LLM_CACHE_TTL_HOURS=float(os.getenv("LLM_CACHE_TTL_HOURS", "24")),
+            LLM_CACHE_MAX_ENTRIES=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+            
+            # Разбиение отчетов на части для GPT
+            GPT_CHUNK_MAX_TOKENS=int(os.getenv("GPT_CHUNK_MAX_TOKENS", "20000")),
+            GPT_MAX_CONCURRENCY=int(os.getenv("GPT_MAX_CONCURRENCY", "3")),
+            
+            # Потоковый ответ GPT и ход диагностики в Telegram
+            GPT_STREAMING=os.getenv("GPT_STREAMING", "true").lower() == "true",
+            PROGRESS_EDIT_INTERVAL_SECONDS=float(os.getenv("PROGRESS_EDIT_INTERVAL_SECONDS", "3")),
+            
+            # Оценка платежей для расчета ПДН
+            PDN_ANNUAL_RATE=float(os.getenv("PDN_ANNUAL_RATE", "0.2")),
+            PDN_TERM_MONTHS=int(os.getenv("PDN_TERM_MONTHS", "60")),
+            
             # Настройки
             LOG_LEVEL=os.getenv("LOG_LEVEL", "INFO"),
             LOG_FILE=os.getenv("LOG_FILE", "bot.log"),
             MAX_FILE_SIZE_MB=int(os.getenv("MAX_FILE_SIZE_MB", "20")),
             SESSION_TIMEOUT_HOURS=int(os.getenv("SESSION_TIMEOUT_HOURS", "24")),
+            
+            # Кэш пользователей
+            USER_CACHE_MAX_SIZE=int(os.getenv("USER_CACHE_MAX_SIZE", "10000")),
+            USER_CACHE_TTL_SECONDS=int(os.getenv("USER_CACHE_TTL_SECONDS", "60")),
+            
+            # last_activity
+            ACTIVITY_FLUSH_INTERVAL_SECONDS=float(os.getenv("ACTIVITY_FLUSH_INTERVAL_SECONDS", "30")),
+            ACTIVITY_MAX_STALENESS_SECONDS=float(os.getenv("ACTIVITY_MAX_STALENESS_SECONDS", "60")),
+            
+            # Очередь логов
+            LOG_SINK_QUEUE_SIZE=int(os.getenv("LOG_SINK_QUEUE_SIZE", "10000")),
+            LOG_SINK_BATCH_SIZE=int(os.getenv("LOG_SINK_BATCH_SIZE", "200")),
+            LOG_SINK_FLUSH_INTERVAL_SECONDS=float(os.getenv("LOG_SINK_FLUSH_INTERVAL_SECONDS", "1")),
         )
 
 def get_settings() -> Settings:
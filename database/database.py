@@ -1,67 +1,267 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base
-from contextlib import asynccontextmanager
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine, async_sessionmaker
+from sqlalchemy.orm import declarative_base, Session
+from sqlalchemy.sql.dml import UpdateBase
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
 import logging
 
-from config.settings import get_settings
+from config.settings import get_settings, Settings
 from .models import Base
+from .migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
 # Глобальные переменные для движка и сессии
 engine = None
+read_engine = None  # Отдельный пул чтения (SQLite), иначе совпадает с engine
 async_session_maker = None
 
+# Текущая сессия (unit of work): вложенные get_db_session() используют ее
+# с точкой сохранения, поэтому один апдейт Telegram выполняется в одной транзакции
+_current_session: ContextVar[Optional[AsyncSession]] = ContextVar("current_db_session", default=None)
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def is_postgres(url: str) -> bool:
+    return url.startswith("postgresql+asyncpg")
+
+class RoutingSession(Session):
+    """Сессия, направляющая чтение в пул чтения, а запись - в единственное соединение записи
+    
+    После первой записи сессия до конца транзакции остается на соединении записи,
+    чтобы видеть собственные незакоммиченные изменения.
+    """
+    
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if read_engine is None or read_engine is engine:
+            return engine.sync_engine
+        
+        if self.info.get("writer") or self._flushing or isinstance(clause, UpdateBase):
+            self.info["writer"] = True
+            return engine.sync_engine
+        
+        return read_engine.sync_engine
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _reset_writer_flag(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writer", None)
+
+def _install_sqlite_pragmas(target: AsyncEngine, settings: Settings, query_only: bool = False):
+    """Прагмы SQLite на каждое новое соединение"""
+    
+    @event.listens_for(target.sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+        # Отрицательное значение - размер в КиБ
+        cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_MB * 1024}")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+def _install_sqlite_transactions(target: AsyncEngine):
+    """Транзакции SQLite под управлением SQLAlchemy
+    
+    Драйвер sqlite3 сам решает, когда начинать транзакцию, и ломает точки
+    сохранения; отключаем это и начинаем транзакцию явно.
+    """
+    
+    @event.listens_for(target.sync_engine, "connect")
+    def _disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(target.sync_engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+def _create_sqlite_engines(settings: Settings):
+    """SQLite: WAL, одно соединение записи (сериализация писателей) и пул чтения"""
+    connect_args = {"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+    
+    write = create_async_engine(
+        settings.DATABASE_URL,
+        echo=False,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        # Писатели ждут своей очереди на соединение, а не получают "database is locked"
+        pool_timeout=settings.SQLITE_WRITE_QUEUE_TIMEOUT_SECONDS,
+        connect_args=connect_args,
+    )
+    _install_sqlite_pragmas(write, settings)
+    _install_sqlite_transactions(write)
+    
+    # In-memory база не разделяется между соединениями
+    if ":memory:" in settings.DATABASE_URL:
+        return write, write
+    
+    read = create_async_engine(
+        settings.DATABASE_URL,
+        echo=False,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=settings.SQLITE_READ_POOL_SIZE,
+        max_overflow=0,
+        connect_args=connect_args,
+    )
+    _install_sqlite_pragmas(read, settings, query_only=True)
+    _install_sqlite_transactions(read)
+    
+    return write, read
+
+def _create_postgres_engine(settings: Settings) -> AsyncEngine:
+    """PostgreSQL/asyncpg: размер пула, кэш подготовленных выражений, таймауты"""
+    return create_async_engine(
+        settings.DATABASE_URL,
+        echo=False,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        connect_args={
+            # Кэш подготовленных выражений на соединение (0 - для pgbouncer в режиме transaction)
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {
+                "statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS),
+                "idle_in_transaction_session_timeout": str(settings.DB_IDLE_IN_TRANSACTION_TIMEOUT_MS),
+                "application_name": "credit_history_bot",
+            },
+        },
+    )
+
 async def init_db():
     """Инициализация базы данных"""
-    global engine, async_session_maker
+    global engine, read_engine, async_session_maker
     
     settings = get_settings()
     
     # Создание движка
-    engine = create_async_engine(
-        settings.DATABASE_URL,
-        echo=False,  # Логирование SQL запросов
-        pool_pre_ping=True,
-        pool_recycle=300,
-    )
+    if is_sqlite(settings.DATABASE_URL):
+        engine, read_engine = _create_sqlite_engines(settings)
+    elif is_postgres(settings.DATABASE_URL):
+        engine = _create_postgres_engine(settings)
+        read_engine = engine
+    else:
+        engine = create_async_engine(
+            settings.DATABASE_URL,
+            echo=False,  # Логирование SQL запросов
+            pool_pre_ping=True,
+            pool_recycle=300,
+        )
+        read_engine = engine
     
     # Создание фабрики сессий
     async_session_maker = async_sessionmaker(
-        engine,
         class_=AsyncSession,
+        sync_session_class=RoutingSession,
         expire_on_commit=False
     )
     
-    # Создание таблиц
+    # Создание таблиц и применение миграций
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        applied = await conn.run_sync(run_migrations)
+    
+    if applied:
+        logger.info(f"Применено миграций: {applied}")
     
     logger.info("База данных инициализирована")
 
 async def close_db():
     """Закрытие соединения с базой данных"""
-    global engine
+    global engine, read_engine
+    if read_engine is not None and read_engine is not engine:
+        await read_engine.dispose()
     if engine:
         await engine.dispose()
         logger.info("Соединение с БД закрыто")
 
+async def _commit(session: AsyncSession):
+    """Закоммитить сессию и выполнить накопленные after-commit обработчики"""
+    await session.commit()
+    
+    callbacks = session.info.get("after_commit", [])
+    session.info["after_commit"] = []
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Ошибка after-commit обработчика: {e}")
+
 @asynccontextmanager
 async def get_db_session():
-    """Контекстный менеджер для получения сессии БД"""
+    """Контекстный менеджер для получения сессии БД
+    
+    Если сессия уже открыта выше по стеку (unit of work), возвращается она,
+    а коммит выполняет внешний блок. Поэтому внутри используем flush(), а не commit().
+    Вложенный блок выполняется в точке сохранения: ошибка, перехваченная
+    вызывающим кодом, откатывает только этот блок, и сессия остается рабочей.
+    """
+    session = _current_session.get()
+    if session is not None:
+        callbacks = session.info.setdefault("after_commit", [])
+        mark = len(callbacks)
+        try:
+            async with session.begin_nested():
+                yield session
+        except Exception:
+            # Обработчики откатившегося блока не выполняются
+            del callbacks[mark:]
+            raise
+        return
+    
     if not async_session_maker:
         raise RuntimeError("База данных не инициализирована")
     
     async with async_session_maker() as session:
+        token = _current_session.set(session)
+        session.info["after_commit"] = []
         try:
             yield session
-            await session.commit()
+            await _commit(session)
         except Exception:
             await session.rollback()
             raise
         finally:
+            _current_session.reset(token)
             await session.close()
 
+def call_after_commit(callback: Callable[[], None]):
+    """Выполнить callback после коммита текущей unit of work (или сразу, если ее нет)"""
+    session = _current_session.get()
+    if session is None:
+        callback()
+    else:
+        session.info.setdefault("after_commit", []).append(callback)
+
+async def commit_unit_of_work():
+    """Досрочно закоммитить текущую unit of work (перед сетевыми вызовами и долгими операциями)
+    
+    Внутри вложенного блока коммит откладывается до внешнего: точку
+    сохранения нельзя закрыть раньше блока.
+    """
+    session = _current_session.get()
+    if session is None or not session.in_transaction() or session.in_nested_transaction():
+        return
+    await _commit(session)
+
+@contextmanager
+def outside_unit_of_work():
+    """Выполнить блок в собственных коротких сессиях, вне текущей unit of work"""
+    token = _current_session.set(None)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
 async def get_session() -> AsyncSession:
     """Получить сессию БД (для dependency injection)"""
     if not async_session_maker:
@@ -0,0 +1,227 @@
+"""Версионные миграции схемы, применяемые при старте.
+
+create_all создает только отсутствующие таблицы, поэтому новые индексы
+и колонки в существующих базах добавляются здесь. Каждая миграция
+идемпотентна: на свежей базе, где create_all уже все создал, она
+ничего не меняет и лишь отмечается как примененная.
+"""
+import json
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import inspect, select, text, or_, type_coerce, Text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn
+
+from .models import Base, SchemaMigration, Application, DiagnosisBlock, BlockSeverity, CompressedText
+import logging
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+def create_indexes(conn: Connection, table_name: str, index_names: List[str]):
+    """Создать индексы модели, если их еще нет"""
+    table = Base.metadata.tables[table_name]
+    for index in table.indexes:
+        if index.name in index_names:
+            index.create(conn, checkfirst=True)
+
+def add_column(conn: Connection, table_name: str, column_name: str):
+    """Добавить колонку модели, если ее еще нет"""
+    columns = {c["name"] for c in inspect(conn).get_columns(table_name)}
+    if column_name in columns:
+        return
+    
+    # Тип, DEFAULT (строковый - в кавычках) и NOT NULL компилирует диалект,
+    # как в CREATE TABLE
+    column = Base.metadata.tables[table_name].c[column_name]
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+
+def _composite_indexes(conn: Connection):
+    """Индексы под горячие запросы (фильтр + сортировка)"""
+    create_indexes(conn, "user_logs", ["ix_user_logs_user_created"])
+    create_indexes(conn, "documents", ["ix_documents_user_type_uploaded"])
+    create_indexes(conn, "applications", ["ix_applications_user_status_created"])
+    create_indexes(conn, "referral_clicks", [
+        "ix_referral_clicks_ref_telegram_clicked",
+        "ix_referral_clicks_broker_clicked"
+    ])
+    create_indexes(conn, "status_history", ["ix_status_history_application_created"])
+
+def _application_versioning(conn: Connection):
+    """Версия и предыдущий статус заявки для атомарных переходов"""
+    add_column(conn, "applications", "previous_status")
+    add_column(conn, "applications", "version")
+
+def _document_content_hash(conn: Connection):
+    """Хэш содержимого документа для кэша извлеченного текста"""
+    add_column(conn, "documents", "content_hash")
+    create_indexes(conn, "documents", ["ix_documents_content_hash"])
+
+def _document_tradelines(conn: Connection):
+    """Разобранные записи о кредитах из отчетов БКИ"""
+    add_column(conn, "documents", "tradelines")
+
+def _application_monthly_income(conn: Connection):
+    """Ежемесячный доход клиента для расчета ПДН"""
+    add_column(conn, "applications", "monthly_income")
+
+# Разбор текстового отчета в том виде, в каком он хранился до миграции 6;
+# зафиксирован здесь, чтобы правки разбора в сервисах не меняли миграцию
+_V6_BLOCK_TITLES = {
+    1: "Ошибки в титуле",
+    2: "Ошибки в реквизитах",
+    3: "Контактные данные",
+    4: "Незакрытые счета",
+    5: "Плохие счета (МФО, ЖКХ, коллекторы)",
+    6: "Разночтения между БКИ",
+    7: "Ошибки в платёжной дисциплине",
+    8: "Задвоение счетов",
+    9: "Необнулённые счета",
+    10: "Стоп-комментарии",
+    11: "Неверные параметры договоров",
+    12: "Незаконные запросы",
+}
+_V6_SEVERITY = ["🟥", "🟨", "🟩"]
+_V6_BLOCK_HEADER = re.compile(r"^\s*Блок\s+(\d+)\s*\.?\s*(.*)$")
+
+def _v6_parse_report(response: str) -> Dict[int, Tuple[str, Optional[str], List[str]]]:
+    """Блоки отчета «Блок X. Название / Критичность: ...»: номер -> (название, критичность, находки)"""
+    blocks: Dict[int, Tuple[str, List[str]]] = {}
+    current: Optional[int] = None
+    
+    for line in response.split("\n"):
+        match = _V6_BLOCK_HEADER.match(line)
+        if match:
+            current = int(match.group(1))
+            blocks.setdefault(current, (match.group(2).strip(), []))
+            continue
+        if line.startswith("Статус анализа"):
+            current = None
+        if current is not None:
+            blocks[current][1].append(line)
+    
+    report = {}
+    for number, (title, block_lines) in blocks.items():
+        severity = None
+        findings = []
+        for line in block_lines:
+            if line.strip().startswith("Критичность"):
+                severity = severity or next((mark for mark in _V6_SEVERITY if mark in line), None)
+            else:
+                findings.append(line)
+        while findings and not findings[-1].strip():
+            findings.pop()
+        while findings and not findings[0].strip():
+            findings.pop(0)
+        report[number] = (_V6_BLOCK_TITLES.get(number) or title, severity, findings)
+    return report
+
+def _diagnosis_blocks(conn: Connection):
+    """Блоки уже выполненных диагностик из Application.diagnosis_result
+    
+    Саму таблицу с индексами создает create_all, здесь - перенос данных.
+    """
+    done = set(conn.execute(select(DiagnosisBlock.application_id).distinct()).scalars())
+    rows = conn.execute(
+        select(Application.id, Application.diagnosis_result)
+        .where(Application.diagnosis_result.is_not(None))
+    )
+    for application_id, diagnosis_result in rows.all():
+        if application_id in done:
+            continue
+        try:
+            raw_response = json.loads(diagnosis_result).get("raw_response") or ""
+        except (ValueError, AttributeError):
+            continue
+        
+        report = _v6_parse_report(raw_response)
+        if report:
+            conn.execute(DiagnosisBlock.__table__.insert(), [
+                {
+                    "application_id": application_id,
+                    "block_number": number,
+                    "title": title,
+                    "severity": BlockSeverity(severity) if severity else None,
+                    "findings": "\n".join(findings),
+                    "created_at": datetime.utcnow()
+                }
+                for number, (title, severity, findings) in sorted(report.items())
+            ])
+
+def _compress_application_results(conn: Connection):
+    """Сжать результаты диагностики, записанные до CompressedText"""
+    table = Application.__table__
+    
+    def uncompressed(column):
+        # Как обычный текст, без обработки типа: видны исходные значения
+        raw = type_coerce(column, Text)
+        return raw.is_not(None) & ~raw.startswith(CompressedText.PREFIX)
+    
+    ids = conn.execute(
+        select(table.c.id).where(or_(
+            uncompressed(table.c.diagnosis_result),
+            uncompressed(table.c.recommendations)
+        ))
+    ).scalars().all()
+    
+    for application_id in ids:
+        # Чтение через тип отдает текст как есть, запись - сжимает
+        row = conn.execute(
+            select(table.c.diagnosis_result, table.c.recommendations)
+            .where(table.c.id == application_id)
+        ).one()
+        conn.execute(
+            table.update()
+            .where(table.c.id == application_id)
+            .values(diagnosis_result=row.diagnosis_result, recommendations=row.recommendations)
+        )
+
+def _job_status_cancelled(conn: Connection):
+    """Статус вытесненной задачи диагностики
+    
+    В PostgreSQL перечисление - отдельный тип, новое значение добавляется
+    явно; в SQLite статус хранится строкой и менять нечего.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TYPE jobstatus ADD VALUE IF NOT EXISTS 'CANCELLED'"))
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "composite_indexes", _composite_indexes),
+    Migration(2, "application_versioning", _application_versioning),
+    Migration(3, "document_content_hash", _document_content_hash),
+    Migration(4, "document_tradelines", _document_tradelines),
+    Migration(5, "application_monthly_income", _application_monthly_income),
+    Migration(6, "diagnosis_blocks", _diagnosis_blocks),
+    Migration(7, "compress_application_results", _compress_application_results),
+    Migration(8, "job_status_cancelled", _job_status_cancelled),
+]
+
+def run_migrations(conn: Connection) -> int:
+    """Применить недостающие миграции по порядку версий"""
+    applied = set(conn.execute(select(SchemaMigration.version)).scalars())
+    count = 0
+    
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version in applied:
+            continue
+        
+        logger.info(f"Применяем миграцию {migration.version}: {migration.name}")
+        migration.apply(conn)
+        conn.execute(
+            SchemaMigration.__table__.insert().values(
+                version=migration.version,
+                name=migration.name
+            )
+        )
+        count += 1
+    
+    return count
@@ -1,11 +1,14 @@
+import base64
+import zlib
 from datetime import datetime
 from typing import Optional, List
 from sqlalchemy import (
     Column, Integer, String, DateTime, Boolean, Text, 
-    ForeignKey, Enum, LargeBinary, Float
+    ForeignKey, Enum, LargeBinary, Float, Index
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred, column_property
+from sqlalchemy.types import TypeDecorator
 import enum
 
 Base = declarative_base()
@@ -25,6 +28,13 @@ class ApplicationStatus(enum.Enum):
     COMPLETED = "completed"
     REJECTED = "rejected"
 
+class JobStatus(enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"  # Вытеснена задачей с новыми документами
+
 class DocumentType(enum.Enum):
     CREDIT_REPORT_NBKI = "credit_report_nbki"
     CREDIT_REPORT_OKB = "credit_report_okb"
@@ -32,6 +42,11 @@ class DocumentType(enum.Enum):
     PASSPORT = "passport"
     OTHER = "other"
 
+class BlockSeverity(enum.Enum):
+    CRITICAL = "🟥"
+    WARNING = "🟨"
+    OK = "🟩"
+
 class User(Base):
     __tablename__ = "users"
     
@@ -94,24 +109,52 @@ class Broker(Base):
     # Связи
     clients = relationship("User", back_populates="broker")
 
+class CompressedText(TypeDecorator):
+    """Текст, хранимый сжатым: «zlib:» + base64 от zlib
+    
+    Значения без префикса (записанные до сжатия) читаются как есть.
+    """
+    impl = Text
+    cache_ok = True
+    
+    PREFIX = "zlib:"
+    
+    def process_bind_param(self, value: Optional[str], dialect) -> Optional[str]:
+        if value is None:
+            return None
+        return self.PREFIX + base64.b64encode(zlib.compress(value.encode("utf-8"))).decode("ascii")
+    
+    def process_result_value(self, value: Optional[str], dialect) -> Optional[str]:
+        if value is None or not value.startswith(self.PREFIX):
+            return value
+        return zlib.decompress(base64.b64decode(value[len(self.PREFIX):])).decode("utf-8")
+
 class Application(Base):
     __tablename__ = "applications"
+    __table_args__ = (
+        Index("ix_applications_user_status_created", "user_id", "status", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     # Статус и этапы
     status = Column(Enum(ApplicationStatus), default=ApplicationStatus.CREATED)
+    previous_status = Column(Enum(ApplicationStatus), nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Оптимистичная блокировка
     current_step = Column(String(100), nullable=True)
     
     # Данные для анализа
     target_bank = Column(String(255), nullable=True)
     loan_purpose = Column(String(500), nullable=True)
     loan_amount = Column(Float, nullable=True)
+    monthly_income = Column(Float, nullable=True)  # Для расчета ПДН
     
-    # Результаты диагностики
-    diagnosis_result = Column(Text, nullable=True)  # JSON с результатами
-    recommendations = Column(Text, nullable=True)
+    # Результаты диагностики: большие, хранятся сжатыми и загружаются только
+    # экранами, которые их показывают (undefer_group("results"))
+    diagnosis_result = deferred(Column(CompressedText, nullable=True), group="results")  # JSON с результатами
+    recommendations = deferred(Column(CompressedText, nullable=True), group="results")
+    has_diagnosis_result = column_property(diagnosis_result.columns[0].is_not(None))
     
     # AmoCRM интеграция
     amocrm_lead_id = Column(Integer, nullable=True)
@@ -128,6 +171,10 @@ class Application(Base):
 
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        Index("ix_documents_user_type_uploaded", "user_id", "file_type", "uploaded_at"),
+        Index("ix_documents_content_hash", "content_hash"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -138,10 +185,12 @@ class Document(Base):
     file_type = Column(Enum(DocumentType), nullable=False)
     file_size = Column(Integer, nullable=False)
     file_path = Column(String(500), nullable=False)  # Путь в Google Drive
+    content_hash = Column(String(64), nullable=True)  # SHA-256 содержимого файла
     
     # Обработка
     is_processed = Column(Boolean, default=False)
-    processing_result = Column(Text, nullable=True)  # JSON с результатами парсинга
+    processing_result = Column(Text, nullable=True)  # JSON со сжатым извлеченным текстом
+    tradelines = Column(LargeBinary, nullable=True)  # Записи о кредитах по колонкам (сжатый npz)
     
     # Системные поля
     uploaded_at = Column(DateTime, default=datetime.utcnow)
@@ -153,6 +202,9 @@ class Document(Base):
 
 class StatusHistory(Base):
     __tablename__ = "status_history"
+    __table_args__ = (
+        Index("ix_status_history_application_created", "application_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True)
     application_id = Column(Integer, ForeignKey("applications.id"), nullable=False)
@@ -175,6 +227,9 @@ class StatusHistory(Base):
 
 class UserLog(Base):
     __tablename__ = "user_logs"
+    __table_args__ = (
+        Index("ix_user_logs_user_created", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -268,6 +323,12 @@ class ReferralStats(Base):
 
 class ReferralClick(Base):
     __tablename__ = "referral_clicks"
+    __table_args__ = (
+        # Дедупликация кликов: ref_code + telegram_id за последние 24 часа
+        Index("ix_referral_clicks_ref_telegram_clicked", "ref_code", "telegram_id", "clicked_at"),
+        # Статистика брокера по периодам
+        Index("ix_referral_clicks_broker_clicked", "broker_id", "clicked_at"),
+    )
     
     id = Column(Integer, primary_key=True)
     ref_code = Column(String(50), nullable=False)
@@ -299,4 +360,84 @@ class BotSettings(Base):
     
     # Системные поля
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow) 
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DiagnosisJob(Base):
+    __tablename__ = "diagnosis_jobs"
+    __table_args__ = (
+        # Выборка следующей задачи воркером
+        Index("ix_diagnosis_jobs_status_available", "status", "available_at"),
+        Index("ix_diagnosis_jobs_application", "application_id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    application_id = Column(Integer, ForeignKey("applications.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    # Состояние задачи
+    status = Column(Enum(JobStatus), default=JobStatus.PENDING, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    last_error = Column(Text, nullable=True)
+    
+    # Аренда: задача видна другим воркерам после истечения lease_expires_at
+    available_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    
+    # Системные поля
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class DiagnosisBlock(Base):
+    __tablename__ = "diagnosis_blocks"
+    __table_args__ = (
+        # Блоки заявки по порядку, по одной записи на блок
+        Index("ix_diagnosis_blocks_application_number", "application_id", "block_number", unique=True),
+        # Сводки по критичности блоков
+        Index("ix_diagnosis_blocks_number_severity", "block_number", "severity"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    application_id = Column(Integer, ForeignKey("applications.id"), nullable=False)
+    
+    # Блок отчета диагностики (1-12)
+    block_number = Column(Integer, nullable=False)
+    title = Column(String(255), nullable=False)
+    severity = Column(Enum(BlockSeverity), nullable=True)  # None - нет данных
+    findings = Column(Text, nullable=True)  # Находки, по одной в строке
+    
+    # Системные поля
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_response_cache"
+    __table_args__ = (
+        # Вытеснение давно не использованных записей
+        Index("ix_llm_response_cache_last_used", "last_used_at"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String(64), unique=True, nullable=False)  # SHA-256 запроса
+    
+    # Что было запрошено
+    model = Column(String(100), nullable=False)
+    prompt_version = Column(String(50), nullable=False)
+    
+    # Ответ модели
+    response = Column(Text, nullable=False)
+    tokens_used = Column(Integer, nullable=True)
+    hits = Column(Integer, default=0, nullable=False)
+    
+    # Системные поля
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    
+    version = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
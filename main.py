@@ -8,7 +8,13 @@ from config.settings import get_settings
 from bot.handlers import register_all_handlers
 from bot.middlewares.logging_middleware import LoggingMiddleware
 from bot.middlewares.auth_middleware import AuthMiddleware
+from bot.middlewares.db_session_middleware import DbSessionMiddleware, CommitBeforeRequestMiddleware
 from database.database import init_db, close_db
+from services.activity_tracker import activity_tracker
+from services.log_sink import log_sink
+from services.diagnosis_queue import diagnosis_queue
+from services.pdf_extractor import pdf_extractor
+from services.openai_client import openai_client
 
 # Настройка логирования
 logging.basicConfig(
@@ -36,6 +42,8 @@ async def main():
     dp = Dispatcher()
     
     # Регистрация middleware
+    dp.update.outer_middleware(DbSessionMiddleware())
+    bot.session.middleware(CommitBeforeRequestMiddleware())
     dp.message.middleware(LoggingMiddleware())
     dp.callback_query.middleware(LoggingMiddleware())
     dp.message.middleware(AuthMiddleware())
@@ -43,6 +51,9 @@ async def main():
     
     # Инициализация базы данных
     await init_db()
+    activity_tracker.start()
+    log_sink.start()
+    diagnosis_queue.start(bot)
     
     # Регистрация хэндлеров
     register_all_handlers(dp)
@@ -53,7 +64,12 @@ async def main():
         # Запуск бота
         await dp.start_polling(bot)
     finally:
-        # Закрытие соединений
+        # Сбрасываем накопленные данные и закрываем соединения
+        await diagnosis_queue.stop()
+        pdf_extractor.stop()
+        await openai_client.close()
+        await log_sink.stop()
+        await activity_tracker.stop()
         await close_db()
         await bot.session.close()
 
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any
+from sqlalchemy import update, case
+
+from database.models import User
+from database.database import get_db_session
+from config.settings import get_settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ActivityTracker:
+    """Отложенная запись last_activity: метки копятся в памяти и пишутся пачкой"""
+    
+    def __init__(self, flush_interval: float, max_staleness: float):
+        self.flush_interval = flush_interval
+        self.max_staleness = max_staleness
+        
+        # user_id -> время последней активности, еще не записанное в БД
+        self._pending: Dict[int, datetime] = {}
+        # user_id -> monotonic-время последней записанной (или поставленной в очередь) метки
+        self._last_recorded: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        
+        self.touches = 0
+        self.skipped = 0
+        self.flushes = 0
+        self.rows_written = 0
+    
+    def touch(self, user_id: int):
+        """Отметить активность пользователя (без обращения к БД)"""
+        self.touches += 1
+        now = time.monotonic()
+        
+        # Метка в БД и так достаточно свежая - пропускаем
+        last = self._last_recorded.get(user_id)
+        if last is not None and now - last < self.max_staleness:
+            self.skipped += 1
+            return
+        
+        self._last_recorded[user_id] = now
+        self._pending[user_id] = datetime.utcnow()
+    
+    async def flush(self) -> int:
+        """Записать накопленные метки одним UPDATE"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            
+            batch, self._pending = self._pending, {}
+            
+            try:
+                async with get_db_session() as session:
+                    await session.execute(
+                        update(User)
+                        .where(User.id.in_(list(batch)))
+                        .values(last_activity=case(batch, value=User.id))
+                        .execution_options(synchronize_session=False)
+                    )
+            except asyncio.CancelledError:
+                # stop() отменил фоновую запись посреди UPDATE: пачку допишет
+                # финальный flush (повтор той же метки безвреден)
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка записи last_activity ({len(batch)} польз.): {e}")
+                self._requeue(batch)
+                return 0
+            
+            self.flushes += 1
+            self.rows_written += len(batch)
+            self._prune()
+            return len(batch)
+    
+    def _requeue(self, batch: Dict[int, datetime]):
+        """Вернуть незаписанные метки в очередь, более новые не перетирая"""
+        for user_id, ts in batch.items():
+            self._pending.setdefault(user_id, ts)
+    
+    def _prune(self):
+        """Забыть пользователей, чьи метки уже устарели"""
+        threshold = time.monotonic() - self.max_staleness
+        stale = [uid for uid, ts in self._last_recorded.items() if ts < threshold]
+        for user_id in stale:
+            del self._last_recorded[user_id]
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    def start(self):
+        """Запустить фоновую запись"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Запись last_activity: раз в {self.flush_interval} с, "
+                f"допустимая устарелость {self.max_staleness} с"
+            )
+    
+    async def stop(self):
+        """Остановить фоновую запись и сбросить остаток в БД"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        # Остановку саму могут отменить по таймауту завершения - остаток все равно пишем
+        flushed = await asyncio.shield(self.flush())
+        logger.info(f"last_activity сброшены при остановке: {flushed}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики отложенной записи"""
+        return {
+            "pending": len(self._pending),
+            "touches": self.touches,
+            "skipped": self.skipped,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written
+        }
+
+_settings = get_settings()
+activity_tracker = ActivityTracker(
+    flush_interval=_settings.ACTIVITY_FLUSH_INTERVAL_SECONDS,
+    max_staleness=_settings.ACTIVITY_MAX_STALENESS_SECONDS
+)
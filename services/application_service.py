@@ -1,19 +1,61 @@
 from datetime import datetime
-from typing import Optional, List, Dict, Any
-from sqlalchemy import select, update
-from sqlalchemy.orm import selectinload
+from typing import Optional, List, Dict, Any, Set, Callable
+from sqlalchemy import select, update, insert, delete, func
+from sqlalchemy.orm import selectinload, undefer_group
 
 from database.models import (
-    Application, User, ApplicationStatus, StatusHistory, Document
+    Application, User, ApplicationStatus, StatusHistory, Document, DiagnosisBlock, BlockSeverity
 )
 from database.database import get_db_session
 from services.user_service import UserService
+from services.chunk_planner import BlockReport
 # GPT диагностика будет импортироваться динамически для избежания циклических импортов
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
+# Допустимые переходы статусов заявки
+STATUS_TRANSITIONS: Dict[ApplicationStatus, Set[ApplicationStatus]] = {
+    ApplicationStatus.CREATED: {
+        ApplicationStatus.DOCUMENTS_UPLOADED,
+        ApplicationStatus.DIAGNOSIS_IN_PROGRESS,
+        ApplicationStatus.REJECTED,
+    },
+    ApplicationStatus.DOCUMENTS_UPLOADED: {
+        ApplicationStatus.DIAGNOSIS_IN_PROGRESS,
+        ApplicationStatus.REJECTED,
+    },
+    ApplicationStatus.DIAGNOSIS_IN_PROGRESS: {
+        ApplicationStatus.DIAGNOSIS_COMPLETED,  # Также откат повторной диагностики
+        ApplicationStatus.CREATED,  # Откат при ошибке диагностики
+        ApplicationStatus.DOCUMENTS_UPLOADED,  # Откат при ошибке диагностики
+        ApplicationStatus.REJECTED,
+    },
+    ApplicationStatus.DIAGNOSIS_COMPLETED: {
+        ApplicationStatus.DIAGNOSIS_IN_PROGRESS,  # Повторная диагностика
+        ApplicationStatus.APPLICATIONS_PENDING,
+        ApplicationStatus.APPLICATIONS_SENT,
+        ApplicationStatus.REJECTED,
+    },
+    ApplicationStatus.APPLICATIONS_PENDING: {
+        ApplicationStatus.APPLICATIONS_SENT,
+        ApplicationStatus.REJECTED,
+    },
+    ApplicationStatus.APPLICATIONS_SENT: {
+        ApplicationStatus.COMPLETED,
+        ApplicationStatus.REJECTED,
+    },
+    ApplicationStatus.COMPLETED: set(),
+    ApplicationStatus.REJECTED: set(),
+}
+
+# Обратная таблица: из каких статусов можно попасть в данный
+ALLOWED_SOURCE_STATUSES: Dict[ApplicationStatus, Set[ApplicationStatus]] = {
+    target: {source for source, targets in STATUS_TRANSITIONS.items() if target in targets}
+    for target in ApplicationStatus
+}
+
 class ApplicationService:
     """Сервис для работы с заявками"""
     
@@ -25,23 +67,26 @@ class ApplicationService:
         user: User,
         target_bank: Optional[str] = None,
         loan_purpose: Optional[str] = None,
-        loan_amount: Optional[float] = None
+        loan_amount: Optional[float] = None,
+        monthly_income: Optional[float] = None
     ) -> Application:
         """Создать новую заявку"""
         
         async with get_db_session() as session:
-            application = Application(
-                user_id=user.id,
-                status=ApplicationStatus.CREATED,
-                current_step="document_upload",
-                target_bank=target_bank,
-                loan_purpose=loan_purpose,
-                loan_amount=loan_amount
+            result = await session.execute(
+                insert(Application)
+                .values(
+                    user_id=user.id,
+                    status=ApplicationStatus.CREATED,
+                    current_step="document_upload",
+                    target_bank=target_bank,
+                    loan_purpose=loan_purpose,
+                    loan_amount=loan_amount,
+                    monthly_income=monthly_income
+                )
+                .returning(Application)
             )
-            
-            session.add(application)
-            await session.commit()
-            await session.refresh(application)
+            application = result.scalars().one()
             
             # Создаем запись в истории статусов
             await self.add_status_history(
@@ -66,74 +111,131 @@ class ApplicationService:
             logger.info(f"Создана заявка {application.id} для пользователя {user.id}")
             return application
     
-    async def get_user_application(self, user_id: int) -> Optional[Application]:
-        """Получить активную заявку пользователя"""
+    async def get_user_application(self, user_id: int, with_results: bool = False) -> Optional[Application]:
+        """Получить активную заявку пользователя
+        
+        Результаты диагностики (diagnosis_result, recommendations) загружаются
+        только с with_results; для проверки их наличия есть has_diagnosis_result.
+        """
+        query = (
+            select(Application)
+            .options(
+                selectinload(Application.documents),
+                selectinload(Application.status_history)
+            )
+            .where(Application.user_id == user_id)
+            .where(Application.status != ApplicationStatus.COMPLETED)
+            .where(Application.status != ApplicationStatus.REJECTED)
+            .order_by(Application.created_at.desc())
+        )
+        if with_results:
+            query = query.options(undefer_group("results"))
+        
         async with get_db_session() as session:
-            result = await session.execute(
-                select(Application)
-                .options(
-                    selectinload(Application.documents),
-                    selectinload(Application.status_history)
-                )
-                .where(Application.user_id == user_id)
-                .where(Application.status != ApplicationStatus.COMPLETED)
-                .where(Application.status != ApplicationStatus.REJECTED)
-                .order_by(Application.created_at.desc())
+            result = await session.execute(query)
+            return result.scalars().first()
+    
+    async def get_application_by_id(self, application_id: int, with_results: bool = False) -> Optional[Application]:
+        """Получить заявку по ID (результаты диагностики - только с with_results)"""
+        query = (
+            select(Application)
+            .options(
+                selectinload(Application.user),
+                selectinload(Application.documents),
+                selectinload(Application.status_history)
             )
+            .where(Application.id == application_id)
+        )
+        if with_results:
+            query = query.options(undefer_group("results"))
+        
+        async with get_db_session() as session:
+            result = await session.execute(query)
             return result.scalars().first()
     
-    async def get_application_by_id(self, application_id: int) -> Optional[Application]:
-        """Получить заявку по ID"""
+    async def update_loan_parameters(
+        self,
+        application_id: int,
+        monthly_income: float,
+        loan_amount: Optional[float]
+    ) -> bool:
+        """Сохранить доход клиента и сумму запрашиваемого кредита (для расчета ПДН)"""
+        
         async with get_db_session() as session:
             result = await session.execute(
-                select(Application)
-                .options(
-                    selectinload(Application.user),
-                    selectinload(Application.documents),
-                    selectinload(Application.status_history)
-                )
+                update(Application)
                 .where(Application.id == application_id)
+                .values(monthly_income=monthly_income, loan_amount=loan_amount)
+                .returning(Application.user_id)
             )
-            return result.scalars().first()
+            user_id = result.scalar()
+            if user_id is None:
+                return False
+            
+            await self.user_service.log_user_action(
+                user_id,
+                "loan_parameters_updated",
+                {"application_id": application_id, "loan_amount": loan_amount}
+            )
+            return True
     
     async def update_application_status(
         self,
         application_id: int,
         new_status: ApplicationStatus,
         comment: Optional[str] = None,
-        created_by: str = "system"
+        created_by: str = "system",
+        expected_version: Optional[int] = None
     ) -> bool:
-        """Обновить статус заявки"""
+        """Обновить статус заявки
+        
+        Переход выполняется одним условным UPDATE ... RETURNING: строка не читается
+        заранее, а недопустимый переход или устаревшая версия просто не обновляют ее.
+        """
+        
+        source_statuses = ALLOWED_SOURCE_STATUSES[new_status]
+        if not source_statuses:
+            logger.warning(f"Переход в статус {new_status} невозможен ни из одного статуса")
+            return False
         
         async with get_db_session() as session:
-            # Получаем текущую заявку
-            result = await session.execute(
-                select(Application).where(Application.id == application_id)
-            )
-            application = result.scalars().first()
-            
-            if not application:
-                return False
-            
-            old_status = application.status
-            
-            # Обновляем статус
-            await session.execute(
+            query = (
                 update(Application)
                 .where(Application.id == application_id)
+                .where(Application.status.in_(source_statuses))
+            )
+            if expected_version is not None:
+                query = query.where(Application.version == expected_version)
+            
+            # В SET правые части видят значения до обновления,
+            # поэтому previous_status получает старый статус
+            result = await session.execute(
+                query
                 .values(
+                    previous_status=Application.status,
                     status=new_status,
+                    version=Application.version + 1,
                     updated_at=datetime.utcnow(),
                     completed_at=datetime.utcnow() if new_status in [
                         ApplicationStatus.COMPLETED, 
                         ApplicationStatus.REJECTED
                     ] else None
                 )
+                .returning(Application.user_id, Application.previous_status, Application.version)
+                .execution_options(synchronize_session=False)
             )
+            row = result.first()
+            
+            if row is None:
+                logger.warning(
+                    f"Статус заявки {application_id} не изменен на {new_status}: "
+                    f"заявка не найдена, переход недопустим или версия устарела"
+                )
+                return False
             
-            await session.commit()
+            user_id, old_status, version = row
             
-            # Добавляем запись в историю
+            # Добавляем запись в историю (в той же транзакции)
             await self.add_status_history(
                 application_id,
                 old_status,
@@ -144,12 +246,13 @@ class ApplicationService:
             
             # Логируем изменение
             await self.user_service.log_user_action(
-                application.user_id,
+                user_id,
                 "application_status_changed",
                 {
                     "application_id": application_id,
                     "old_status": old_status.value if old_status else None,
                     "new_status": new_status.value,
+                    "version": version,
                     "comment": comment
                 }
             )
@@ -177,7 +280,7 @@ class ApplicationService:
             )
             
             session.add(history)
-            await session.commit()
+            await session.flush()
     
     async def set_diagnosis_result(
         self,
@@ -197,7 +300,7 @@ class ApplicationService:
                     updated_at=datetime.utcnow()
                 )
             )
-            await session.commit()
+            await session.flush()
             
             # Обновляем статус
             await self.update_application_status(
@@ -208,6 +311,54 @@ class ApplicationService:
             
             return True
     
+    async def save_diagnosis_blocks(self, application_id: int, report: BlockReport):
+        """Заменить блоки диагностики заявки блоками отчета"""
+        
+        async with get_db_session() as session:
+            await session.execute(
+                delete(DiagnosisBlock).where(DiagnosisBlock.application_id == application_id)
+            )
+            if report:
+                await session.execute(
+                    insert(DiagnosisBlock),
+                    [
+                        {
+                            "application_id": application_id,
+                            "block_number": number,
+                            "title": title,
+                            "severity": BlockSeverity(severity) if severity else None,
+                            "findings": "\n".join(findings),
+                            "created_at": datetime.utcnow()
+                        }
+                        for number, (title, severity, findings) in sorted(report.items())
+                    ]
+                )
+            await session.flush()
+    
+    async def get_diagnosis_blocks(self, application_id: int) -> List[DiagnosisBlock]:
+        """Блоки диагностики заявки по порядку номеров"""
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(DiagnosisBlock)
+                .where(DiagnosisBlock.application_id == application_id)
+                .order_by(DiagnosisBlock.block_number)
+            )
+            return list(result.scalars().all())
+    
+    async def get_block_statistics(self) -> Dict[int, Dict[Optional[BlockSeverity], int]]:
+        """Число заявок по блокам и критичности: номер блока -> критичность -> заявок"""
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(DiagnosisBlock.block_number, DiagnosisBlock.severity, func.count())
+                .group_by(DiagnosisBlock.block_number, DiagnosisBlock.severity)
+            )
+            stats: Dict[int, Dict[Optional[BlockSeverity], int]] = {}
+            for number, severity, count in result.all():
+                stats.setdefault(number, {})[severity] = count
+            return stats
+    
     async def get_application_stats(self, user_id: int) -> Dict[str, Any]:
         """Получить статистику заявок пользователя"""
         
@@ -257,8 +408,39 @@ class ApplicationService:
         
         return len(credit_reports) > 0
     
-    async def start_diagnosis(self, application_id: int) -> bool:
-        """Запустить диагностику КИ через GPT"""
+    async def rollback_diagnosis_status(
+        self, 
+        application_id: int, 
+        comment: str, 
+        expected_version: Optional[int] = None
+    ) -> bool:
+        """Вернуть заявку из «идет диагностика» в статус до запуска
+        
+        Повторная диагностика завершенной заявки при ошибке оставляет ее
+        завершенной с прежним результатом, а не сбрасывает в CREATED.
+        С expected_version откатывается только свой запуск: если заявку
+        с тех пор изменили (запущен новый анализ), она не трогается.
+        """
+        
+        application = await self.get_application_by_id(application_id)
+        if not application or application.status != ApplicationStatus.DIAGNOSIS_IN_PROGRESS:
+            return False
+        if expected_version is not None and application.version != expected_version:
+            return False
+        
+        return await self.update_application_status(
+            application_id,
+            application.previous_status or ApplicationStatus.CREATED,
+            comment,
+            expected_version=application.version
+        )
+    
+    async def start_diagnosis(
+        self, 
+        application_id: int, 
+        on_block: Optional[Callable[[int, str, Optional[str]], None]] = None
+    ) -> bool:
+        """Запустить диагностику КИ через GPT (on_block - ход анализа по блокам)"""
         
         # Проверяем готовность документов
         if not await self.check_documents_ready_for_diagnosis(application_id):
@@ -269,12 +451,19 @@ class ApplicationService:
         if not application:
             return False
         
-        # Обновляем статус
-        await self.update_application_status(
+        # Обновляем статус (не выйдет, если диагностика уже идет)
+        if not await self.update_application_status(
             application_id,
             ApplicationStatus.DIAGNOSIS_IN_PROGRESS,
-            "Диагностика КИ запущена через GPT"
-        )
+            "Диагностика КИ запущена через GPT",
+            expected_version=application.version
+        ):
+            return False
+        
+        # Версия заявки этого запуска: результат сохраняется и заявка
+        # завершается, только если с тех пор ее не изменили, иначе
+        # устаревший анализ перезаписал бы более новый
+        version = application.version + 1
         
         try:
             # Динамический импорт для избежания циклических зависимостей
@@ -287,25 +476,29 @@ class ApplicationService:
             
             result = await gpt_service.analyze_credit_history(
                 user_id=application.user_id,
-                application_id=application_id
+                application_id=application_id,
+                on_block=on_block,
+                expected_version=version
             )
             
             if result["success"]:
                 # Обновляем статус на завершенный
-                await self.update_application_status(
+                if not await self.update_application_status(
                     application_id,
                     ApplicationStatus.DIAGNOSIS_COMPLETED,
-                    f"GPT диагностика завершена. Проанализировано документов: {result.get('documents_analyzed', 0)}"
-                )
+                    f"GPT диагностика завершена. Проанализировано документов: {result.get('documents_analyzed', 0)}",
+                    expected_version=version
+                ):
+                    return False
                 
                 logger.info(f"GPT диагностика завершена для заявки {application_id}")
                 return True
             else:
-                # Ошибка анализа
-                await self.update_application_status(
+                # Ошибка анализа - возвращаем статус до запуска
+                await self.rollback_diagnosis_status(
                     application_id,
-                    ApplicationStatus.CREATED,  # Возвращаем к исходному статусу
-                    f"Ошибка GPT диагностики: {result.get('error', 'Неизвестная ошибка')}"
+                    f"Ошибка GPT диагностики: {result.get('error', 'Неизвестная ошибка')}",
+                    expected_version=version
                 )
                 
                 logger.error(f"Ошибка GPT диагностики для заявки {application_id}: {result.get('error')}")
@@ -315,10 +508,10 @@ class ApplicationService:
             # Критическая ошибка
             logger.error(f"Критическая ошибка GPT диагностики для заявки {application_id}: {e}")
             
-            await self.update_application_status(
+            await self.rollback_diagnosis_status(
                 application_id,
-                ApplicationStatus.CREATED,
-                f"Техническая ошибка диагностики: {str(e)}"
+                f"Техническая ошибка диагностики: {str(e)}",
+                expected_version=version
             )
             
             return False
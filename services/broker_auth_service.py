@@ -6,8 +6,9 @@ from sqlalchemy import select, update
 from sqlalchemy.orm import selectinload
 
 from database.models import BrokerApplication, InviteCode, User, UserRole, Broker
-from database.database import get_db_session
+from database.database import get_db_session, call_after_commit
 from services.user_service import UserService
+from services.user_cache import user_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -53,7 +54,7 @@ class BrokerAuthService:
             )
             
             session.add(application)
-            await session.commit()
+            await session.flush()
             await session.refresh(application)
             
             logger.info(f"Создана заявка брокера #{application.id} от пользователя {telegram_id}")
@@ -109,7 +110,7 @@ class BrokerAuthService:
             )
             
             session.add(invite_code)
-            await session.commit()
+            await session.flush()
             await session.refresh(invite_code)
             
             logger.info(f"Заявка #{app_id} одобрена, создан код {code}")
@@ -134,7 +135,7 @@ class BrokerAuthService:
                     processed_at=datetime.utcnow()
                 )
             )
-            await session.commit()
+            await session.flush()
             
             logger.info(f"Заявка #{app_id} отклонена")
             return True
@@ -182,7 +183,8 @@ class BrokerAuthService:
             # Создать запись брокера если нужно
             await self._create_broker_profile(session, user, invite_code.application_id)
             
-            await session.commit()
+            await session.flush()
+            call_after_commit(lambda: user_cache.invalidate(user.telegram_id))
             
             # Логируем активацию
             await self.user_service.log_user_action(
@@ -270,7 +272,7 @@ class BrokerAuthService:
             )
             
             session.add(invite_code)
-            await session.commit()
+            await session.flush()
             await session.refresh(invite_code)
             
             logger.info(f"Создан ручной инвайт-код {code}")
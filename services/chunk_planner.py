@@ -0,0 +1,364 @@
+import json
+import re
+from typing import List, Tuple, Dict, Optional, Any
+
+try:
+    import tiktoken  # pip install tiktoken
+except ImportError:
+    tiktoken = None
+
+# Без tiktoken считаем по символам: русский текст отчетов БКИ
+# дает в среднем около 2.5 символов на токен
+CHARS_PER_TOKEN = 2.5
+
+# Блоки анализа в порядке промпта
+BLOCK_TITLES = {
+    1: "Ошибки в титуле",
+    2: "Ошибки в реквизитах",
+    3: "Контактные данные",
+    4: "Незакрытые счета",
+    5: "Плохие счета (МФО, ЖКХ, коллекторы)",
+    6: "Разночтения между БКИ",
+    7: "Ошибки в платёжной дисциплине",
+    8: "Задвоение счетов",
+    9: "Необнулённые счета",
+    10: "Стоп-комментарии",
+    11: "Неверные параметры договоров",
+    12: "Незаконные запросы",
+}
+
+# Критичность по убыванию
+SEVERITY = ["🟥", "🟨", "🟩"]
+
+# Отчет по блокам: номер -> (название, критичность, строки находок);
+# критичность None - нет данных
+BlockReport = Dict[int, Tuple[str, Optional[str], List[str]]]
+
+# Строгая схема ответа модели: блоки с критичностью и списком находок
+REPORT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "blocks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "number": {"type": "integer"},
+                    "title": {"type": "string"},
+                    "severity": {"type": ["string", "null"], "enum": SEVERITY + [None]},
+                    "findings": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["number", "title", "severity", "findings"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["blocks"],
+    "additionalProperties": False,
+}
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "ki_report", "strict": True, "schema": REPORT_SCHEMA},
+}
+
+_BLOCK_HEADER = re.compile(r"^\s*Блок\s+(\d+)\s*\.?\s*(.*)$")
+
+_encoding = None
+
+def estimate_tokens(text: str) -> int:
+    """Оценить число токенов текста"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text))
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def _split_text(text: str, max_tokens: int) -> List[str]:
+    """Разбить текст по строкам на части не больше max_tokens"""
+    parts = []
+    current: List[str] = []
+    current_tokens = 0
+    
+    for line in text.split("\n"):
+        line_tokens = estimate_tokens(line) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            parts.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+def plan_chunks(
+    blocks: List[Tuple[str, str]],
+    max_tokens: int
+) -> List[List[Tuple[str, str]]]:
+    """Разложить блоки БКИ (название, текст) по частям для анализа
+    
+    Блоки идут в исходном порядке и по возможности целиком: соседние
+    отчеты упаковываются в одну часть, пока она укладывается в бюджет,
+    чтобы модель видела разночтения между БКИ. Отчет больше бюджета
+    делится по строкам на «НБКИ (часть 1/3)» и т.д.
+    """
+    units: List[Tuple[str, str, int]] = []
+    for name, text in blocks:
+        tokens = estimate_tokens(text)
+        if tokens <= max_tokens:
+            units.append((name, text, tokens))
+            continue
+        parts = _split_text(text, max_tokens)
+        for index, part in enumerate(parts, start=1):
+            units.append((f"{name} (часть {index}/{len(parts)})", part, estimate_tokens(part)))
+    
+    chunks: List[List[Tuple[str, str]]] = []
+    current: List[Tuple[str, str]] = []
+    current_tokens = 0
+    for name, text, tokens in units:
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append((name, text))
+        current_tokens += tokens
+    
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _split_blocks(response: str) -> Dict[int, Tuple[str, List[str]]]:
+    """Блоки текстового ответа модели: номер -> (название, строки без заголовка)"""
+    blocks: Dict[int, Tuple[str, List[str]]] = {}
+    current: Optional[int] = None
+    
+    for line in response.split("\n"):
+        match = _BLOCK_HEADER.match(line)
+        if match:
+            current = int(match.group(1))
+            blocks.setdefault(current, (match.group(2).strip(), []))
+            continue
+        if line.startswith("Статус анализа"):
+            current = None
+        if current is not None:
+            blocks[current][1].append(line)
+    
+    return blocks
+
+def _severity(lines: List[str]) -> Optional[str]:
+    for line in lines:
+        if line.strip().startswith("Критичность"):
+            for mark in SEVERITY:
+                if mark in line:
+                    return mark
+    return None
+
+def _block_entry(data: Any) -> Optional[Tuple[int, str, Optional[str], List[str]]]:
+    """Блок из объекта JSON ответа; None, если объект на блок не похож"""
+    if not isinstance(data, dict):
+        return None
+    try:
+        number = int(data["number"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    
+    severity = data.get("severity")
+    findings = data.get("findings") or []
+    if isinstance(findings, str):
+        findings = [findings]
+    title = BLOCK_TITLES.get(number) or str(data.get("title") or "").strip()
+    return number, title, severity if severity in SEVERITY else None, [str(line) for line in findings]
+
+def parse_json_report(response: str) -> Optional[BlockReport]:
+    """Отчет из ответа в формате REPORT_SCHEMA; None, если это не JSON"""
+    try:
+        data = json.loads(response)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("blocks"), list):
+        return None
+    
+    report: BlockReport = {}
+    for item in data["blocks"]:
+        entry = _block_entry(item)
+        if entry:
+            report.setdefault(entry[0], entry[1:])
+    return report
+
+def parse_text_report(response: str) -> BlockReport:
+    """Отчет из текстового ответа «Блок X. Название / Критичность: ...»"""
+    report: BlockReport = {}
+    for number, (title, block_lines) in _split_blocks(response).items():
+        findings = [
+            line for line in block_lines
+            if not line.strip().startswith("Критичность")
+        ]
+        while findings and not findings[-1].strip():
+            findings.pop()
+        while findings and not findings[0].strip():
+            findings.pop(0)
+        report[number] = (BLOCK_TITLES.get(number) or title, _severity(block_lines), findings)
+    return report
+
+def report_summary(report: BlockReport) -> Dict[str, int]:
+    """Итоговый статус анализа по блокам"""
+    severities = [severity for _, severity, _ in report.values()]
+    return {
+        "blocks": len(severities),
+        "with_errors": sum(1 for severity in severities if severity in ("🟥", "🟨")),
+        "without_errors": severities.count("🟩"),
+        "no_data": severities.count(None),
+    }
+
+def render_report(report: BlockReport) -> str:
+    """Текст отчета по блокам с итоговым статусом анализа"""
+    lines: List[str] = []
+    for number in sorted(report):
+        title, severity, findings = report[number]
+        lines.append(f"Блок {number}. {title}")
+        lines.append(f"Критичность: {severity or 'нет данных'}")
+        lines.extend(findings)
+        lines.append("")
+    
+    summary = report_summary(report)
+    lines.extend([
+        "Статус анализа:",
+        f"Всего блоков обработано: {summary['blocks']}",
+        f"Блоков с ошибками: {summary['with_errors']}",
+        f"Блоков без ошибок: {summary['without_errors']}",
+        f"Блоков с отсутствием данных: {summary['no_data']}",
+    ])
+    return "\n".join(lines)
+
+def merge_block_reports(chunk_labels: List[str], reports: List[BlockReport]) -> BlockReport:
+    """Детерминированно объединить отчеты по частям в один отчет из 12 блоков
+    
+    Для каждого блока берется самая высокая критичность среди частей,
+    находки частей идут в порядке частей с пометкой источника.
+    """
+    numbers = sorted(set(BLOCK_TITLES) | {n for report in reports for n in report})
+    
+    merged: BlockReport = {}
+    for number in numbers:
+        title = BLOCK_TITLES.get(number)
+        severities = []
+        findings = []
+        
+        for label, report in zip(chunk_labels, reports):
+            if number not in report:
+                continue
+            block_title, severity, block_findings = report[number]
+            title = title or block_title
+            if severity:
+                severities.append(severity)
+            
+            body = [line for line in block_findings if line.strip()] or ["нет данных"]
+            findings.extend(f"[{label}] {line}" for line in body)
+        
+        severity = min(severities, key=SEVERITY.index) if severities else None
+        merged[number] = (title or "", severity, findings)
+    
+    return merged
+
+def replace_blocks(
+    report: BlockReport,
+    replacements: Dict[int, Tuple[Optional[str], List[str]]],
+    additions: Optional[Dict[int, Tuple[Optional[str], List[str]]]] = None
+) -> BlockReport:
+    """Подставить в отчет модели блоки, рассчитанные без нее
+    
+    replacements: номер блока -> (критичность, строки находок) вместо
+    ответа модели; additions - находки, дописываемые к ответу модели
+    (критичность блока - наивысшая из двух). Недостающие блоки
+    отмечаются как «нет данных».
+    """
+    additions = additions or {}
+    numbers = sorted(set(BLOCK_TITLES) | set(report) | set(replacements) | set(additions))
+    
+    result: BlockReport = {}
+    for number in numbers:
+        title = BLOCK_TITLES.get(number) or report.get(number, ("", None, []))[0]
+        if number in replacements:
+            severity, findings = replacements[number]
+        elif number in report:
+            _, severity, findings = report[number]
+        else:
+            severity, findings = None, ["нет данных"]
+        
+        if number in additions:
+            extra_severity, extra_findings = additions[number]
+            severities = [mark for mark in (severity, extra_severity) if mark]
+            severity = min(severities, key=SEVERITY.index) if severities else None
+            findings = findings + extra_findings
+        result[number] = (title, severity, list(findings))
+    
+    return result
+
+class BlockStreamParser:
+    """Разбор ответа модели (JSON по REPORT_SCHEMA) по мере поступления
+    
+    feed() принимает очередной фрагмент потока и возвращает блоки
+    (номер, название, критичность), объекты которых в массиве blocks
+    уже закрылись. Каждый символ просматривается один раз: парсер
+    помнит глубину вложенности и находится ли он внутри строки, а в
+    буфере держит только начатый, но еще не закрытый блок.
+    """
+    
+    # Глубина объекта блока: корневой объект -> массив blocks -> блок
+    BLOCK_DEPTH = 3
+    
+    def __init__(self):
+        self._buffer = ""
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start: Optional[int] = None
+    
+    def feed(self, delta: str) -> List[Tuple[int, str, Optional[str]]]:
+        scanned = len(self._buffer)
+        buffer = self._buffer + delta
+        events = []
+        
+        for index in range(scanned, len(buffer)):
+            char = buffer[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{" or char == "[":
+                self._depth += 1
+                if char == "{" and self._depth == self.BLOCK_DEPTH:
+                    self._start = index
+            elif char == "}" or char == "]":
+                if char == "}" and self._depth == self.BLOCK_DEPTH and self._start is not None:
+                    event = self._event(buffer[self._start:index + 1])
+                    if event:
+                        events.append(event)
+                    self._start = None
+                self._depth -= 1
+        
+        # Просмотренное вне начатого блока больше не понадобится
+        if self._start is None:
+            self._buffer = ""
+        else:
+            self._buffer = buffer[self._start:]
+            self._start = 0
+        return events
+    
+    def close(self) -> List[Tuple[int, str, Optional[str]]]:
+        # Незакрытый блок - оборванный ответ, его разберет итоговый разбор
+        self._buffer = ""
+        self._start = None
+        return []
+    
+    def _event(self, text: str) -> Optional[Tuple[int, str, Optional[str]]]:
+        try:
+            entry = _block_entry(json.loads(text))
+        except ValueError:
+            return None
+        return entry[:3] if entry else None
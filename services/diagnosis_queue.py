@@ -0,0 +1,496 @@
+import asyncio
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional, List, Dict, Set, Any
+from sqlalchemy import select, update, insert, func, or_, and_, case, exists
+from sqlalchemy.orm import aliased
+
+from database.models import DiagnosisJob, JobStatus, Application, User
+from database.database import get_db_session, call_after_commit
+from services.application_service import ApplicationService
+from config.settings import get_settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DiagnosisQueue:
+    """Персистентная очередь диагностики КИ с пулом asyncio-воркеров
+    
+    Задачи хранятся в таблице diagnosis_jobs и переживают перезапуск.
+    Воркер арендует задачу на visibility_timeout и продлевает аренду,
+    пока идет анализ; задачу упавшего воркера подхватит другой.
+    
+    По каждой заявке одновременно идет не больше одного анализа. Задача
+    становится доступной через debounce после последней загрузки, так что
+    отчеты, загруженные подряд, анализируются одним запуском, а загрузка
+    во время анализа отменяет его и ставит новый.
+    """
+    
+    def __init__(
+        self,
+        workers: int,
+        poll_interval: float,
+        visibility_timeout: float,
+        max_attempts: int,
+        retry_backoff: float,
+        debounce: float
+    ):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.debounce = debounce
+        
+        self.application_service = ApplicationService()
+        self._bot = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        
+        # Анализы, идущие в этом процессе, и вытесненные среди них: id задачи
+        self._running: Dict[int, asyncio.Task] = {}
+        self._superseded: Set[int] = set()
+        
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.debounced = 0
+        self.superseded = 0
+    
+    async def enqueue(self, application_id: int, supersede: bool = True) -> DiagnosisJob:
+        """Поставить диагностику заявки в очередь с отсрочкой debounce
+        
+        Ожидающая задача заявки не дублируется, а откладывается еще на debounce.
+        Идущий анализ при supersede отменяется: его входные данные устарели.
+        """
+        now = datetime.utcnow()
+        available_at = now + timedelta(seconds=self.debounce)
+        
+        async with get_db_session() as session:
+            # Загрузка в окне ожидания сливается с уже поставленной задачей
+            result = await session.execute(
+                update(DiagnosisJob)
+                .where(DiagnosisJob.application_id == application_id)
+                .where(DiagnosisJob.status == JobStatus.PENDING)
+                .values(
+                    available_at=case(
+                        (DiagnosisJob.available_at < available_at, available_at),
+                        else_=DiagnosisJob.available_at
+                    ),
+                    updated_at=now
+                )
+                .returning(DiagnosisJob)
+                .execution_options(synchronize_session=False)
+            )
+            job = result.scalars().first()
+            
+            if job:
+                self.debounced += 1
+                logger.info(f"Диагностика заявки {application_id} отложена до {job.available_at} (задача {job.id})")
+                return job
+            
+            if supersede:
+                result = await session.execute(
+                    update(DiagnosisJob)
+                    .where(DiagnosisJob.application_id == application_id)
+                    .where(DiagnosisJob.status == JobStatus.RUNNING)
+                    .values(
+                        status=JobStatus.CANCELLED,
+                        finished_at=now,
+                        updated_at=now,
+                        last_error="Загружены новые документы"
+                    )
+                    .returning(DiagnosisJob.id)
+                    .execution_options(synchronize_session=False)
+                )
+                for job_id in result.scalars().all():
+                    self.superseded += 1
+                    # Анализ в этом процессе отменяем сразу, в других его
+                    # остановит проверка статуса в _heartbeat
+                    call_after_commit(partial(self._cancel_local, job_id))
+                    logger.info(f"Диагностика заявки {application_id} вытеснена новой загрузкой (задача {job_id})")
+            else:
+                result = await session.execute(
+                    select(DiagnosisJob)
+                    .where(DiagnosisJob.application_id == application_id)
+                    .where(DiagnosisJob.status == JobStatus.RUNNING)
+                )
+                job = result.scalars().first()
+                
+                if job:
+                    logger.info(f"Диагностика заявки {application_id} уже идет (задача {job.id})")
+                    return job
+            
+            result = await session.execute(
+                insert(DiagnosisJob)
+                .values(
+                    application_id=application_id,
+                    user_id=select(Application.user_id)
+                        .where(Application.id == application_id)
+                        .scalar_subquery(),
+                    status=JobStatus.PENDING,
+                    max_attempts=self.max_attempts,
+                    available_at=available_at
+                )
+                .returning(DiagnosisJob)
+            )
+            job = result.scalars().one()
+            
+            if not self.debounce:
+                # Будим воркеры, когда задача станет видна другим соединениям
+                call_after_commit(self._wake)
+            
+            logger.info(f"Диагностика заявки {application_id} поставлена в очередь (задача {job.id})")
+            return job
+    
+    def _cancel_local(self, job_id: int):
+        """Отменить анализ вытесненной задачи, если он идет в этом процессе"""
+        task = self._running.get(job_id)
+        if task is not None and not task.done():
+            self._superseded.add(job_id)
+            task.cancel()
+    
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def _claim(self, worker_id: str) -> Optional[DiagnosisJob]:
+        """Арендовать следующую доступную задачу одним условным UPDATE"""
+        now = datetime.utcnow()
+        other = aliased(DiagnosisJob)
+        # Не больше одного анализа на заявку: пока у нее есть задача с живой
+        # арендой, остальные ее задачи ждут. Вытесненная (CANCELLED) задача
+        # тоже считается: ее анализ в другом процессе идет, пока _heartbeat
+        # не заметит отмену, а ее воркер снимает аренду, остановив анализ
+        busy = exists().where(
+            other.application_id == DiagnosisJob.application_id,
+            other.id != DiagnosisJob.id,
+            other.status.in_([JobStatus.RUNNING, JobStatus.CANCELLED]),
+            other.lease_expires_at >= now
+        )
+        claimable = and_(
+            or_(
+                and_(DiagnosisJob.status == JobStatus.PENDING, DiagnosisJob.available_at <= now),
+                and_(DiagnosisJob.status == JobStatus.RUNNING, DiagnosisJob.lease_expires_at < now)
+            ),
+            ~busy
+        )
+        
+        async with get_db_session() as session:
+            # Задачи с исчерпанными попытками и истекшей арендой больше не берем
+            await session.execute(
+                update(DiagnosisJob)
+                .where(DiagnosisJob.status == JobStatus.RUNNING)
+                .where(DiagnosisJob.lease_expires_at < now)
+                .where(DiagnosisJob.attempts >= DiagnosisJob.max_attempts)
+                .values(status=JobStatus.FAILED, finished_at=now, last_error="Истекла аренда")
+                .execution_options(synchronize_session=False)
+            )
+            
+            candidate = (
+                select(DiagnosisJob.id)
+                .where(claimable)
+                .where(DiagnosisJob.attempts < DiagnosisJob.max_attempts)
+                .order_by(DiagnosisJob.available_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            
+            # Условие повторяется во внешнем WHERE: конкурент, успевший раньше,
+            # оставит нам ноль строк
+            result = await session.execute(
+                update(DiagnosisJob)
+                .where(DiagnosisJob.id == candidate)
+                .where(claimable)
+                .values(
+                    status=JobStatus.RUNNING,
+                    locked_by=worker_id,
+                    lease_expires_at=now + timedelta(seconds=self.visibility_timeout),
+                    attempts=DiagnosisJob.attempts + 1,
+                    updated_at=now
+                )
+                .returning(DiagnosisJob)
+                .execution_options(synchronize_session=False)
+            )
+            return result.scalars().first()
+    
+    async def _heartbeat(self, job_id: int, worker_id: str, run: asyncio.Task):
+        """Продлевать аренду, пока идет обработка, и отменить анализ вытесненной задачи
+        
+        Статус проверяется каждые poll_interval: задачу могла вытеснить
+        загрузка, обработанная другим процессом бота.
+        """
+        loop = asyncio.get_running_loop()
+        extended = loop.time()
+        
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            
+            async with get_db_session() as session:
+                status = (await session.execute(
+                    select(DiagnosisJob.status)
+                    .where(DiagnosisJob.id == job_id)
+                    .where(DiagnosisJob.locked_by == worker_id)
+                )).scalar()
+                
+                if status != JobStatus.RUNNING:
+                    self._superseded.add(job_id)
+                    run.cancel()
+                    return
+                
+                if loop.time() - extended >= self.visibility_timeout / 3:
+                    await session.execute(
+                        update(DiagnosisJob)
+                        .where(DiagnosisJob.id == job_id)
+                        .where(DiagnosisJob.locked_by == worker_id)
+                        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.visibility_timeout))
+                        .execution_options(synchronize_session=False)
+                    )
+                    extended = loop.time()
+    
+    async def _finish(self, job: DiagnosisJob, worker_id: str, success: bool, error: Optional[str] = None):
+        """Зафиксировать результат: готово, повтор с задержкой или окончательная ошибка"""
+        now = datetime.utcnow()
+        
+        if success:
+            values = {"status": JobStatus.DONE, "finished_at": now, "last_error": None}
+        elif job.attempts < job.max_attempts:
+            # Экспоненциальная задержка с джиттером
+            delay = self.retry_backoff * (2 ** (job.attempts - 1)) * random.uniform(0.8, 1.2)
+            values = {
+                "status": JobStatus.PENDING,
+                "available_at": now + timedelta(seconds=delay),
+                "last_error": error
+            }
+        else:
+            values = {"status": JobStatus.FAILED, "finished_at": now, "last_error": error}
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                update(DiagnosisJob)
+                .where(DiagnosisJob.id == job.id)
+                .where(DiagnosisJob.locked_by == worker_id)
+                .where(DiagnosisJob.status == JobStatus.RUNNING)
+                .values(locked_by=None, lease_expires_at=None, updated_at=now, **values)
+                .returning(DiagnosisJob.id)
+                .execution_options(synchronize_session=False)
+            )
+            if result.scalar() is None:
+                # Задачу вытеснили, пока анализ завершался
+                return JobStatus.CANCELLED
+        
+        return values["status"]
+    
+    async def _release(self, job: DiagnosisJob, worker_id: str):
+        """Снять аренду вытесненной задачи: ее анализ остановлен, новая задача заявки может начаться"""
+        try:
+            async with get_db_session() as session:
+                await session.execute(
+                    update(DiagnosisJob)
+                    .where(DiagnosisJob.id == job.id)
+                    .where(DiagnosisJob.locked_by == worker_id)
+                    .where(DiagnosisJob.status == JobStatus.CANCELLED)
+                    .values(locked_by=None, lease_expires_at=None, updated_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+        except Exception as e:
+            # Новая задача начнется после истечения аренды
+            logger.error(f"Не удалось снять аренду задачи {job.id}: {e}")
+    
+    async def _process(self, job: DiagnosisJob, worker_id: str):
+        logger.info(f"[{worker_id}] Задача {job.id}: диагностика заявки {job.application_id}, попытка {job.attempts}")
+        
+        # Оборванная или вытесненная попытка могла оставить заявку в статусе
+        # "идет диагностика"; другой анализ заявки сейчас идти не может
+        await self.application_service.rollback_diagnosis_status(
+            job.application_id,
+            "Повтор диагностики после сбоя" if job.attempts > 1 else "Перезапуск диагностики с новыми документами"
+        )
+        
+        progress = await self._start_progress(job)
+        
+        run = asyncio.create_task(self.application_service.start_diagnosis(
+            job.application_id,
+            on_block=progress.on_block if progress else None
+        ))
+        self._running[job.id] = run
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, worker_id, run))
+        error = None
+        try:
+            success = await run
+            if not success:
+                error = "Диагностика завершилась с ошибкой"
+        except asyncio.CancelledError:
+            # Отмена воркера (остановка бота) пробрасывается дальше
+            if job.id not in self._superseded:
+                raise
+            success = False
+        except Exception as e:
+            logger.error(f"[{worker_id}] Задача {job.id} упала: {e}")
+            success = False
+            error = str(e)
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.id, None)
+        
+        if job.id in self._superseded:
+            self._superseded.discard(job.id)
+            logger.info(f"[{worker_id}] Задача {job.id} вытеснена: анализ заявки {job.application_id} прерван")
+            await self._release(job, worker_id)
+            if progress:
+                try:
+                    await progress.supersede()
+                except Exception as e:
+                    logger.error(f"Не удалось обновить ход диагностики задачи {job.id}: {e}")
+            return
+        
+        if progress and success:
+            try:
+                await progress.finish()
+            except Exception as e:
+                logger.error(f"Не удалось обновить ход диагностики задачи {job.id}: {e}")
+        
+        status = await self._finish(job, worker_id, success, error)
+        
+        if status == JobStatus.CANCELLED:
+            logger.info(f"[{worker_id}] Задача {job.id} вытеснена после завершения анализа")
+            await self._release(job, worker_id)
+        elif status == JobStatus.DONE:
+            self.completed += 1
+            await self._notify(job, success=True)
+        elif status == JobStatus.PENDING:
+            self.retried += 1
+            logger.warning(f"Задача {job.id} будет повторена: {error}")
+        else:
+            self.failed += 1
+            await self._notify(job, success=False)
+    
+    async def _get_telegram_id(self, user_id: int) -> Optional[int]:
+        async with get_db_session() as session:
+            return (await session.execute(
+                select(User.telegram_id).where(User.id == user_id)
+            )).scalar()
+    
+    async def _start_progress(self, job: DiagnosisJob):
+        """Сообщение с ходом диагностики, которое обновляется по блокам ответа GPT"""
+        if self._bot is None:
+            return None
+        
+        from bot.utils.diagnosis_progress import DiagnosisProgress
+        
+        try:
+            progress = DiagnosisProgress(
+                self._bot,
+                await self._get_telegram_id(job.user_id),
+                get_settings().PROGRESS_EDIT_INTERVAL_SECONDS
+            )
+            await progress.start()
+            return progress
+        except Exception as e:
+            logger.error(f"Не удалось отправить ход диагностики задачи {job.id}: {e}")
+            return None
+    
+    async def _notify(self, job: DiagnosisJob, success: bool):
+        """Push-уведомление пользователю о результате"""
+        if self._bot is None:
+            return
+        
+        # Импорт здесь: слой бота не нужен сервису вне работающего бота
+        from bot.utils.messages import MESSAGES
+        from bot.keyboards.inline import get_status_keyboard, get_back_button
+        
+        try:
+            telegram_id = await self._get_telegram_id(job.user_id)
+            
+            if success:
+                documents = await self.application_service.get_documents_for_application(job.application_id)
+                reports = [d for d in documents if d.file_type.value.startswith('credit_report_')]
+                await self._bot.send_message(
+                    telegram_id,
+                    MESSAGES["diagnosis_ready"].format(
+                        application_id=job.application_id,
+                        documents=len(reports)
+                    ),
+                    reply_markup=get_status_keyboard(has_diagnosis_results=True)
+                )
+            else:
+                await self._bot.send_message(
+                    telegram_id,
+                    MESSAGES["diagnosis_failed"].format(application_id=job.application_id),
+                    reply_markup=get_back_button()
+                )
+        except Exception as e:
+            logger.error(f"Не удалось уведомить пользователя о задаче {job.id}: {e}")
+    
+    async def _worker(self, index: int):
+        worker_id = f"{self._worker_prefix}:{index}"
+        
+        while True:
+            try:
+                job = await self._claim(worker_id)
+            except Exception as e:
+                logger.error(f"[{worker_id}] Ошибка выборки задачи: {e}")
+                job = None
+            
+            if job is None:
+                # Ждем сигнала о новой задаче или интервала опроса
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            
+            await self._process(job, worker_id)
+    
+    def start(self, bot=None):
+        """Запустить воркеры (bot нужен для push-уведомлений)"""
+        if self._tasks:
+            return
+        
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Очередь диагностики запущена: воркеров {self.workers}")
+    
+    async def stop(self):
+        """Остановить воркеры; прерванные задачи подхватятся после истечения аренды"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Очередь диагностики остановлена")
+    
+    async def stats(self) -> Dict[str, Any]:
+        """Счетчики очереди и число задач по статусам"""
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(DiagnosisJob.status, func.count()).group_by(DiagnosisJob.status)
+            )
+            by_status = {status.value: count for status, count in result.all()}
+        
+        return {
+            "workers": len(self._tasks),
+            "by_status": by_status,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "debounced": self.debounced,
+            "superseded": self.superseded
+        }
+
+_settings = get_settings()
+diagnosis_queue = DiagnosisQueue(
+    workers=_settings.DIAGNOSIS_WORKERS,
+    poll_interval=_settings.DIAGNOSIS_POLL_INTERVAL_SECONDS,
+    visibility_timeout=_settings.DIAGNOSIS_VISIBILITY_TIMEOUT_SECONDS,
+    max_attempts=_settings.DIAGNOSIS_MAX_ATTEMPTS,
+    retry_backoff=_settings.DIAGNOSIS_RETRY_BACKOFF_SECONDS,
+    debounce=_settings.DIAGNOSIS_DEBOUNCE_SECONDS
+)
@@ -1,8 +1,12 @@
 import os
+import json
+import zlib
+import base64
+import hashlib
 import aiofiles
 from datetime import datetime
-from typing import Optional, List, Tuple
-from sqlalchemy import select, update
+from typing import Optional, List, Tuple, Dict
+from sqlalchemy import select, update, insert
 from sqlalchemy.orm import selectinload
 
 from database.models import Document, User, Application, DocumentType
@@ -12,6 +16,38 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+def content_hash(file_data: bytes) -> str:
+    """SHA-256 содержимого файла"""
+    return hashlib.sha256(file_data).hexdigest()
+
+# Версия извлечения текста: повышается, когда меняется извлечение или
+# сокращение текста, чтобы сохраненные тексты извлекались заново
+EXTRACTED_TEXT_VERSION = 3
+
+def pack_extracted_text(file_hash: str, text: str) -> str:
+    """Упаковать извлеченный текст для Document.processing_result"""
+    return json.dumps({
+        "content_hash": file_hash,
+        "version": EXTRACTED_TEXT_VERSION,
+        "compression": "zlib",
+        "text": base64.b64encode(zlib.compress(text.encode("utf-8"))).decode("ascii"),
+        "chars": len(text),
+        "extracted_at": datetime.utcnow().isoformat()
+    })
+
+def unpack_extracted_text(processing_result: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Распаковать (хэш, текст) из processing_result; None, если кэша нет"""
+    if not processing_result:
+        return None
+    try:
+        data = json.loads(processing_result)
+        if data.get("compression") != "zlib" or data.get("version", 1) != EXTRACTED_TEXT_VERSION:
+            return None
+        text = zlib.decompress(base64.b64decode(data["text"])).decode("utf-8")
+        return data["content_hash"], text
+    except (ValueError, KeyError, TypeError, zlib.error):
+        return None
+
 class DocumentService:
     """Сервис для работы с документами"""
     
@@ -45,19 +81,21 @@ class DocumentService:
         
         # Записываем в БД
         async with get_db_session() as session:
-            document = Document(
-                user_id=user.id,
-                application_id=application_id,
-                file_name=file_name,
-                file_type=file_type,
-                file_size=len(file_data),
-                file_path=file_path,
-                is_processed=False
+            result = await session.execute(
+                insert(Document)
+                .values(
+                    user_id=user.id,
+                    application_id=application_id,
+                    file_name=file_name,
+                    file_type=file_type,
+                    file_size=len(file_data),
+                    file_path=file_path,
+                    content_hash=content_hash(file_data),
+                    is_processed=False
+                )
+                .returning(Document)
             )
-            
-            session.add(document)
-            await session.commit()
-            await session.refresh(document)
+            document = result.scalars().one()
             
             logger.info(f"Документ {file_name} сохранен для пользователя {user.id}")
             return document
@@ -104,7 +142,53 @@ class DocumentService:
                     processing_result=str(processing_result)
                 )
             )
-            await session.commit()
+            await session.flush()
+            return True
+    
+    async def find_extracted_texts(self, content_hashes: List[str]) -> Dict[str, str]:
+        """Найти уже извлеченные тексты по хэшам содержимого"""
+        if not content_hashes:
+            return {}
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(Document.processing_result)
+                .where(Document.content_hash.in_(set(content_hashes)))
+                .where(Document.is_processed == True)
+            )
+            
+            texts = {}
+            for processing_result in result.scalars():
+                cached = unpack_extracted_text(processing_result)
+                if cached:
+                    texts[cached[0]] = cached[1]
+            return texts
+    
+    async def save_extracted_text(self, document_id: int, file_hash: str, text: str) -> bool:
+        """Сохранить извлеченный текст документа в сжатом виде"""
+        async with get_db_session() as session:
+            await session.execute(
+                update(Document)
+                .where(Document.id == document_id)
+                .values(
+                    content_hash=file_hash,
+                    is_processed=True,
+                    processed_at=datetime.utcnow(),
+                    processing_result=pack_extracted_text(file_hash, text)
+                )
+            )
+            await session.flush()
+            return True
+    
+    async def save_tradelines(self, document_id: int, data: bytes) -> bool:
+        """Сохранить упакованные записи о кредитах документа"""
+        async with get_db_session() as session:
+            await session.execute(
+                update(Document)
+                .where(Document.id == document_id)
+                .values(tradelines=data)
+            )
+            await session.flush()
             return True
     
     async def validate_file_format(self, file_name: str) -> bool:
@@ -138,7 +222,7 @@ class DocumentService:
             # Удаляем из БД
             async with get_db_session() as session:
                 await session.delete(document)
-                await session.commit()
+                await session.flush()
             
             logger.info(f"Документ {document.id} удален")
             return True
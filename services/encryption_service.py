@@ -2,11 +2,58 @@ from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import base64
+import hashlib
 import os
-from typing import Union
+import threading
+from typing import Dict, Union
 
 from config.settings import get_settings
 
+KDF_SALT = b'stable_salt_for_credit_history_bot'  # В продакшене должен быть случайным
+KDF_ITERATIONS = 100000
+
+def derive_key(password: bytes) -> bytes:
+    """Получить ключ Fernet из пароля (PBKDF2, дорогая операция)"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=KDF_SALT,
+        iterations=KDF_ITERATIONS,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
+class Keyring:
+    """Процессный кэш шифров: каждый ключ выводится через PBKDF2 один раз"""
+    
+    def __init__(self):
+        self._ciphers: Dict[bytes, Fernet] = {}
+        self._lock = threading.Lock()
+        self.derivations = 0
+    
+    def get_cipher(self, password: bytes) -> Fernet:
+        """Получить общий шифр для пароля (Fernet потокобезопасен)"""
+        # Храним не сам пароль, а его отпечаток
+        fingerprint = hashlib.sha256(password).digest()
+        
+        cipher = self._ciphers.get(fingerprint)
+        if cipher is not None:
+            return cipher
+        
+        with self._lock:
+            cipher = self._ciphers.get(fingerprint)
+            if cipher is None:
+                cipher = Fernet(derive_key(password))
+                self._ciphers[fingerprint] = cipher
+                self.derivations += 1
+            return cipher
+    
+    def clear(self):
+        """Сбросить кэш (например, после ротации ключа)"""
+        with self._lock:
+            self._ciphers.clear()
+
+keyring = Keyring()
+
 class EncryptionService:
     """Сервис для шифрования персональных данных"""
     
@@ -18,19 +65,8 @@ class EncryptionService:
         """Инициализация cipher для шифрования"""
         settings = get_settings()
         
-        # Генерируем ключ из пароля
-        password = settings.ENCRYPTION_KEY.encode()
-        salt = b'stable_salt_for_credit_history_bot'  # В продакшене должен быть случайным
-        
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        self._fernet = Fernet(key)
+        # Ключ выводится из пароля один раз на процесс
+        self._fernet = keyring.get_cipher(settings.ENCRYPTION_KEY.encode())
     
     def encrypt(self, data: str) -> bytes:
         """Зашифровать строку"""
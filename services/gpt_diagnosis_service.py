@@ -3,27 +3,53 @@ import json
 import asyncio
 import aiofiles
 from datetime import datetime
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Tuple, Callable
 from sqlalchemy import select, update
 
 from database.models import Document, User, Application, DocumentType
-from database.database import get_db_session
-from services.document_service import DocumentService
+from database.database import get_db_session, outside_unit_of_work
+from services.document_service import DocumentService, content_hash, unpack_extracted_text
+from services.pdf_extractor import pdf_extractor
+from services.text_reducer import text_reducer
+from services.tradeline_parser import tradeline_parser, pack_tradelines, unpack_tradelines, pd
+from services.llm_cache import llm_cache
+from services.openai_client import openai_client, ResponseTruncatedError
+from services.chunk_planner import (
+    plan_chunks, merge_block_reports, replace_blocks, BlockStreamParser, BLOCK_TITLES, SEVERITY,
+    BlockReport, RESPONSE_FORMAT, parse_json_report, parse_text_report, render_report, report_summary
+)
+from services.reconciliation import reconcile
+from services.pdn_calculator import calculate_debt_load, format_debt_load
+from services.payment_grid import analyze_payment_grid
+from services.application_service import ApplicationService
 from config.settings import get_settings
 import logging
 
-# Для работы с PDF и извлечения текста
-try:
-    import PyMuPDF as fitz  # pip install PyMuPDF
-except ImportError:
-    fitz = None
+logger = logging.getLogger(__name__)
 
-try:
-    import openai  # pip install openai
-except ImportError:
-    openai = None
+# Обработчик готового блока ответа: (номер, название, критичность)
+BlockCallback = Callable[[int, str, Optional[str]], None]
 
-logger = logging.getLogger(__name__)
+# Параметры запроса к GPT; PROMPT_VERSION повышается при правке промпта
+# Ответ - JSON по строгой схеме (structured outputs), поэтому нужна модель
+# с их поддержкой
+GPT_MODEL = "gpt-4o"
+GPT_PARAMS = {
+    "max_tokens": 4000,
+    "temperature": 0.1,  # Минимальная креативность
+    "response_format": RESPONSE_FORMAT
+}
+# Лимит ответа для повтора, если ответ обрезан по max_tokens
+# (предел ответа gpt-4o - 16384 токена)
+GPT_RETRY_MAX_TOKENS = 16000
+PROMPT_VERSION = "ki-analyst-3"
+
+async def _none() -> None:
+    return None
+
+def _is_broken_json(response: str) -> bool:
+    """Ответ начинается как JSON, но не разбирается по схеме"""
+    return response.lstrip().startswith("{") and parse_json_report(response) is None
 
 class GPTDiagnosisService:
     """Сервис для анализа кредитной истории через GPT"""
@@ -31,17 +57,20 @@ class GPTDiagnosisService:
     def __init__(self):
         self.settings = get_settings()
         self.document_service = DocumentService()
-        
-        # Настраиваем OpenAI
-        if openai:
-            openai.api_key = getattr(self.settings, 'OPENAI_API_KEY', None)
     
     async def analyze_credit_history(
         self, 
         user_id: int, 
-        application_id: Optional[int] = None
+        application_id: Optional[int] = None,
+        on_block: Optional[BlockCallback] = None,
+        expected_version: Optional[int] = None
     ) -> Dict[str, Any]:
-        """Главный метод анализа кредитной истории"""
+        """Главный метод анализа кредитной истории
+        
+        on_block вызывается для каждого блока, как только он готов
+        в потоке ответа GPT (для показа хода диагностики). С expected_version
+        результат сохраняется, только если версия заявки не изменилась.
+        """
         
         try:
             logger.info(f"Начинаем анализ КИ для пользователя {user_id}")
@@ -65,25 +94,64 @@ class GPTDiagnosisService:
                     "error": "Не удалось извлечь текст из документов"
                 }
             
-            # 3. Объединяем тексты БКИ
-            combined_text = await self._combine_bki_texts(extracted_texts)
+            # Блоки 6, 8 и 9 - сверка записей о кредитах между БКИ, без GPT
+            tradelines = self._collect_tradelines(documents)
+            combined_tradelines = self._combine_tradelines(tradelines)
+            reconciled = reconcile(tradelines)
+            if reconciled:
+                logger.info(f"Блоки {', '.join(map(str, reconciled))} рассчитаны сверкой записей")
+                if on_block:
+                    for number, (severity, _) in reconciled.items():
+                        on_block(number, BLOCK_TITLES[number], severity)
+                    on_block = self._skip_blocks(on_block, reconciled)
+            
+            # 3. Раскладываем отчеты БКИ по частям в пределах бюджета токенов
+            chunks = plan_chunks(
+                self._order_bki_blocks(extracted_texts),
+                self.settings.GPT_CHUNK_MAX_TOKENS
+            )
+            chunk_texts = [
+                self._format_bki_blocks(chunk, part=index, parts=len(chunks))
+                for index, chunk in enumerate(chunks, start=1)
+            ]
+            
+            # Кредитная нагрузка считается по записям, GPT получает готовые числа
+            # один раз - вместе с первой частью
+            debt_load = await self._calculate_debt_load(application_id, combined_tradelines)
+            if debt_load:
+                chunk_texts[0] = f"{format_debt_load(debt_load)}\n\n{chunk_texts[0]}"
             
-            # 4. Проверяем лимит символов (120,000)
-            if len(combined_text) > 120000:
-                logger.warning(f"Текст превышает лимит: {len(combined_text)} символов")
-                combined_text = combined_text[:120000] + "\n[ТЕКСТ ОБРЕЗАН]"
+            text_length = sum(len(text) for text in chunk_texts)
             
-            # 5. Отправляем в GPT на анализ
-            gpt_result = await self._send_to_gpt(combined_text)
+            logger.info(f"Объединенный текст: {text_length} символов, частей: {len(chunks)}")
+            
+            # 4-5. Анализируем части параллельно (map)
+            gpt_result = await self._analyze_chunks(chunk_texts, on_block, skip_blocks=tuple(reconciled))
             
             if not gpt_result["success"]:
                 return gpt_result
             
-            # 6. Парсим результат GPT
-            analysis_result = await self._parse_gpt_response(gpt_result["response"])
+            # 6. Разбираем ответы GPT и сводим находки частей в один отчет
+            # из 12 блоков (reduce)
+            reports = [await self._parse_gpt_response(response) for response in gpt_result["responses"]]
+            report = reports[0]
+            if len(chunks) > 1:
+                report = merge_block_reports(
+                    [", ".join(name for name, _ in chunk) for chunk in chunks],
+                    reports
+                )
+            
+            # Подставляем рассчитанные сверкой блоки и проверку платежных строк
+            payment_findings = analyze_payment_grid(combined_tradelines)
+            additions = self._payment_discipline_block(combined_tradelines, payment_findings)
+            report = replace_blocks(report, reconciled, additions)
+            
+            analysis_result = self._build_analysis_result(report)
+            analysis_result["debt_load"] = debt_load
+            analysis_result["payment_discipline"] = payment_findings
             
             # 7. Сохраняем результат
-            await self._save_analysis_result(user_id, application_id, analysis_result)
+            await self._save_analysis_result(user_id, application_id, analysis_result, report, expected_version)
             
             logger.info(f"Анализ КИ завершен для пользователя {user_id}")
             
@@ -91,7 +159,9 @@ class GPTDiagnosisService:
                 "success": True,
                 "analysis": analysis_result,
                 "documents_analyzed": len(documents),
-                "text_length": len(combined_text)
+                "text_length": text_length,
+                "chunks": len(chunks),
+                "reconciled_blocks": sorted(reconciled)
             }
             
         except Exception as e:
@@ -106,7 +176,12 @@ class GPTDiagnosisService:
         user_id: int, 
         application_id: Optional[int] = None
     ) -> List[Document]:
-        """Получить документы БКИ пользователя"""
+        """Получить документы БКИ пользователя: самый новый отчет каждого БКИ
+        
+        Повторная загрузка отчета того же бюро (исправленный отчет, из-за
+        которого вытесняется идущая диагностика) заменяет прежний; старые
+        отчеты не извлекаются и не анализируются.
+        """
         
         async with get_db_session() as session:
             query = select(Document).where(
@@ -121,10 +196,13 @@ class GPTDiagnosisService:
             if application_id:
                 query = query.where(Document.application_id == application_id)
             
-            query = query.order_by(Document.uploaded_at.desc())
+            query = query.order_by(Document.uploaded_at.desc(), Document.id.desc())
             result = await session.execute(query)
             
-            documents = result.scalars().all()
+            latest: Dict[DocumentType, Document] = {}
+            for document in result.scalars():
+                latest.setdefault(document.file_type, document)
+            documents = list(latest.values())
             
             logger.info(f"Найдено {len(documents)} документов БКИ для пользователя {user_id}")
             return documents
@@ -133,70 +211,230 @@ class GPTDiagnosisService:
         self, 
         documents: List[Document]
     ) -> Dict[str, str]:
-        """Извлечь текст из PDF документов"""
+        """Извлечь текст из PDF документов
         
-        extracted_texts = {}
+        Текст каждого документа кэшируется в Document.processing_result по
+        SHA-256 содержимого, поэтому повторная диагностика не читает файлы
+        и не разбирает PDF заново.
+        """
+        
+        texts: Dict[int, str] = {}
+        to_save: List[Tuple[int, str, str]] = []
         
+        # 1. Собственный кэш документа
         for document in documents:
+            cached = unpack_extracted_text(document.processing_result) if document.is_processed else None
+            if cached and (document.content_hash is None or cached[0] == document.content_hash):
+                texts[document.id] = cached[1]
+        
+        # 2. Тот же файл мог быть загружен и разобран раньше под другим документом
+        missing = [d for d in documents if d.id not in texts]
+        shared = await self.document_service.find_extracted_texts(
+            [d.content_hash for d in missing if d.content_hash]
+        )
+        for document in missing:
+            if document.content_hash in shared:
+                texts[document.id] = shared[document.content_hash]
+                to_save.append((document.id, document.content_hash, texts[document.id]))
+        
+        cache_hits = len(texts)
+        
+        # 3. Файлы читаются для документов без текста или без записей о кредитах;
+        # извлечение текста и разбор таблиц идут параллельно
+        pending = [d for d in documents if d.id not in texts or self._needs_tradelines(d)]
+        results = await asyncio.gather(
+            *[self._extract_text_from_document(document, need_text=document.id not in texts)
+              for document in pending]
+        )
+        tradelines_to_save: List[Tuple[int, bytes]] = []
+        for document, result in zip(pending, results):
+            if not result:
+                continue
+            file_hash, text, tradelines = result
+            if text:
+                texts[document.id] = text
+                to_save.append((document.id, file_hash, text))
+            if tradelines is not None:
+                document.tradelines = pack_tradelines(tradelines)
+                tradelines_to_save.append((document.id, document.tradelines))
+        
+        logger.info(
+            f"Тексты документов: из кэша {cache_hits}, извлечено {len(texts) - cache_hits}, "
+            f"не удалось {len(documents) - len(texts)}; "
+            f"разобрано записей о кредитах: {len(tradelines_to_save)}"
+        )
+        
+        # 4. Сохраняем новые тексты и записи одной транзакцией
+        if to_save or tradelines_to_save:
             try:
-                # Читаем файл
-                file_data = await self.document_service.get_file_data(document)
-                
-                if not file_data:
-                    logger.warning(f"Не удалось прочитать файл {document.file_name}")
-                    continue
-                
-                # Извлекаем текст
-                text = await self._extract_text_from_pdf(file_data, document.file_name)
-                
-                if text:
-                    # Определяем тип БКИ
-                    bki_type = self._determine_bki_type(document.file_type, text)
-                    extracted_texts[bki_type] = text
-                    
-                    logger.info(f"Извлечен текст из {document.file_name}: {len(text)} символов")
-                
+                async with get_db_session():
+                    for document_id, file_hash, text in to_save:
+                        await self.document_service.save_extracted_text(document_id, file_hash, text)
+                    for document_id, data in tradelines_to_save:
+                        await self.document_service.save_tradelines(document_id, data)
             except Exception as e:
-                logger.error(f"Ошибка извлечения текста из {document.file_name}: {e}")
-                continue
+                logger.error(f"Не удалось сохранить извлеченные тексты: {e}")
+        
+        extracted_texts = {}
+        for document in documents:
+            text = texts.get(document.id)
+            if text:
+                # Определяем тип БКИ
+                bki_type = self._determine_bki_type(document.file_type, text)
+                extracted_texts[bki_type] = text
+                
+                logger.info(f"Текст {document.file_name}: {len(text)} символов")
         
         return extracted_texts
     
-    async def _extract_text_from_pdf(
+    async def _extract_text_from_document(
         self, 
-        file_data: bytes, 
-        file_name: str
-    ) -> Optional[str]:
-        """Извлечь текст из PDF файла"""
+        document: Document, 
+        need_text: bool = True
+    ) -> Optional[Tuple[str, Optional[str], Optional["pd.DataFrame"]]]:
+        """Прочитать файл документа, извлечь текст и записи о кредитах
         
-        if not fitz:
-            logger.error("PyMuPDF не установлен. Используйте: pip install PyMuPDF")
-            return None
+        Возвращает (хэш, текст, записи); текст извлекается только при
+        need_text, записи - только если их еще нет у документа.
+        """
         
         try:
-            # Открываем PDF из байтов
-            pdf_document = fitz.open(stream=file_data, filetype="pdf")
-            
-            text_parts = []
-            
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document.load_page(page_num)
-                text = page.get_text()
-                text_parts.append(text)
-            
-            pdf_document.close()
-            
-            full_text = "\n".join(text_parts)
-            
-            # Базовая очистка текста
-            full_text = self._clean_extracted_text(full_text)
+            # Читаем файл
+            file_data = await self.document_service.get_file_data(document)
+            
+            if not file_data:
+                logger.warning(f"Не удалось прочитать файл {document.file_name}")
+                return None
+            
+            # Извлекаем текст и таблицы договоров
+            text, tradelines = await asyncio.gather(
+                self._extract_text_from_pdf(file_data, document) if need_text else _none(),
+                self._extract_tradelines_from_pdf(file_data, document)
+                if self._needs_tradelines(document) else _none()
+            )
+            if need_text and not text and tradelines is None:
+                return None
             
-            return full_text
+            return content_hash(file_data), text, tradelines
             
         except Exception as e:
-            logger.error(f"Ошибка извлечения текста из PDF {file_name}: {e}")
+            logger.error(f"Ошибка извлечения текста из {document.file_name}: {e}")
             return None
     
+    async def _extract_text_from_pdf(
+        self, 
+        file_data: bytes, 
+        document: Document
+    ) -> Optional[str]:
+        """Извлечь текст из PDF файла (разбор идет в пуле процессов)"""
+        
+        pages = await pdf_extractor.extract_pages(file_data, document.file_name)
+        
+        if pages is None:
+            return None
+        
+        # Убираем колонтитулы, оговорки и страницы без договоров
+        bureau = self._determine_bki_type(document.file_type, "")
+        full_text = text_reducer.reduce(pages, bureau, document.file_name)
+        
+        # Базовая очистка текста
+        return self._clean_extracted_text(full_text)
+    
+    def _collect_tradelines(self, documents: List[Document]) -> Dict[str, Optional["pd.DataFrame"]]:
+        """Записи о кредитах по БКИ
+        
+        Записи берутся из Document.tradelines уже загруженных документов
+        (самый новый отчет каждого БКИ); разбираются заново только отчеты
+        без сохраненных записей - см. _needs_tradelines.
+        """
+        
+        tradelines = {}
+        for document in documents:
+            bureau = self._determine_bki_type(document.file_type, "")
+            tradelines[bureau] = unpack_tradelines(document.tradelines)
+        return dict(self._order_bki_blocks(tradelines))
+    
+    async def _calculate_debt_load(
+        self, 
+        application_id: Optional[int], 
+        tradelines: Optional["pd.DataFrame"]
+    ) -> Optional[Dict[str, Any]]:
+        """Кредитная нагрузка по записям отчетов и параметрам заявки"""
+        
+        if tradelines is None:
+            return None
+        
+        loan_amount = monthly_income = None
+        if application_id:
+            async with get_db_session() as session:
+                row = (await session.execute(
+                    select(Application.loan_amount, Application.monthly_income)
+                    .where(Application.id == application_id)
+                )).first()
+                if row:
+                    loan_amount, monthly_income = row
+        
+        return calculate_debt_load(
+            tradelines,
+            loan_amount,
+            monthly_income,
+            self.settings.PDN_ANNUAL_RATE,
+            self.settings.PDN_TERM_MONTHS
+        )
+    
+    def _combine_tradelines(
+        self, 
+        tradelines: Dict[str, Optional["pd.DataFrame"]]
+    ) -> Optional["pd.DataFrame"]:
+        """Записи всех отчетов одной таблицей; None, если записей нет"""
+        
+        frames = [frame for frame in tradelines.values() if frame is not None and not frame.empty]
+        if not frames:
+            return None
+        return pd.concat(frames, ignore_index=True)
+    
+    def _payment_discipline_block(
+        self, 
+        tradelines: Optional["pd.DataFrame"], 
+        findings: List[Dict[str, Any]]
+    ) -> Dict[int, Tuple[Optional[str], List[str]]]:
+        """Находки по платежным строкам как дополнение к блоку 7"""
+        
+        if tradelines is None:
+            return {}
+        
+        lines = ["Проверка платежных строк по записям отчетов:"]
+        lines.extend(f"- {finding['text']}" for finding in findings)
+        if not findings:
+            lines.append("- нарушений не выявлено")
+        
+        severities = [finding["severity"] for finding in findings]
+        severity = min(severities, key=SEVERITY.index) if severities else "🟩"
+        return {7: (severity, lines)}
+    
+    def _skip_blocks(self, on_block: BlockCallback, blocks: Dict[int, Any]) -> BlockCallback:
+        """Обработчик блоков, пропускающий уже рассчитанные без GPT"""
+        
+        def filtered(number: int, title: str, severity: Optional[str]):
+            if number not in blocks:
+                on_block(number, title, severity)
+        
+        return filtered
+    
+    def _needs_tradelines(self, document: Document) -> bool:
+        """Записи о кредитах документа еще не разобраны"""
+        return document.tradelines is None and tradeline_parser.available
+    
+    async def _extract_tradelines_from_pdf(
+        self, 
+        file_data: bytes, 
+        document: Document
+    ) -> Optional["pd.DataFrame"]:
+        """Разобрать таблицы договоров отчета БКИ в записи о кредитах"""
+        
+        bureau = self._determine_bki_type(document.file_type, "")
+        return await tradeline_parser.parse(file_data, document.file_name, bureau)
+    
     def _clean_extracted_text(self, text: str) -> str:
         """Очистка извлеченного текста"""
         
@@ -239,103 +477,225 @@ class GPTDiagnosisService:
         else:
             return "БКИ_Неизвестный"
     
-    async def _combine_bki_texts(self, extracted_texts: Dict[str, str]) -> str:
-        """Объединить тексты БКИ в один файл"""
+    def _order_bki_blocks(self, extracted_texts: Dict[str, Any]) -> List[Tuple[str, Any]]:
+        """Отчеты БКИ в порядке протокола: НБКИ, ОКБ, Эквифакс, затем остальные"""
+        
+        bki_order = ["НБКИ", "ОКБ", "Эквифакс"]
+        
+        blocks = [(name, extracted_texts[name]) for name in bki_order if name in extracted_texts]
+        blocks.extend(
+            (name, text) for name, text in extracted_texts.items() if name not in bki_order
+        )
+        return blocks
+    
+    def _format_bki_blocks(
+        self, 
+        blocks: List[Tuple[str, str]], 
+        part: int = 1, 
+        parts: int = 1
+    ) -> str:
+        """Оформить отчеты БКИ в размеченный текст для GPT"""
         
         combined_parts = []
         
         # Заголовок
-        combined_parts.append("=== ОБЪЕДИНЕННЫЙ ОТЧЕТ КРЕДИТНОЙ ИСТОРИИ ===\n")
+        title = "=== ОБЪЕДИНЕННЫЙ ОТЧЕТ КРЕДИТНОЙ ИСТОРИИ ==="
+        if parts > 1:
+            title += f" (часть {part} из {parts})"
+        combined_parts.append(title + "\n")
+        
+        for bki_name, text in blocks:
+            combined_parts.append(f"\n{'='*50}")
+            combined_parts.append(f"БЛОК: ОТЧЕТ {bki_name}")
+            combined_parts.append(f"{'='*50}\n")
+            combined_parts.append(text)
+            combined_parts.append(f"\n{'='*50}")
+            combined_parts.append(f"КОНЕЦ БЛОКА {bki_name}")
+            combined_parts.append(f"{'='*50}\n")
+        
+        return "\n".join(combined_parts)
+    
+    async def _analyze_chunks(
+        self, 
+        chunk_texts: List[str], 
+        on_block: Optional[BlockCallback] = None,
+        skip_blocks: Tuple[int, ...] = ()
+    ) -> Dict[str, Any]:
+        """Отправить части в GPT параллельно, не более GPT_MAX_CONCURRENCY запросов сразу"""
         
-        # Порядок БКИ как в протоколе: НБКИ, ОКБ, Эквифакс
-        bki_order = ["НБКИ", "ОКБ", "Эквифакс"]
+        semaphore = asyncio.Semaphore(self.settings.GPT_MAX_CONCURRENCY)
         
-        for bki_name in bki_order:
-            if bki_name in extracted_texts:
-                combined_parts.append(f"\n{'='*50}")
-                combined_parts.append(f"БЛОК: ОТЧЕТ {bki_name}")
-                combined_parts.append(f"{'='*50}\n")
-                combined_parts.append(extracted_texts[bki_name])
-                combined_parts.append(f"\n{'='*50}")
-                combined_parts.append(f"КОНЕЦ БЛОКА {bki_name}")
-                combined_parts.append(f"{'='*50}\n")
-        
-        # Добавляем остальные БКИ если есть
-        for bki_name, text in extracted_texts.items():
-            if bki_name not in bki_order:
-                combined_parts.append(f"\n{'='*50}")
-                combined_parts.append(f"БЛОК: ОТЧЕТ {bki_name}")
-                combined_parts.append(f"{'='*50}\n")
-                combined_parts.append(text)
-                combined_parts.append(f"\n{'='*50}")
-                combined_parts.append(f"КОНЕЦ БЛОКА {bki_name}")
-                combined_parts.append(f"{'='*50}\n")
-        
-        combined_text = "\n".join(combined_parts)
-        
-        logger.info(f"Объединенный текст: {len(combined_text)} символов")
-        
-        return combined_text
+        async def analyze(text: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._send_to_gpt(text, on_block, skip_blocks)
+        
+        # Каждой части - свои короткие сессии кэша: одну сессию
+        # нельзя использовать из нескольких задач сразу
+        with outside_unit_of_work():
+            results = await asyncio.gather(*[analyze(text) for text in chunk_texts])
+        
+        for result in results:
+            if not result["success"]:
+                return result
+        
+        return {
+            "success": True,
+            "response": results[0]["response"],
+            "responses": [result["response"] for result in results],
+            "tokens_used": sum(result.get("tokens_used") or 0 for result in results),
+            "cached_chunks": sum(1 for result in results if result.get("cached"))
+        }
     
-    async def _send_to_gpt(self, combined_text: str) -> Dict[str, Any]:
-        """Отправить текст в GPT на анализ"""
+    async def _send_to_gpt(
+        self, 
+        combined_text: str, 
+        on_block: Optional[BlockCallback] = None,
+        skip_blocks: Tuple[int, ...] = ()
+    ) -> Dict[str, Any]:
+        """Отправить текст в GPT на анализ
         
-        if not openai or not openai.api_key:
+        С on_block и включенным GPT_STREAMING ответ читается потоком,
+        и о каждом блоке сообщается сразу, не дожидаясь конца ответа.
+        Блоки skip_blocks рассчитаны без GPT, модель их не анализирует.
+        """
+        
+        if not openai_client.configured:
             return {
                 "success": False,
                 "error": "OpenAI API не настроен"
             }
         
         # Читаем промпт
-        prompt = await self._get_analysis_prompt()
+        prompt = await self._get_analysis_prompt(skip_blocks)
+        
+        # Тот же текст с тем же промптом уже мог быть проанализирован
+        cache_key = llm_cache.make_key(GPT_MODEL, PROMPT_VERSION, prompt, combined_text, GPT_PARAMS)
+        try:
+            cached = await llm_cache.get(cache_key)
+        except Exception as e:
+            logger.error(f"Ошибка чтения кэша ответов GPT: {e}")
+            cached = None
+        
+        if cached and _is_broken_json(cached["response"]):
+            # Обрезанный ответ, сохраненный до проверки finish_reason
+            logger.warning("Ответ GPT в кэше - неполный JSON, запрашиваем заново")
+            cached = None
+        
+        if cached:
+            logger.info(f"Ответ GPT взят из кэша: {len(cached['response'])} символов")
+            if on_block:
+                parser = BlockStreamParser()
+                for event in parser.feed(cached["response"]) + parser.close():
+                    on_block(*event)
+            return {
+                "success": True,
+                "response": cached["response"],
+                "tokens_used": cached["tokens_used"],
+                "cached": True
+            }
         
         try:
             logger.info("Отправляем запрос в GPT...")
             
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-4",  # или gpt-3.5-turbo для экономии
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": prompt
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"Проанализируй кредитную историю:\n\n{combined_text}"
-                    }
-                ],
-                max_tokens=4000,
-                temperature=0.1  # Минимальная креативность
-            )
+            messages = [
+                {
+                    "role": "system", 
+                    "content": prompt
+                },
+                {
+                    "role": "user", 
+                    "content": f"Проанализируй кредитную историю:\n\n{combined_text}"
+                }
+            ]
             
-            gpt_response = response.choices[0].message.content
+            try:
+                gpt_response, tokens_used = await self._request_gpt(messages, on_block, GPT_PARAMS)
+            except ResponseTruncatedError as e:
+                # Обрезанный JSON не разобрать - один повтор с большим лимитом,
+                # если не хватит и его, задача диагностики завершится ошибкой
+                logger.warning(f"{e}, повтор с max_tokens={GPT_RETRY_MAX_TOKENS}")
+                gpt_response, tokens_used = await self._request_gpt(
+                    messages,
+                    on_block,
+                    {**GPT_PARAMS, "max_tokens": GPT_RETRY_MAX_TOKENS}
+                )
             
             logger.info(f"Получен ответ от GPT: {len(gpt_response)} символов")
             
-            return {
-                "success": True,
-                "response": gpt_response,
-                "tokens_used": response.usage.total_tokens
-            }
-            
         except Exception as e:
             logger.error(f"Ошибка запроса к GPT: {e}")
             return {
                 "success": False,
                 "error": f"Ошибка GPT API: {str(e)}"
             }
+        
+        try:
+            await llm_cache.put(
+                cache_key,
+                GPT_MODEL,
+                PROMPT_VERSION,
+                gpt_response,
+                tokens_used
+            )
+        except Exception as e:
+            logger.error(f"Ошибка записи в кэш ответов GPT: {e}")
+        
+        return {
+            "success": True,
+            "response": gpt_response,
+            "tokens_used": tokens_used,
+            "cached": False
+        }
+    
+    async def _request_gpt(
+        self, 
+        messages: List[Dict[str, str]], 
+        on_block: Optional[BlockCallback], 
+        params: Dict[str, Any]
+    ) -> Tuple[str, Optional[int]]:
+        """Один запрос к GPT: потоком, если нужен ход анализа по блокам"""
+        
+        if on_block and self.settings.GPT_STREAMING:
+            return await self._stream_from_gpt(messages, on_block, params)
+        return await openai_client.chat(GPT_MODEL, messages, **params)
     
-    async def _get_analysis_prompt(self) -> str:
+    async def _stream_from_gpt(
+        self, 
+        messages: List[Dict[str, str]], 
+        on_block: BlockCallback, 
+        params: Dict[str, Any]
+    ) -> Tuple[str, Optional[int]]:
+        """Получить ответ GPT потоком, разбирая блоки по мере поступления
+        
+        Блоки обрезанного ответа, о которых уже сообщено, при повторе
+        приходят снова; on_block это допускает.
+        """
+        
+        parser = BlockStreamParser()
+        parts = []
+        
+        async for delta in openai_client.stream_chat(GPT_MODEL, messages, **params):
+            parts.append(delta)
+            for event in parser.feed(delta):
+                on_block(*event)
+        
+        for event in parser.close():
+            on_block(*event)
+        
+        # В потоковом режиме API не сообщает расход токенов
+        return "".join(parts), None
+    
+    async def _get_analysis_prompt(self, skip_blocks: Tuple[int, ...] = ()) -> str:
         """Получить промпт для анализа"""
         
         # Возвращаем промпт из нашего файла
         # TODO: Можно вынести в отдельный файл или настройки
         
-        return """🧠 ПОДРОБНЫЙ ПРОМТ: КИ-Аналитик (1-й этап — поиск ошибок и расчёты)
+        prompt = """🧠 ПОДРОБНЫЙ ПРОМТ: КИ-Аналитик (1-й этап — поиск ошибок и расчёты)
 Ты — технический аналитик кредитной истории. Работаешь по трём отчётам БКИ (НБКИ, ОКБ, Эквифакс) и анкете клиента. На выходе ты должен:
 Найти все ошибки, дубли, противоречия;
 Выявить стоп-факторы и технические слабые места;
-Рассчитать текущую кредитную нагрузку (ПДН, платежи, просрочки);
+Использовать кредитную нагрузку (ПДН, платежи, просрочки) из блока «КРЕДИТНАЯ НАГРУЗКА» как она дана, не пересчитывая; если этого блока в тексте нет — нагрузку не рассчитывать;
 Выдать по каждому блоку чёткий отчёт: что найдено, где, почему это критично.
 
 📋 ОБЩИЕ ПРАВИЛА ДЛЯ GPT:
@@ -362,80 +722,88 @@ class GPTDiagnosisService:
 Блок 11. Неверные параметры договоров
 Блок 12. Незаконные запросы
 
-ФОРМАТ КАЖДОГО БЛОКА:
-Блок X. Название
-Критичность: 🟥/🟨/🟩
-[Описание найденных ошибок с указанием источника]
+ФОРМАТ ОТВЕТА - JSON строго по схеме:
+{"blocks": [{"number": X, "title": "Название", "severity": "🟥"/"🟨"/"🟩" или null, "findings": ["..."]}]}
+Все 12 блоков по порядку номеров. severity: 🟥 - критично, 🟨 - важно, 🟩 - ошибок не выявлено, null - нет данных.
+findings - найденные ошибки, каждая отдельной строкой с указанием источника;
+если ошибок нет - ["ошибок не выявлено"], если нет информации - ["нет данных"].
+Итоговый статус анализа не нужен - он считается программно."""
+        
+        if skip_blocks:
+            numbers = ", ".join(map(str, skip_blocks))
+            prompt += f"""
 
-В КОНЦЕ ОБЯЗАТЕЛЬНО:
-Статус анализа:
-Всего блоков обработано: 12
-Блоков с ошибками: N
-Блоков без ошибок: M  
-Блоков с отсутствием данных: K"""
-    
-    async def _parse_gpt_response(self, gpt_response: str) -> Dict[str, Any]:
-        """Парсинг ответа GPT"""
-        
-        # Базовый парсинг - можно улучшить
-        analysis_result = {
-            "raw_response": gpt_response,
-            "blocks": {},
-            "summary": {},
-            "parsed_at": datetime.utcnow().isoformat()
-        }
-        
-        # Простой парсинг блоков
-        lines = gpt_response.split('\n')
-        current_block = None
-        current_content = []
-        
-        for line in lines:
-            if line.startswith('Блок') and '.' in line:
-                # Сохраняем предыдущий блок
-                if current_block and current_content:
-                    analysis_result["blocks"][current_block] = '\n'.join(current_content)
-                
-                # Начинаем новый блок
-                current_block = line.strip()
-                current_content = [line]
-                
-            elif current_block:
-                current_content.append(line)
+БЛОКИ {numbers} РАССЧИТАНЫ ПРОГРАММНОЙ СВЕРКОЙ ОТЧЁТОВ:
+Не анализируй их. Для каждого из них верни severity null и findings ["рассчитано сверкой"]."""
         
-        # Сохраняем последний блок
-        if current_block and current_content:
-            analysis_result["blocks"][current_block] = '\n'.join(current_content)
+        return prompt
+    
+    async def _parse_gpt_response(self, gpt_response: str) -> BlockReport:
+        """Разбор ответа GPT по блокам"""
+        
+        report = parse_json_report(gpt_response)
+        if report is None:
+            if _is_broken_json(gpt_response):
+                # Разбор текста нашел бы в JSON пустые блоки, и неполный
+                # отчет сохранился бы как готовый
+                raise ValueError("Ответ GPT - неполный JSON")
+            # Ответ без схемы (старая модель или сбой формата) - разбираем текст
+            logger.warning("Ответ GPT не в формате JSON, разбираем как текст")
+            report = parse_text_report(gpt_response)
+        return report
+    
+    def _build_analysis_result(self, report: BlockReport) -> Dict[str, Any]:
+        """Результат анализа для Application.diagnosis_result
         
-        # Ищем статистику
-        if "Статус анализа" in gpt_response:
-            status_section = gpt_response.split("Статус анализа")[-1]
-            analysis_result["summary"]["status_section"] = status_section.strip()
+        Блоки по отдельности хранятся в DiagnosisBlock, здесь - только
+        текст отчета и итоги.
+        """
         
-        return analysis_result
+        return {
+            "raw_response": render_report(report),
+            "summary": report_summary(report),
+            "parsed_at": datetime.utcnow().isoformat()
+        }
     
     async def _save_analysis_result(
         self, 
         user_id: int, 
         application_id: Optional[int], 
-        analysis_result: Dict[str, Any]
+        analysis_result: Dict[str, Any],
+        report: BlockReport,
+        expected_version: Optional[int] = None
     ):
-        """Сохранить результат анализа"""
+        """Сохранить результат анализа и блоки отчета
+        
+        Ошибка записи в базу не перехватывается: диагностика без
+        сохраненного результата не должна считаться завершенной, задача
+        очереди завершится ошибкой и будет повторена. Если версия заявки
+        уже не expected_version, результат устарел и не сохраняется.
+        """
+        
+        # Сохраняем в базу данных
+        if application_id:
+            async with get_db_session() as session:
+                query = update(Application).where(Application.id == application_id)
+                if expected_version is not None:
+                    query = query.where(Application.version == expected_version)
+                
+                result = await session.execute(
+                    query
+                    .values(
+                        diagnosis_result=json.dumps(analysis_result, ensure_ascii=False),
+                        updated_at=datetime.utcnow()
+                    )
+                    .returning(Application.id)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.scalar() is None:
+                    raise RuntimeError(f"Заявка {application_id} изменена во время диагностики, результат устарел")
+                
+                await ApplicationService().save_diagnosis_blocks(application_id, report)
+                await session.flush()
         
         try:
-            # Сохраняем в базу данных
-            if application_id:
-                async with get_db_session() as session:
-                    await session.execute(
-                        update(Application)
-                        .where(Application.id == application_id)
-                        .values(
-                            diagnosis_result=json.dumps(analysis_result, ensure_ascii=False),
-                            updated_at=datetime.utcnow()
-                        )
-                    )
-                    await session.commit()
-            
             # Сохраняем в файл для логирования
             log_dir = "gpt_analysis_logs"
             os.makedirs(log_dir, exist_ok=True)
@@ -449,4 +817,4 @@ class GPTDiagnosisService:
             logger.info(f"Результат анализа сохранен: {log_file}")
             
         except Exception as e:
-            logger.error(f"Ошибка сохранения результата анализа: {e}")
\ No newline at end of file
+            logger.error(f"Ошибка записи лога анализа: {e}")
\ No newline at end of file
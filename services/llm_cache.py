@@ -0,0 +1,163 @@
+import json
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert as postgres_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.models import LLMCacheEntry
+from database.database import get_db_session
+from config.settings import get_settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# INSERT ... ON CONFLICT по диалекту базы
+_UPSERTS = {
+    "sqlite": sqlite_insert,
+    "postgresql": postgres_insert,
+}
+
+class LLMResponseCache:
+    """Персистентный кэш ответов GPT
+    
+    Ключ - SHA-256 от модели, версии промпта, самого промпта, входного
+    текста и параметров запроса: любое изменение дает новый ключ.
+    Записи живут ttl_hours, при превышении max_entries вытесняются
+    давно не использованные.
+    """
+    
+    def __init__(self, ttl_hours: float, max_entries: int):
+        self.ttl = timedelta(hours=ttl_hours)
+        self.max_entries = max_entries
+        
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+    
+    @staticmethod
+    def make_key(
+        model: str,
+        prompt_version: str,
+        prompt: str,
+        text: str,
+        params: Dict[str, Any]
+    ) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "prompt_version": prompt_version,
+                "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+                "text": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+                "params": params
+            },
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    async def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Получить ответ из кэша (просроченные записи не возвращаются)"""
+        now = datetime.utcnow()
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                update(LLMCacheEntry)
+                .where(LLMCacheEntry.cache_key == cache_key)
+                .where(LLMCacheEntry.expires_at > now)
+                .values(hits=LLMCacheEntry.hits + 1, last_used_at=now)
+                .returning(LLMCacheEntry.response, LLMCacheEntry.tokens_used)
+                .execution_options(synchronize_session=False)
+            )
+            row = result.first()
+        
+        if row is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        self.tokens_saved += row.tokens_used or 0
+        return {"response": row.response, "tokens_used": row.tokens_used}
+    
+    async def put(
+        self,
+        cache_key: str,
+        model: str,
+        prompt_version: str,
+        response: str,
+        tokens_used: Optional[int] = None
+    ):
+        """Сохранить ответ и вытеснить лишнее"""
+        now = datetime.utcnow()
+        values = {
+            "cache_key": cache_key,
+            "model": model,
+            "prompt_version": prompt_version,
+            "response": response,
+            "tokens_used": tokens_used,
+            "hits": 0,
+            "created_at": now,
+            "last_used_at": now,
+            "expires_at": now + self.ttl
+        }
+        
+        async with get_db_session() as session:
+            dialect = session.get_bind().dialect.name
+            upsert = _UPSERTS.get(dialect)
+            if upsert is None:
+                raise RuntimeError(f"Кэш ответов GPT не поддерживает базу {dialect}: нужна SQLite или PostgreSQL")
+            
+            # Параллельная диагностика того же текста могла сохранить ответ раньше
+            query = upsert(LLMCacheEntry).values(**values)
+            query = query.on_conflict_do_update(
+                index_elements=[LLMCacheEntry.cache_key],
+                set_={k: query.excluded[k] for k in ("response", "tokens_used", "last_used_at", "expires_at")}
+            )
+            await session.execute(query)
+            self.stores += 1
+            
+            # Просроченные записи
+            result = await session.execute(
+                delete(LLMCacheEntry)
+                .where(LLMCacheEntry.expires_at <= now)
+                .execution_options(synchronize_session=False)
+            )
+            evicted = result.rowcount or 0
+            
+            # Сверх лимита - давно не использованные
+            count = (await session.execute(select(func.count(LLMCacheEntry.id)))).scalar()
+            if count > self.max_entries:
+                oldest = (
+                    select(LLMCacheEntry.id)
+                    .order_by(LLMCacheEntry.last_used_at)
+                    .limit(count - self.max_entries)
+                )
+                result = await session.execute(
+                    delete(LLMCacheEntry)
+                    .where(LLMCacheEntry.id.in_(oldest))
+                    .execution_options(synchronize_session=False)
+                )
+                evicted += result.rowcount or 0
+            
+            if evicted:
+                self.evictions += evicted
+                logger.info(f"Из кэша ответов GPT вытеснено записей: {evicted}")
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "tokens_saved": self.tokens_saved,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+_settings = get_settings()
+llm_cache = LLMResponseCache(
+    ttl_hours=_settings.LLM_CACHE_TTL_HOURS,
+    max_entries=_settings.LLM_CACHE_MAX_ENTRIES
+)
@@ -0,0 +1,202 @@
+import asyncio
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+from sqlalchemy import insert
+
+from database.models import UserLog
+from database.database import get_db_session
+from config.settings import get_settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором пачки, которую не удалось записать (например, база занята)
+WRITE_RETRY_DELAY = 0.5
+
+class UserLogSink:
+    """Асинхронная очередь записей UserLog с пакетной вставкой
+    
+    Записи ставятся в очередь после коммита транзакции, в которой
+    выполнено действие (см. UserService.log_user_action): лог откатившейся
+    транзакции не пишется, а пользователь и заявка из записи уже есть в БД.
+    """
+    
+    def __init__(
+        self,
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        drain_timeout: float = 10.0
+    ):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drain_timeout = drain_timeout
+        
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Пачка, которая пишется сейчас: остановка ее не прерывает
+        self._writing: Optional[asyncio.Future] = None
+        # Записи, взятые из очереди, но не дошедшие до записи к остановке
+        self._unwritten: List[Dict[str, Any]] = []
+        
+        self.accepted = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+    
+    def put_nowait(
+        self,
+        user_id: int,
+        action: str,
+        details: Optional[str] = None,
+        ip_address: Optional[str] = None,
+        created_at: Optional[datetime] = None
+    ) -> bool:
+        """Поставить запись в очередь, не дожидаясь БД; при переполнении запись отбрасывается"""
+        row = {
+            "user_id": user_id,
+            "action": action,
+            "details": details,
+            "ip_address": ip_address,
+            "created_at": created_at or datetime.utcnow()
+        }
+        
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Очередь логов переполнена, запись {action} отброшена")
+            return False
+        
+        self.accepted += 1
+        return True
+    
+    async def _insert(self, batch: List[Dict[str, Any]]) -> Optional[Exception]:
+        """Вставить пачку одним INSERT; возвращает ошибку вместо исключения"""
+        try:
+            async with get_db_session() as session:
+                await session.execute(insert(UserLog), batch)
+        except Exception as e:
+            return e
+        self.written += len(batch)
+        self.batches += 1
+        return None
+    
+    async def _write(self, batch: List[Dict[str, Any]]):
+        """Записать пачку: при ошибке один повтор, затем запись по половинам
+        
+        Повтор переживает временную ошибку (база занята), деление пополам
+        отделяет запись, которую нельзя вставить, от остальных.
+        """
+        error = await self._insert(batch)
+        if error is None:
+            return
+        logger.warning(f"Ошибка записи пачки логов ({len(batch)} записей), повтор: {error}")
+        await asyncio.sleep(WRITE_RETRY_DELAY)
+        if await self._insert(batch) is not None:
+            await self._write_split(batch)
+    
+    async def _write_split(self, batch: List[Dict[str, Any]]):
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            for part in (batch[:middle], batch[middle:]):
+                if await self._insert(part) is not None:
+                    await self._write_split(part)
+            return
+        
+        self.failed += 1
+        logger.error(f"Запись лога {batch[0]['action']} пользователя {batch[0]['user_id']} не записана")
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            
+            # Добираем пачку до batch_size или до истечения интервала
+            try:
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Остановка посреди набора пачки: записи допишет stop()
+                self._unwritten.extend(batch)
+                raise
+            
+            # Отмена при остановке не прерывает запись начатой пачки
+            self._writing = asyncio.ensure_future(self._write(batch))
+            await asyncio.shield(self._writing)
+            self._writing = None
+            for _ in batch:
+                self._queue.task_done()
+    
+    def start(self):
+        """Запустить фоновую запись логов"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Очередь логов запущена: пачка {self.batch_size}, "
+                f"интервал {self.flush_interval} с, емкость {self.queue_size}"
+            )
+    
+    async def stop(self):
+        """Дописать очередь и остановить запись"""
+        if self._task is None:
+            return
+        
+        try:
+            await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Очередь логов не опустела за {self.drain_timeout} с")
+        
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        
+        # Начатая пачка дописывается, а не обрывается
+        if self._writing is not None:
+            await self._writing
+            self._writing = None
+        
+        # Остатки, не попавшие в пачку до остановки
+        leftover, self._unwritten = self._unwritten, []
+        while not self._queue.empty():
+            leftover.append(self._queue.get_nowait())
+        for start in range(0, len(leftover), self.batch_size):
+            await self._write(leftover[start:start + self.batch_size])
+        
+        logger.info(f"Очередь логов остановлена: записано {self.written}, отброшено {self.dropped}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики очереди логов"""
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed
+        }
+
+_settings = get_settings()
+log_sink = UserLogSink(
+    queue_size=_settings.LOG_SINK_QUEUE_SIZE,
+    batch_size=_settings.LOG_SINK_BATCH_SIZE,
+    flush_interval=_settings.LOG_SINK_FLUSH_INTERVAL_SECONDS
+)
@@ -0,0 +1,266 @@
+import asyncio
+import random
+import time
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+
+from config.settings import get_settings
+from services.chunk_planner import estimate_tokens
+import logging
+
+try:
+    import httpx
+    import openai  # pip install openai
+except ImportError:
+    httpx = None
+    openai = None
+
+logger = logging.getLogger(__name__)
+
+class ResponseTruncatedError(Exception):
+    """Ответ обрезан лимитом max_tokens (finish_reason == "length")"""
+
+class TokenBucket:
+    """Ведро токенов: rate единиц в минуту, накопление не больше rate"""
+    
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Дождаться amount единиц; возвращает время ожидания в секундах"""
+        # Запрос больше емкости иначе не прошел бы никогда
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                
+                delay = (amount - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+class OpenAIClient:
+    """Общий асинхронный клиент OpenAI для всего процесса
+    
+    Одно HTTP-соединение с keep-alive на все запросы, ограничения
+    RPM/TPM через ведра токенов, общий лимит одновременных запросов,
+    таймаут на вызов и повторы с экспоненциальной задержкой и
+    джиттером на 429, 5xx и сетевых ошибках.
+    """
+    
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: Optional[str],
+        timeout: float,
+        max_retries: int,
+        retry_backoff: float,
+        rpm_limit: int,
+        tpm_limit: int,
+        max_concurrency: int,
+        max_connections: int
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        
+        self.requests_bucket = TokenBucket(rpm_limit)
+        self.tokens_bucket = TokenBucket(tpm_limit)
+        
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.truncated = 0
+        self.throttled_seconds = 0.0
+    
+    @property
+    def configured(self) -> bool:
+        return openai is not None and bool(self.api_key)
+    
+    def _get_client(self):
+        if self._client is None:
+            # Свои повторы openai отключены: ими управляет _call
+            self._client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=self.timeout,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections
+                    )
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+    
+    def _is_retryable(self, error: Exception) -> bool:
+        # Обрыв соединения при чтении потока приходит от httpx без обертки openai
+        if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, httpx.TransportError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        delay = self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        
+        # Сервер может сам сказать, сколько ждать
+        if isinstance(error, openai.APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                delay = max(delay, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+        return delay
+    
+    async def _throttle(self, messages: List[Dict[str, str]], max_tokens: int):
+        tokens = sum(estimate_tokens(message["content"]) for message in messages) + max_tokens
+        waited = await self.requests_bucket.acquire(1)
+        waited += await self.tokens_bucket.acquire(tokens)
+        if waited:
+            self.throttled_seconds += waited
+            logger.info(f"Запрос к OpenAI задержан лимитами на {waited:.1f} с")
+    
+    async def chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        **params
+    ) -> Tuple[str, Optional[int]]:
+        """Выполнить запрос и вернуть (текст ответа, токенов израсходовано)
+        
+        Ответ, обрезанный лимитом max_tokens, не возвращается:
+        поднимается ResponseTruncatedError.
+        """
+        client = self._get_client()
+        
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(messages, params.get("max_tokens", 0))
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    response = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        **params
+                    )
+            except Exception as e:
+                if not self._is_retryable(e) or attempt == self.max_retries:
+                    self.errors += 1
+                    raise
+                delay = self._retry_delay(e, attempt)
+                self.retries += 1
+                logger.warning(f"Ошибка OpenAI ({e.__class__.__name__}), повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                continue
+            
+            choice = response.choices[0]
+            if choice.finish_reason == "length":
+                self._raise_truncated(params)
+            usage = response.usage.total_tokens if response.usage else None
+            return choice.message.content, usage
+    
+    async def stream_chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        **params
+    ) -> AsyncIterator[str]:
+        """Потоковый запрос: фрагменты текста ответа по мере поступления
+        
+        Повтор возможен только до первого фрагмента, иначе часть
+        ответа уже отдана вызывающему коду. Если поток закончился
+        по лимиту max_tokens, после последнего фрагмента поднимается
+        ResponseTruncatedError.
+        """
+        client = self._get_client()
+        
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(messages, params.get("max_tokens", 0))
+            received = False
+            finish_reason = None
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    stream = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        stream=True,
+                        **params
+                    )
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        choice = chunk.choices[0]
+                        finish_reason = choice.finish_reason or finish_reason
+                        delta = choice.delta.content
+                        if delta:
+                            received = True
+                            yield delta
+                
+            except Exception as e:
+                if received or not self._is_retryable(e) or attempt == self.max_retries:
+                    self.errors += 1
+                    raise
+                delay = self._retry_delay(e, attempt)
+                self.retries += 1
+                logger.warning(f"Ошибка OpenAI ({e.__class__.__name__}), повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                continue
+            
+            if finish_reason == "length":
+                self._raise_truncated(params)
+            return
+    
+    def _raise_truncated(self, params: Dict[str, Any]):
+        # Повтор с тем же лимитом оборвется так же - решает вызывающий код
+        self.truncated += 1
+        raise ResponseTruncatedError(
+            f"Ответ обрезан лимитом max_tokens={params.get('max_tokens')}"
+        )
+    
+    async def close(self):
+        """Закрыть HTTP-соединения"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "truncated": self.truncated,
+            "throttled_seconds": self.throttled_seconds
+        }
+
+_settings = get_settings()
+openai_client = OpenAIClient(
+    api_key=_settings.OPENAI_API_KEY,
+    base_url=_settings.OPENAI_BASE_URL,
+    timeout=_settings.OPENAI_TIMEOUT_SECONDS,
+    max_retries=_settings.OPENAI_MAX_RETRIES,
+    retry_backoff=_settings.OPENAI_RETRY_BACKOFF_SECONDS,
+    rpm_limit=_settings.OPENAI_RPM_LIMIT,
+    tpm_limit=_settings.OPENAI_TPM_LIMIT,
+    max_concurrency=_settings.OPENAI_MAX_CONCURRENCY,
+    max_connections=_settings.OPENAI_MAX_CONNECTIONS
+)
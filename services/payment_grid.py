@@ -0,0 +1,181 @@
+from datetime import date
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Sequence, Tuple
+
+from services.tradeline_parser import np, pd
+from services.reconciliation import contract_key
+
+# Уровни платежной строки после декодирования
+NO_DATA = -1
+ON_TIME = 0
+BAD_DEBT = 6
+LEVEL_TITLES = {
+    1: "1-29 дн.",
+    2: "30-59 дн.",
+    3: "60-89 дн.",
+    4: "90-119 дн.",
+    5: "120+ дн.",
+    BAD_DEBT: "безнадежный долг/взыскание",
+}
+
+# Кодировки статусов по БКИ: символ -> уровень (остальное - нет данных).
+# НБКИ: 1 - без просрочки, A - до 30 дней, 2..5 - 30-59 ... 120+,
+# 7 - реструктуризация, 8 - погашение залогом, 9 - безнадежный долг.
+# ОКБ и Эквифакс: 0 - без просрочки, 1..5 - 1-30 ... 120+, 9 - списан.
+STATUS_CODES = {
+    "НБКИ": {"0": ON_TIME, "1": ON_TIME, "7": ON_TIME, "A": 1, "2": 2, "3": 3, "4": 4, "5": 5,
+             "8": BAD_DEBT, "9": BAD_DEBT},
+    "ОКБ": {"0": ON_TIME, "1": 1, "2": 2, "3": 3, "4": 4, "5": 5, "9": BAD_DEBT},
+    "Эквифакс": {"0": ON_TIME, "1": 1, "2": 2, "3": 3, "4": 4, "5": 5, "9": BAD_DEBT},
+}
+
+@lru_cache(maxsize=32)
+def _lookup_tables(bureaus: Tuple[str, ...]) -> "np.ndarray":
+    """Таблица [БКИ, байт символа] -> уровень для векторного декодирования"""
+    tables = np.full((len(bureaus), 256), NO_DATA, dtype=np.int8)
+    for index, bureau in enumerate(bureaus):
+        for code, level in STATUS_CODES.get(bureau, STATUS_CODES["НБКИ"]).items():
+            tables[index, ord(code)] = level
+            tables[index, ord(code.lower())] = level
+    return tables
+
+def decode_grid(
+    payment_strings: Sequence[str],
+    bureaus: Sequence[str],
+    months: Optional[int] = None
+) -> "np.ndarray":
+    """Платежные строки -> матрица уровней [договор, месяц] (int8)
+    
+    Месяц 0 - последний (первый символ строки), дальше - все более
+    ранние. Строки выравниваются по длине, недостающие месяцы - NO_DATA.
+    """
+    if months is None:
+        months = max((len(value) for value in payment_strings), default=0)
+    if not len(payment_strings) or not months:
+        return np.full((len(payment_strings), months), NO_DATA, dtype=np.int8)
+    
+    # Все строки одним буфером байтов: символы вне ASCII - «?», то есть нет данных
+    raw = b"".join(
+        value[:months].ljust(months, "-").encode("ascii", "replace") for value in payment_strings
+    )
+    grid = np.frombuffer(raw, dtype=np.uint8).reshape(len(payment_strings), months)
+    
+    names = tuple(dict.fromkeys(bureaus))
+    bureau_index = np.array([names.index(bureau) for bureau in bureaus], dtype=np.intp)
+    return _lookup_tables(names)[bureau_index[:, None], grid]
+
+def _months_ago(dates: "np.ndarray", today: date) -> "np.ndarray":
+    """Сколько полных месяцев назад была дата (для NaT - -1)"""
+    result = np.full(len(dates), -1, dtype=np.int64)
+    known = ~np.isnat(dates)
+    periods = dates[known].astype("datetime64[M]").astype(np.int64)
+    result[known] = np.datetime64(today, "M").astype(np.int64) - periods
+    return result
+
+def _month_list(months: Sequence[int]) -> str:
+    return ", ".join(str(month) for month in months)
+
+def _record(row, kind: str, severity: str, months: List[int], text: str, **extra) -> Dict[str, Any]:
+    return {
+        "type": kind,
+        "severity": severity,
+        "bureau": row["bureau"],
+        "contract_number": row["contract_number"],
+        "creditor": row["creditor"],
+        "months": months,
+        "text": text,
+        **extra,
+    }
+
+def analyze_payment_grid(tradelines: "pd.DataFrame", today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Находки по платежным строкам записей о кредитах (блок 7 промпта)
+    
+    Ищет эпизоды просрочки, просрочку после закрытия договора и
+    расхождения платежной дисциплины одного договора между БКИ по
+    месяцам. Месяцы в находках считаются назад от текущего (0 - текущий);
+    отчеты БКИ загружаются вместе, поэтому строки разных бюро
+    выравниваются по последнему месяцу.
+    """
+    if tradelines is None or tradelines.empty:
+        return []
+    
+    today = today or date.today()
+    frame = tradelines.reset_index(drop=True)
+    levels = decode_grid(frame["payment_string"].tolist(), frame["bureau"].tolist())
+    if not levels.shape[1]:
+        return []
+    
+    overdue = levels > ON_TIME
+    known = levels != NO_DATA
+    findings: List[Dict[str, Any]] = []
+    
+    # Строки для текста находок: iloc на каждую находку заметно дороже
+    rows = frame[["bureau", "contract_number", "creditor", "closed"]].to_dict("records")
+    
+    # 1. Эпизоды просрочки: начало серии месяцев с просрочкой (по времени
+    # серия идет от больших номеров месяцев к меньшим)
+    starts = overdue & ~np.pad(overdue[:, 1:], ((0, 0), (0, 1)))
+    episodes = starts.sum(axis=1)
+    worst = levels.max(axis=1)
+    for index in np.flatnonzero(episodes):
+        row = rows[index]
+        months = np.flatnonzero(overdue[index]).tolist()
+        findings.append(_record(
+            row, "overdue_episode", "🟥" if worst[index] >= 2 else "🟨", months,
+            f"{row['bureau']}, договор № {row['contract_number']} ({row['creditor'] or 'кредитор не указан'}): "
+            f"эпизодов просрочки {episodes[index]}, максимальная {LEVEL_TITLES[int(worst[index])]}, "
+            f"месяцы назад: {_month_list(months)}"
+        ))
+    
+    # 2. Просрочка в месяцах после закрытия договора
+    since_closed = _months_ago(frame["closed"].to_numpy(dtype="datetime64[ns]"), today)
+    after_closure = np.arange(levels.shape[1])[None, :] < since_closed[:, None]
+    impossible = overdue & after_closure
+    for index in np.flatnonzero(impossible.any(axis=1)):
+        row = rows[index]
+        months = np.flatnonzero(impossible[index]).tolist()
+        findings.append(_record(
+            row, "overdue_after_closure", "🟥", months,
+            f"{row['bureau']}, договор № {row['contract_number']}: закрыт "
+            f"{row['closed'].strftime('%d.%m.%Y')}, но после закрытия отмечена просрочка "
+            f"(месяцы назад: {_month_list(months)})"
+        ))
+    
+    # 3. Расхождения между БКИ: множества месяцев с просрочкой как битовые
+    # маски; сравниваются только месяцы, известные обоим бюро
+    overdue_bits = np.packbits(overdue, axis=1)
+    known_bits = np.packbits(known, axis=1)
+    
+    keys = np.array([contract_key(row["contract_number"]) for row in rows], dtype=object)
+    keyed = np.flatnonzero(keys != "")
+    order = keyed[np.argsort(keys[keyed], kind="stable")]
+    if len(order) > 1:
+        sorted_keys = keys[order]
+        group_start = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        reference = order[np.maximum.accumulate(np.where(group_start, np.arange(len(order)), 0))]
+        bureaus = frame["bureau"].to_numpy()
+        pairs = ~group_start & (bureaus[order] != bureaus[reference])
+        left, right = reference[pairs], order[pairs]
+        
+        differ = (overdue_bits[left] ^ overdue_bits[right]) & known_bits[left] & known_bits[right]
+        mismatched = np.flatnonzero(differ.any(axis=1))
+        months_differ = np.unpackbits(differ[mismatched], axis=1)[:, :levels.shape[1]]
+        
+        for position, pair in enumerate(mismatched):
+            a, b = rows[left[pair]], rows[right[pair]]
+            months = np.flatnonzero(months_differ[position]).tolist()
+            in_a = [m for m in months if overdue[left[pair], m]]
+            in_b = [m for m in months if overdue[right[pair], m]]
+            findings.append(_record(
+                a, "bureau_mismatch", "🟥", months,
+                f"договор № {a['contract_number']} ({a['creditor'] or b['creditor'] or 'кредитор не указан'}): "
+                f"платежная дисциплина различается - просрочка в {a['bureau']} "
+                f"за месяцы {_month_list(in_a) or 'нет'}, в {b['bureau']} за месяцы {_month_list(in_b) or 'нет'}",
+                other_bureau=b["bureau"]
+            ))
+    
+    return findings
+
+def current_levels(payment_strings: Sequence[str], bureaus: Sequence[str]) -> "np.ndarray":
+    """Уровень просрочки в последнем месяце по каждой записи"""
+    return decode_grid(payment_strings, bureaus, months=1)[:, 0]
@@ -0,0 +1,160 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, List, Tuple, Dict, Any
+
+from config.settings import get_settings
+import logging
+
+# Для работы с PDF и извлечения текста
+try:
+    import fitz  # pip install PyMuPDF
+except ImportError:
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+def _extract_page_range(file_data: bytes, start: int, stop: Optional[int]) -> Tuple[List[str], int]:
+    """Извлечь текст страниц [start, stop) в процессе пула
+    
+    Возвращает тексты страниц и общее число страниц документа, чтобы
+    первый вызов сразу показал, нужно ли делить остаток на диапазоны.
+    """
+    pdf_document = fitz.open(stream=file_data, filetype="pdf")
+    try:
+        page_count = pdf_document.page_count
+        stop = page_count if stop is None else min(stop, page_count)
+        texts = [pdf_document.load_page(page_num).get_text() for page_num in range(start, stop)]
+        return texts, page_count
+    finally:
+        pdf_document.close()
+
+class PdfExtractor:
+    """Извлечение текста из PDF в пуле процессов
+    
+    PyMuPDF держит GIL и на большом отчете надолго блокирует event loop,
+    поэтому разбор вынесен в ProcessPoolExecutor. Большие документы
+    делятся на диапазоны по pages_per_task страниц и разбираются
+    параллельно несколькими процессами.
+    """
+    
+    def __init__(self, workers: int, pages_per_task: int, timeout: float):
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+        self.timeout = timeout
+        
+        self._executor: Optional[ProcessPoolExecutor] = None
+        
+        self.documents = 0
+        self.pages = 0
+        self.timeouts = 0
+        self.failures = 0
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: форк процесса с запущенным event loop и потоками
+            # драйверов БД небезопасен
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Пул извлечения PDF запущен: процессов {self.workers}")
+        return self._executor
+    
+    async def _extract(self, file_data: bytes) -> List[str]:
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        
+        # Первый диапазон заодно сообщает число страниц
+        first_texts, page_count = await loop.run_in_executor(
+            executor, _extract_page_range, file_data, 0, self.pages_per_task
+        )
+        
+        rest = [
+            loop.run_in_executor(executor, _extract_page_range, file_data, start, start + self.pages_per_task)
+            for start in range(self.pages_per_task, page_count, self.pages_per_task)
+        ]
+        texts = list(first_texts)
+        for range_texts, _ in await asyncio.gather(*rest):
+            texts.extend(range_texts)
+        
+        self.pages += page_count
+        return texts
+    
+    async def extract_text(self, file_data: bytes, file_name: str) -> Optional[str]:
+        """Извлечь текст PDF, не блокируя event loop"""
+        pages = await self.extract_pages(file_data, file_name)
+        return None if pages is None else "\n".join(pages)
+    
+    async def extract_pages(self, file_data: bytes, file_name: str) -> Optional[List[str]]:
+        """Извлечь текст PDF постранично, не блокируя event loop"""
+        
+        if not fitz:
+            logger.error("PyMuPDF не установлен. Используйте: pip install PyMuPDF")
+            return None
+        
+        try:
+            pages = await asyncio.wait_for(self._extract(file_data), self.timeout)
+            self.documents += 1
+            return pages
+            
+        except asyncio.TimeoutError:
+            # Уже запущенные в процессах задачи доработают сами, результат отбросим
+            self.timeouts += 1
+            logger.error(f"Превышено время извлечения текста из PDF {file_name}: {self.timeout} с")
+            return None
+            
+        except BrokenProcessPool:
+            # Процесс пула упал (например, на битом файле): пересоздаем пул
+            self.failures += 1
+            logger.error(f"Пул извлечения PDF поврежден на файле {file_name}, пересоздаем")
+            self._executor = None
+            return None
+            
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Ошибка извлечения текста из PDF {file_name}: {e}")
+            return None
+    
+    async def run(self, fn, *args):
+        """Выполнить fn(*args) в том же пуле с тем же таймаутом
+        
+        Для других разборов PDF (например, таблиц отчета): fn должна быть
+        функцией уровня модуля, чтобы ее можно было передать в процесс.
+        Ошибки пробрасываются вызывающему коду.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._get_executor(), fn, *args),
+                self.timeout
+            )
+        except BrokenProcessPool:
+            self.failures += 1
+            self._executor = None
+            raise
+    
+    def stop(self):
+        """Остановить процессы пула"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.info("Пул извлечения PDF остановлен")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self._executor is not None,
+            "documents": self.documents,
+            "pages": self.pages,
+            "timeouts": self.timeouts,
+            "failures": self.failures
+        }
+
+_settings = get_settings()
+pdf_extractor = PdfExtractor(
+    workers=_settings.PDF_WORKERS,
+    pages_per_task=_settings.PDF_PAGES_PER_TASK,
+    timeout=_settings.PDF_EXTRACT_TIMEOUT_SECONDS
+)
@@ -0,0 +1,146 @@
+from datetime import date
+from typing import Optional, Dict, Any
+
+from services.tradeline_parser import np, pd
+from services.reconciliation import contract_key
+from services.payment_grid import current_levels
+
+# Корзины просрочки по статусу последнего месяца платежной строки
+OVERDUE_BUCKETS = ["1-29", "30-59", "60-89", "90+"]
+# Уровень payment_grid -> корзина (-1 - нет просрочки или нет данных)
+_LEVEL_BUCKET = np.array([-1, -1, 0, 1, 2, 3, 3, 3], dtype=np.int64) if np is not None else None
+
+def annuity_payment(principal, annual_rate: float, months: int):
+    """Аннуитетный платеж в месяц (работает и с массивами NumPy)"""
+    rate = annual_rate / 12
+    if rate == 0:
+        return principal / months
+    return principal * rate / (1 - (1 + rate) ** -months)
+
+def debt_load(
+    keys: "np.ndarray",
+    active: "np.ndarray",
+    balance: "np.ndarray",
+    credit_limit: "np.ndarray",
+    overdue: "np.ndarray",
+    buckets: "np.ndarray",
+    loan_amount: Optional[float],
+    monthly_income: Optional[float],
+    annual_rate: float,
+    term_months: int
+) -> Dict[str, Any]:
+    """Расчет нагрузки по массивам записей (один элемент - запись одного БКИ)
+    
+    Один договор обычно есть в нескольких БКИ: по каждому коду договора
+    (keys - целые числа) берется запись с наибольшим остатком, чтобы
+    не считать долг дважды. buckets - номер корзины просрочки
+    (-1, если статус неизвестен).
+    """
+    # Пропуски в суммах - нули; одним массивом дешевле, чем по колонке
+    amounts = np.vstack((balance, credit_limit, overdue))
+    amounts[np.isnan(amounts)] = 0.0
+    balance, credit_limit, overdue = amounts
+    
+    # Сортировка по коду и убыванию остатка, первая запись каждого кода
+    order = np.lexsort((-balance, keys))
+    sorted_keys = keys[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    unique = order[first]
+    unique = unique[active[unique]]
+    
+    balance = balance[unique]
+    overdue = overdue[unique]
+    buckets = buckets[unique]
+    
+    payments = float(annuity_payment(balance, annual_rate, term_months).sum())
+    new_payment = float(annuity_payment(loan_amount, annual_rate, term_months)) if loan_amount else 0.0
+    by_bucket = np.bincount(buckets[buckets >= 0], weights=overdue[buckets >= 0], minlength=len(OVERDUE_BUCKETS))
+    
+    result = {
+        "accounts": int(len(unique)),
+        "total_exposure": round(float(balance.sum()), 2),
+        "total_limit": round(float(credit_limit[unique].sum()), 2),
+        "monthly_payments": round(payments, 2),
+        "new_loan_amount": loan_amount,
+        "new_loan_payment": round(new_payment, 2),
+        "overdue_total": round(float(overdue.sum()), 2),
+        "overdue_buckets": {
+            name: round(float(amount), 2) for name, amount in zip(OVERDUE_BUCKETS, by_bucket)
+        },
+        "overdue_unclassified": round(float(overdue[buckets < 0].sum()), 2),
+        "monthly_income": monthly_income,
+        "pdn_current": None,
+        "pdn": None,
+        "assumptions": {"annual_rate": annual_rate, "term_months": term_months},
+    }
+    if monthly_income:
+        result["pdn_current"] = round(payments / monthly_income, 4)
+        result["pdn"] = round((payments + new_payment) / monthly_income, 4)
+    return result
+
+def calculate_debt_load(
+    tradelines: "pd.DataFrame",
+    loan_amount: Optional[float],
+    monthly_income: Optional[float],
+    annual_rate: float,
+    term_months: int,
+    today: Optional[date] = None
+) -> Dict[str, Any]:
+    """Кредитная нагрузка (ПДН, платежи, просрочки) по записям о кредитах
+    
+    Ежемесячный платеж по договору в отчетах не указан, поэтому он
+    оценивается как аннуитет от текущего остатка под annual_rate на
+    term_months; так же оценивается платеж по запрашиваемому кредиту.
+    """
+    # Коды договоров по нормализованным номерам; записи без номера
+    # не сливаются между собой
+    codes: Dict[str, int] = {}
+    keys = np.array([
+        codes.setdefault(contract_key(number) or f"#{index}", len(codes))
+        for index, number in enumerate(tradelines["contract_number"])
+    ], dtype=np.int64)
+    
+    closed = tradelines["closed"].to_numpy()
+    active = np.isnat(closed) | (closed > np.datetime64(today or date.today()))
+    
+    levels = current_levels(tradelines["payment_string"].tolist(), tradelines["bureau"].tolist())
+    buckets = _LEVEL_BUCKET[levels + 1]
+    
+    return debt_load(
+        keys,
+        active,
+        tradelines["balance"].to_numpy(dtype=float),
+        tradelines["credit_limit"].to_numpy(dtype=float),
+        tradelines["overdue"].to_numpy(dtype=float),
+        buckets,
+        loan_amount,
+        monthly_income,
+        annual_rate,
+        term_months
+    )
+
+def _rub(value: float) -> str:
+    return f"{value:,.2f}".replace(",", " ").replace(".", ",") + " руб."
+
+def format_debt_load(result: Dict[str, Any]) -> str:
+    """Расчет нагрузки в виде блока текста для GPT"""
+    buckets = ", ".join(f"{name} дн.: {_rub(amount)}" for name, amount in result["overdue_buckets"].items())
+    lines = [
+        "=== КРЕДИТНАЯ НАГРУЗКА (рассчитана программно по записям отчетов, не пересчитывай) ===",
+        f"Действующих договоров: {result['accounts']}",
+        f"Общая задолженность: {_rub(result['total_exposure'])}",
+        f"Сумма лимитов: {_rub(result['total_limit'])}",
+        f"Ежемесячные платежи (оценка): {_rub(result['monthly_payments'])}",
+        f"Просроченная задолженность: {_rub(result['overdue_total'])} ({buckets})",
+    ]
+    if result["new_loan_amount"]:
+        lines.append(
+            f"Запрашиваемый кредит: {_rub(result['new_loan_amount'])}, "
+            f"платеж (оценка): {_rub(result['new_loan_payment'])}"
+        )
+    if result["pdn"] is not None:
+        lines.append(f"ПДН текущий: {result['pdn_current']:.1%}, с новым кредитом: {result['pdn']:.1%}")
+    else:
+        lines.append("ПДН: нет данных о доходе")
+    return "\n".join(lines)
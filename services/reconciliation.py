@@ -0,0 +1,162 @@
+import re
+from datetime import date
+from typing import Optional, List, Dict, Tuple
+
+from services.tradeline_parser import pd
+
+# Блоки промпта, которые рассчитываются сверкой записей без GPT
+RECONCILED_BLOCKS = (6, 8, 9)
+
+# Поля, сравниваемые между БКИ: колонка -> (название, тип)
+COMPARED_FIELDS = {
+    "opened": ("дата открытия", "date"),
+    "closed": ("дата закрытия", "date"),
+    "credit_limit": ("лимит/сумма", "amount"),
+    "balance": ("остаток задолженности", "amount"),
+    "overdue": ("просроченная задолженность", "amount"),
+}
+
+# Кириллица, похожая на латиницу: в номерах договоров бюро пишут по-разному
+_HOMOGLYPHS = str.maketrans("АВЕКМНОРСТУХ", "ABEKMHOPCTYX")
+
+Findings = Dict[int, Tuple[Optional[str], List[str]]]
+
+_KEY_JUNK = re.compile(r"[^0-9A-ZА-Я]")
+
+def contract_key(number: Optional[str]) -> str:
+    """Нормализованный ключ договора: «№ 12-0045/А» и «120045A» совпадают"""
+    return _KEY_JUNK.sub("", (number or "").upper().translate(_HOMOGLYPHS)).lstrip("0")
+
+def contract_keys(numbers: "pd.Series") -> "pd.Series":
+    """Ключи договоров колонки
+    
+    У клиента десятки записей, и на таком объеме цикл по значениям
+    в разы быстрее цепочки .str-операций pandas.
+    """
+    return pd.Series([contract_key(number) for number in numbers], index=numbers.index, dtype=object)
+
+def _amount(value: float) -> str:
+    return f"{value:,.2f}".replace(",", " ").replace(".", ",")
+
+def _value(value, kind: str) -> str:
+    if pd.isna(value):
+        return "нет данных"
+    if kind == "date":
+        return value.strftime("%d.%m.%Y")
+    return _amount(value)
+
+def _contract(row) -> str:
+    creditor = row["creditor"] or "кредитор не указан"
+    return f"договор № {row['contract_number']} ({creditor})"
+
+def _severity(red: List[str], yellow: List[str]) -> str:
+    return "🟥" if red else "🟨" if yellow else "🟩"
+
+def _discrepancies(frame: "pd.DataFrame", bureaus: List[str]) -> Tuple[Optional[str], List[str]]:
+    """Блок 6: одни и те же договоры в разных БКИ"""
+    if len(bureaus) < 2:
+        return None, ["нет данных: для сверки нужны отчеты минимум двух БКИ"]
+    
+    # Одна запись на договор в каждом бюро; соединение по ключу - хэш-группировка
+    records = frame[frame["key"] != ""].drop_duplicates(["bureau", "key"])
+    first = records.groupby("key").first()
+    red: List[str] = []
+    yellow: List[str] = []
+    
+    for field, (label, kind) in COMPARED_FIELDS.items():
+        values = records[field].round(0) if kind == "amount" else records[field]
+        mismatched = values.groupby(records["key"]).nunique() > 1
+        if not mismatched.any():
+            continue
+        
+        pivot = records[records["key"].isin(mismatched[mismatched].index)].pivot(
+            index="key", columns="bureau", values=field
+        )
+        for key, row in pivot.iterrows():
+            by_bureau = "; ".join(
+                f"{bureau}: {_value(row[bureau], kind)}" for bureau in bureaus if bureau in row.index
+            )
+            red.append(f"{_contract(first.loc[key])}: {label} различается - {by_bureau}")
+    
+    # Договор есть не во всех бюро
+    counts = records.groupby("key")["bureau"].nunique()
+    partial = records[records["key"].isin(counts[counts < len(bureaus)].index)]
+    for key, present in partial.groupby("key", sort=True)["bureau"].agg(set).items():
+        missing = [bureau for bureau in bureaus if bureau not in present]
+        found = [bureau for bureau in bureaus if bureau in present]
+        yellow.append(
+            f"{_contract(first.loc[key])}: есть в {', '.join(found)}, нет в {', '.join(missing)}"
+        )
+    
+    findings = red + yellow
+    return _severity(red, yellow), findings or ["ошибок не выявлено"]
+
+def _duplicates(frame: "pd.DataFrame") -> Tuple[Optional[str], List[str]]:
+    """Блок 8: один договор учтен в бюро несколько раз"""
+    red: List[str] = []
+    yellow: List[str] = []
+    
+    keyed = frame[frame["key"] != ""]
+    repeated = keyed[keyed.duplicated(["bureau", "key"], keep=False)]
+    for (bureau, _), group in repeated.groupby(["bureau", "key"], sort=True):
+        pages = ", ".join(str(page) for page in sorted(set(group["page"])))
+        red.append(f"{bureau}, {_contract(group.iloc[0])}: учтен повторно, записей {len(group)} (стр. {pages})")
+    
+    # Разные номера, но тот же кредитор, дата открытия и сумма - вероятный дубль
+    complete = frame.dropna(subset=["opened", "credit_limit"])
+    complete = complete[complete["creditor"] != ""].drop_duplicates(["bureau", "key"])
+    columns = ["bureau", "creditor", "opened", "credit_limit"]
+    similar = complete[complete.duplicated(columns, keep=False)]
+    for (bureau, creditor, opened, credit_limit), group in similar.groupby(columns, sort=True):
+        numbers = ", ".join(f"№ {number}" for number in group["contract_number"])
+        yellow.append(
+            f"{bureau}, {creditor}: договоры {numbers} с одинаковой датой открытия "
+            f"{opened.strftime('%d.%m.%Y')} и суммой {_amount(credit_limit)}"
+        )
+    
+    findings = red + yellow
+    return _severity(red, yellow), findings or ["ошибок не выявлено"]
+
+def _stale_balances(frame: "pd.DataFrame", today: date) -> Tuple[Optional[str], List[str]]:
+    """Блок 9: договор закрыт, но задолженность не обнулена"""
+    frame = frame.drop_duplicates(["bureau", "key", "closed", "balance", "overdue"])
+    balance = frame["balance"].fillna(0)
+    overdue = frame["overdue"].fillna(0)
+    stale = frame[
+        frame["closed"].notna()
+        & (frame["closed"] <= pd.Timestamp(today))
+        & ((balance > 0) | (overdue > 0))
+    ]
+    
+    findings = [
+        f"{row['bureau']}, {_contract(row)}: закрыт {row['closed'].strftime('%d.%m.%Y')}, "
+        f"но остаток {_value(row['balance'], 'amount')}, просрочка {_value(row['overdue'], 'amount')}"
+        for _, row in stale.sort_values(["bureau", "key"]).iterrows()
+    ]
+    return ("🟥" if findings else "🟩"), findings or ["ошибок не выявлено"]
+
+def reconcile(
+    tradelines: Dict[str, Optional["pd.DataFrame"]],
+    today: Optional[date] = None
+) -> Findings:
+    """Сверить записи о кредитах отчетов БКИ (блоки 6, 8 и 9 промпта)
+    
+    tradelines: название БКИ -> записи его отчета. Сверка выполняется
+    только если разобраны записи всех отчетов: иначе отсутствие
+    находок нельзя отличить от неразобранной таблицы, и эти блоки
+    остаются за GPT (возвращается пустой словарь).
+    """
+    if pd is None or not tradelines:
+        return {}
+    if any(frame is None or frame.empty for frame in tradelines.values()):
+        return {}
+    
+    frame = pd.concat(list(tradelines.values()), ignore_index=True)
+    frame["key"] = contract_keys(frame["contract_number"])
+    bureaus = list(tradelines)
+    
+    return {
+        6: _discrepancies(frame, bureaus),
+        8: _duplicates(frame),
+        9: _stale_balances(frame, today or date.today()),
+    }
@@ -38,7 +38,7 @@ class ReferralService:
             
             # Создаем или обновляем статистику
             await self._ensure_referral_stats(session, broker_id, broker.ref_code)
-            await session.commit()
+            await session.flush()
             
             return referral_link
     
@@ -95,7 +95,7 @@ class ReferralService:
             
             # Обновляем статистику
             await self._update_click_stats(session, broker.id, ref_code)
-            await session.commit()
+            await session.flush()
             
             logger.info(f"Клик отслежен: код {ref_code}, брокер {broker.id}")
             return True
@@ -126,7 +126,7 @@ class ReferralService:
             
             # Обновляем статистику регистраций
             await self._update_registration_stats(session, broker.id, ref_code)
-            await session.commit()
+            await session.flush()
             
             logger.info(f"Регистрация отслежена: пользователь {user_id}, код {ref_code}")
             return True
@@ -232,7 +232,7 @@ class ReferralService:
                     conversions=ReferralStats.conversions + 1
                 )
             )
-            await session.commit()
+            await session.flush()
             
             logger.info(f"Начислена комиссия {commission_amount} брокеру {user.broker.id}")
             return True
@@ -271,7 +271,7 @@ class ReferralService:
                     
                     # Создаем новую статистику
                     await self._ensure_referral_stats(session, broker_id, new_code)
-                    await session.commit()
+                    await session.flush()
                     
                     logger.info(f"Новый реферальный код {new_code} создан для брокера {broker_id}")
                     return new_code
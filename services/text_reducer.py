@@ -0,0 +1,202 @@
+import re
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Set
+
+from config.settings import get_settings
+from services.tradeline_parser import HEADER_KEYWORDS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Строк сверху и снизу страницы, где ищутся колонтитулы
+ZONE_LINES = 3
+# Повторяющаяся строка считается шаблонной (оговорка, легенда раздела) только
+# от этой длины: короткие значения («Закрыт», «0,00») повторяются и в данных
+MIN_BODY_LINE_CHARS = 40
+# Максимум запомненных шаблонных строк на одно БКИ
+MAX_LEARNED_LINES = 2000
+
+# Признаки страницы с данными о договорах
+CONTENT_KEYWORDS = (
+    "договор", "кредит", "заем", "займ", "задолженност", "просроч",
+    "платеж", "лимит", "запрос", "обязательств",
+)
+
+# Счетчик страниц: «Страница 3 из 12», «стр. 3», «3 из 12»
+_PAGE_COUNTER_RE = re.compile(
+    r"^(?:стр(?:аница)?\.?\s*\d{1,4}(?:\s*(?:из|/)\s*\d{1,4})?|\d{1,4}\s+из\s+\d{1,4})$",
+    re.IGNORECASE
+)
+# Шапки бюро и отчета, которые печатаются на каждой странице
+_BANNER_RE = re.compile(
+    r"кредитн\w* отч[её]т|бюро кредитных историй|кредитное бюро|эквифакс|equifax|"
+    r"\bнбки\b|\bокб\b|конфиденциальн",
+    re.IGNORECASE
+)
+_DIGIT_RE = re.compile(r"\d")
+# Начала строк полей записи о кредите: «Кредитор: ...», «Номер договора ...»
+_FIELD_PREFIXES = ("договор",) + tuple(keyword for _, keywords in HEADER_KEYWORDS for keyword in keywords)
+# Точечные заполнители, линии из подчеркиваний, тире и псевдографика таблиц
+_FILLER_RE = re.compile(r"\.{4,}|…{2,}|_{3,}|-{4,}|={3,}|[─━│┃┌┐└┘├┤┬┴┼]+")
+_SPACES_RE = re.compile(r"[ \t\u00a0]+")
+
+def _compact(line: str) -> str:
+    """Строка без заполнителей и лишних пробелов"""
+    return _SPACES_RE.sub(" ", _FILLER_RE.sub(" ", line)).strip()
+
+def _is_page_counter(line: str) -> bool:
+    return bool(_PAGE_COUNTER_RE.match(line))
+
+def _is_banner(line: str) -> bool:
+    """Шапка бюро или отчета; строка с цифрами (номер, дата, сумма) шапкой не считается"""
+    return not _DIGIT_RE.search(line) and bool(_BANNER_RE.search(line))
+
+def _is_tradeline_field(line: str) -> bool:
+    """Строка поля записи о кредите; такие строки не удаляются, даже повторяясь"""
+    return line.lower().startswith(_FIELD_PREFIXES)
+
+def _has_content(lines: List[str]) -> bool:
+    """На странице есть цифры (кроме счетчика страниц) или признаки договоров"""
+    for line in lines:
+        if _is_page_counter(line):
+            continue
+        if _DIGIT_RE.search(line):
+            return True
+        lowered = line.lower()
+        if any(keyword in lowered for keyword in CONTENT_KEYWORDS):
+            return True
+    return False
+
+class TextReducer:
+    """Сокращение текста отчетов БКИ перед отправкой в GPT
+    
+    Удаляются:
+    - счетчики страниц в первых и последних строках страницы;
+    - шапки бюро и отчета без цифр, повторяющиеся там же на доле
+      min_page_share страниц (остается первое вхождение);
+    - длинные строки (оговорки, легенды разделов), которые повторяются
+      дословно, вместе с цифрами, на доле min_page_share страниц
+      документа: остается первое вхождение.
+    
+    Такие строки запоминаются по БКИ: встреченные шаблонными в
+    min_documents документах одного бюро удаляются полностью, в том числе
+    там, где повторов внутри документа нет (короткие отчеты). Строки
+    полей записей о кредитах («Кредитор: ...», «Договор № ...») не
+    удаляются никогда. Страницы без цифр и признаков договоров
+    пропускаются (первая страница остается всегда).
+    """
+    
+    def __init__(self, min_page_share: float, min_documents: int):
+        self.min_page_share = min_page_share
+        self.min_documents = min_documents
+        
+        # БКИ -> строка -> в скольких документах она была шаблонной
+        self._seen: Dict[str, "OrderedDict[str, int]"] = {}
+        
+        self.documents = 0
+        self.pages = 0
+        self.pages_skipped = 0
+        self.lines_removed = 0
+        self.chars_in = 0
+        self.chars_out = 0
+    
+    def _learned(self, bureau: str) -> Set[str]:
+        seen = self._seen.get(bureau, {})
+        return {line for line, documents in seen.items() if documents >= self.min_documents}
+    
+    def _learn(self, bureau: str, lines: Set[str]):
+        seen = self._seen.setdefault(bureau, OrderedDict())
+        for line in lines:
+            seen[line] = seen.get(line, 0) + 1
+            seen.move_to_end(line)
+        while len(seen) > MAX_LEARNED_LINES:
+            seen.popitem(last=False)
+    
+    def _repeated(self, pages: List[List[str]]) -> Set[str]:
+        """Шапки в колонтитулах и длинные строки, повторяющиеся на доле min_page_share страниц"""
+        if len(pages) < 2:
+            return set()
+        
+        counts: Counter = Counter()
+        for lines in pages:
+            repeated = {
+                line for line in lines[:ZONE_LINES] + lines[-ZONE_LINES:] if _is_banner(line)
+            }
+            repeated.update(line for line in lines if len(line) >= MIN_BODY_LINE_CHARS)
+            counts.update(line for line in repeated if not _is_tradeline_field(line))
+        
+        threshold = max(2, self.min_page_share * len(pages))
+        return {line for line, count in counts.items() if count >= threshold}
+    
+    def reduce(self, pages: List[str], bureau: str, file_name: str = "") -> str:
+        """Текст страниц документа без шаблонных строк и пустых страниц"""
+        
+        split = [[_compact(line) for line in page.split("\n")] for page in pages]
+        split = [[line for line in lines if line] for lines in split]
+        
+        repeated = self._repeated(split)
+        learned = self._learned(bureau)
+        
+        kept_pages: List[str] = []
+        emitted: Set[str] = set()
+        removed = 0
+        skipped = 0
+        for page_num, lines in enumerate(split):
+            zone = set(range(ZONE_LINES)) | set(range(len(lines) - ZONE_LINES, len(lines)))
+            kept: List[str] = []
+            for index, line in enumerate(lines):
+                if index in zone and _is_page_counter(line):
+                    removed += 1
+                    continue
+                if line in learned and not _is_tradeline_field(line):
+                    removed += 1
+                    continue
+                if line in repeated:
+                    if line in emitted:
+                        removed += 1
+                        continue
+                    emitted.add(line)
+                kept.append(line)
+            
+            if page_num and not _has_content(kept):
+                skipped += 1
+                removed += len(kept)
+                continue
+            kept_pages.append("\n".join(kept))
+        
+        self._learn(bureau, repeated)
+        
+        text = "\n\n".join(page for page in kept_pages if page)
+        chars_in = sum(len(page) for page in pages)
+        
+        self.documents += 1
+        self.pages += len(pages)
+        self.pages_skipped += skipped
+        self.lines_removed += removed
+        self.chars_in += chars_in
+        self.chars_out += len(text)
+        
+        ratio = len(text) / chars_in if chars_in else 1.0
+        logger.info(
+            f"Сокращение текста {file_name} ({bureau}): {chars_in} -> {len(text)} символов ({ratio:.0%}), "
+            f"удалено строк {removed}, пропущено страниц {skipped} из {len(pages)}"
+        )
+        return text
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": self.documents,
+            "pages": self.pages,
+            "pages_skipped": self.pages_skipped,
+            "lines_removed": self.lines_removed,
+            "chars_in": self.chars_in,
+            "chars_out": self.chars_out,
+            "ratio": self.chars_out / self.chars_in if self.chars_in else 1.0,
+            "learned_lines": sum(len(self._learned(bureau)) for bureau in self._seen),
+        }
+
+_settings = get_settings()
+text_reducer = TextReducer(
+    min_page_share=_settings.BOILERPLATE_MIN_PAGE_SHARE,
+    min_documents=_settings.BOILERPLATE_MIN_DOCUMENTS
+)
@@ -0,0 +1,234 @@
+import io
+import re
+from typing import Optional, List, Dict, Any
+
+from services.pdf_extractor import pdf_extractor
+import logging
+
+# Для разбора таблиц отчетов и хранения записей по колонкам
+try:
+    import numpy as np
+    import pandas as pd
+    import pdfplumber  # pip install pdfplumber
+except ImportError:
+    np = None
+    pd = None
+    pdfplumber = None
+
+logger = logging.getLogger(__name__)
+
+# Схема записи о кредите: колонка -> тип хранения
+TRADELINE_COLUMNS = {
+    "bureau": "str",
+    "creditor": "str",
+    "contract_number": "str",
+    "opened": "date",
+    "closed": "date",
+    "credit_limit": "float",
+    "balance": "float",
+    "overdue": "float",
+    "payment_string": "str",
+    "page": "int",
+}
+
+# Подстроки заголовков колонок в отчетах НБКИ, ОКБ и Эквифакс.
+# Порядок важен: «просроченная задолженность» должна попасть в overdue
+# раньше, чем «задолженность» в balance
+HEADER_KEYWORDS = [
+    ("overdue", ["просроч"]),
+    ("payment_string", ["платежн", "дисциплин", "история платеж", "своевременност"]),
+    ("closed", ["дата закрыт", "фактическ", "дата погашен", "закрыт"]),
+    ("opened", ["дата открыт", "дата заключ", "дата выдач", "открыт"]),
+    ("contract_number", ["номер договора", "№ договора", "договор №", "номер сделки", "номер"]),
+    ("credit_limit", ["лимит", "сумма кредита", "сумма договора", "сумма обязательства"]),
+    ("balance", ["остаток", "задолженност", "баланс"]),
+    ("creditor", ["кредитор", "источник", "займодав", "организац", "банк"]),
+]
+
+# Минимум распознанных колонок, чтобы считать строку заголовком
+MIN_HEADER_FIELDS = 3
+
+_DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{2,4})")
+_AMOUNT_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+def _normalize_cell(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    return " ".join(value.replace("ё", "е").replace("Ё", "Е").split())
+
+def parse_amount(value: Optional[str]) -> Optional[float]:
+    """Сумма из ячейки отчета: «1 234 567,89 руб.» -> 1234567.89"""
+    text = _normalize_cell(value).replace(" ", "").replace(",", ".")
+    match = _AMOUNT_RE.search(text)
+    return float(match.group()) if match else None
+
+def parse_date(value: Optional[str]) -> Optional[str]:
+    """Дата из ячейки отчета в ISO: «05.03.2021» -> «2021-03-05»"""
+    match = _DATE_RE.search(_normalize_cell(value))
+    if not match:
+        return None
+    day, month, year = match.groups()
+    if len(year) == 2:
+        year = "20" + year
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+def _map_header(row: List[Optional[str]]) -> Dict[int, str]:
+    """Номер колонки таблицы -> поле записи; пусто, если строка не заголовок"""
+    mapping: Dict[int, str] = {}
+    for index, cell in enumerate(row):
+        header = _normalize_cell(cell).lower()
+        if not header:
+            continue
+        for field, keywords in HEADER_KEYWORDS:
+            if field not in mapping.values() and any(keyword in header for keyword in keywords):
+                mapping[index] = field
+                break
+    return mapping if len(mapping) >= MIN_HEADER_FIELDS else {}
+
+def _parse_tradelines(file_data: bytes, bureau: str) -> Dict[str, list]:
+    """Разобрать таблицы договоров отчета в процессе пула
+    
+    Возвращает записи по колонкам (списки равной длины): так результат
+    дешевле передать между процессами и сразу собрать в DataFrame.
+    Таблица без строки заголовка считается продолжением предыдущей,
+    если у нее столько же колонок (перенос таблицы на новую страницу).
+    """
+    columns: Dict[str, list] = {name: [] for name in TRADELINE_COLUMNS}
+    mapping: Dict[int, str] = {}
+    width = 0
+    
+    with pdfplumber.open(io.BytesIO(file_data)) as pdf:
+        for page_num, page in enumerate(pdf.pages, start=1):
+            for table in page.extract_tables():
+                if not table:
+                    continue
+                
+                rows = table
+                header = _map_header(table[0])
+                if header:
+                    mapping, width, rows = header, len(table[0]), table[1:]
+                elif not mapping or len(table[0]) != width:
+                    continue
+                
+                for row in rows:
+                    record = {field: row[index] for index, field in mapping.items() if index < len(row)}
+                    creditor = _normalize_cell(record.get("creditor"))
+                    contract_number = _normalize_cell(record.get("contract_number"))
+                    if not creditor and not contract_number:
+                        continue
+                    
+                    columns["bureau"].append(bureau)
+                    columns["creditor"].append(creditor)
+                    columns["contract_number"].append(contract_number)
+                    columns["opened"].append(parse_date(record.get("opened")))
+                    columns["closed"].append(parse_date(record.get("closed")))
+                    columns["credit_limit"].append(parse_amount(record.get("credit_limit")))
+                    columns["balance"].append(parse_amount(record.get("balance")))
+                    columns["overdue"].append(parse_amount(record.get("overdue")))
+                    columns["payment_string"].append(
+                        _normalize_cell(record.get("payment_string")).replace(" ", "")
+                    )
+                    columns["page"].append(page_num)
+            
+            # Кэш объектов страницы pdfplumber иначе живет до закрытия документа
+            page.close()
+    
+    return columns
+
+def tradelines_frame(columns: Dict[str, list]) -> "pd.DataFrame":
+    """Собрать DataFrame с типами колонок по TRADELINE_COLUMNS"""
+    frame = {}
+    for name, kind in TRADELINE_COLUMNS.items():
+        values = columns.get(name, [])
+        if kind == "date":
+            frame[name] = pd.to_datetime(
+                pd.Series(values, dtype=object), format="%Y-%m-%d", errors="coerce"
+            ).astype("datetime64[ns]")
+        elif kind == "float":
+            frame[name] = pd.Series(values, dtype="float64")
+        elif kind == "int":
+            frame[name] = pd.Series(values, dtype="int32")
+        else:
+            frame[name] = pd.Series(["" if value is None else value for value in values], dtype=object)
+    return pd.DataFrame(frame)
+
+def pack_tradelines(frame: "pd.DataFrame") -> bytes:
+    """Упаковать записи в сжатый npz: по массиву NumPy на колонку, без pickle"""
+    arrays = {}
+    for name, kind in TRADELINE_COLUMNS.items():
+        column = frame[name]
+        if kind == "date":
+            arrays[name] = column.to_numpy(dtype="datetime64[D]")
+        elif kind == "str":
+            arrays[name] = np.asarray(column.tolist(), dtype=np.str_) if len(column) else np.array([], dtype="U1")
+        else:
+            arrays[name] = column.to_numpy()
+    
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+def unpack_tradelines(data: Optional[bytes]) -> Optional["pd.DataFrame"]:
+    """Распаковать записи документа; None, если их нет или формат устарел"""
+    if not data or np is None:
+        return None
+    try:
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            if set(arrays.files) != set(TRADELINE_COLUMNS):
+                return None
+            frame = pd.DataFrame({name: arrays[name] for name in TRADELINE_COLUMNS})
+    except (ValueError, OSError):
+        return None
+    
+    for name, kind in TRADELINE_COLUMNS.items():
+        if kind == "date":
+            frame[name] = frame[name].astype("datetime64[ns]")
+        elif kind == "str":
+            frame[name] = frame[name].astype(object)
+    return frame
+
+class TradelineParser:
+    """Разбор отчетов БКИ в типизированные записи о кредитах
+    
+    Таблицы договоров извлекаются pdfplumber в пуле процессов
+    PdfExtractor (разбор таблиц еще дороже извлечения текста и тоже
+    держит GIL), результат собирается в DataFrame по колонкам.
+    """
+    
+    def __init__(self):
+        self.documents = 0
+        self.rows = 0
+        self.failures = 0
+    
+    @property
+    def available(self) -> bool:
+        return pdfplumber is not None and pd is not None
+    
+    async def parse(self, file_data: bytes, file_name: str, bureau: str) -> Optional["pd.DataFrame"]:
+        """Записи о кредитах из отчета; None, если разобрать не удалось"""
+        
+        if not self.available:
+            logger.error("pdfplumber/pandas не установлены. Используйте: pip install pdfplumber pandas")
+            return None
+        
+        try:
+            columns = await pdf_extractor.run(_parse_tradelines, file_data, bureau)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Ошибка разбора таблиц договоров {file_name}: {e.__class__.__name__} {e}")
+            return None
+        
+        frame = tradelines_frame(columns)
+        self.documents += 1
+        self.rows += len(frame)
+        logger.info(f"Записей о кредитах в {file_name}: {len(frame)}")
+        return frame
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": self.documents,
+            "rows": self.rows,
+            "failures": self.failures
+        }
+
+tradeline_parser = TradelineParser()
@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from database.models import User
+from config.settings import get_settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UserCache:
+    """Ограниченный LRU-кэш пользователей с TTL, ключ - telegram_id"""
+    
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        
+        # telegram_id -> (момент истечения, пользователь с загруженным брокером)
+        self._entries: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+        # user.id -> telegram_id, чтобы сбрасывать кэш из сервисов по ID
+        self._telegram_ids: Dict[int, int] = {}
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, telegram_id: int) -> Optional[User]:
+        """Получить пользователя из кэша"""
+        entry = self._entries.get(telegram_id)
+        
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._remove(telegram_id)
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return user
+    
+    def put(self, user: User):
+        """Положить пользователя в кэш"""
+        if self.max_size <= 0:
+            return
+        
+        self._entries[user.telegram_id] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(user.telegram_id)
+        self._telegram_ids[user.id] = user.telegram_id
+        
+        while len(self._entries) > self.max_size:
+            oldest_telegram_id, (_, oldest_user) = self._entries.popitem(last=False)
+            self._telegram_ids.pop(oldest_user.id, None)
+            self.evictions += 1
+    
+    def invalidate(self, telegram_id: int):
+        """Сбросить запись по Telegram ID"""
+        self._remove(telegram_id)
+    
+    def invalidate_user_id(self, user_id: int):
+        """Сбросить запись по ID пользователя в БД"""
+        telegram_id = self._telegram_ids.get(user_id)
+        if telegram_id is not None:
+            self._remove(telegram_id)
+    
+    def clear(self):
+        """Очистить кэш"""
+        self._entries.clear()
+        self._telegram_ids.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для подбора размера кэша"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+    
+    def _remove(self, telegram_id: int):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is not None:
+            self._telegram_ids.pop(entry[1].id, None)
+
+_settings = get_settings()
+user_cache = UserCache(
+    max_size=_settings.USER_CACHE_MAX_SIZE,
+    ttl_seconds=_settings.USER_CACHE_TTL_SECONDS
+)
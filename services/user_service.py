@@ -1,12 +1,14 @@
 from datetime import datetime
 from typing import Optional, List
-from sqlalchemy import select, update
+from sqlalchemy import select, update, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from database.models import User, Broker, UserRole, UserLog
-from database.database import get_db_session
+from database.database import get_db_session, call_after_commit, outside_unit_of_work
 from services.encryption_service import EncryptionService
+from services.user_cache import user_cache
+from services.log_sink import log_sink
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,6 +29,20 @@ class UserService:
             )
             return result.scalars().first()
     
+    async def get_cached_user_by_telegram_id(self, telegram_id: int) -> Optional[User]:
+        """Получить пользователя через кэш (для AuthMiddleware)"""
+        user = user_cache.get(telegram_id)
+        if user is not None:
+            return user
+        
+        # Кэшируем отсоединенный снимок из собственной короткой сессии,
+        # чтобы откат транзакции апдейта не инвалидировал объект в кэше
+        with outside_unit_of_work():
+            user = await self.get_user_by_telegram_id(telegram_id)
+        if user is not None:
+            user_cache.put(user)
+        return user
+    
     async def get_user_by_id(self, user_id: int) -> Optional[User]:
         """Получить пользователя по ID"""
         async with get_db_session() as session:
@@ -48,28 +64,33 @@ class UserService:
         """Создать нового пользователя"""
         
         async with get_db_session() as session:
-            # Проверяем привязку к брокеру
-            broker = None
+            # Привязка к брокеру подзапросом и RETURNING: один round trip вместо
+            # SELECT брокера + INSERT + повторного SELECT для refresh
+            broker_id = None
             if broker_ref_code:
-                broker_result = await session.execute(
-                    select(Broker).where(Broker.ref_code == broker_ref_code)
+                broker_id = (
+                    select(Broker.id)
+                    .where(Broker.ref_code == broker_ref_code)
+                    .scalar_subquery()
                 )
-                broker = broker_result.scalars().first()
             
             # Создаем пользователя
-            user = User(
-                telegram_id=telegram_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-                broker_id=broker.id if broker else None,
-                broker_ref_code=broker_ref_code,
-                role=UserRole.CLIENT
+            result = await session.execute(
+                insert(User)
+                .values(
+                    telegram_id=telegram_id,
+                    username=username,
+                    first_name=first_name,
+                    last_name=last_name,
+                    broker_id=broker_id,
+                    broker_ref_code=broker_ref_code,
+                    role=UserRole.CLIENT
+                )
+                .returning(User)
             )
+            user = result.scalars().one()
             
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
+            call_after_commit(lambda: user_cache.invalidate(telegram_id))
             
             # Логируем регистрацию
             await self.log_user_action(
@@ -105,7 +126,8 @@ class UserService:
                     .where(User.id == user_id)
                     .values(**update_data)
                 )
-                await session.commit()
+                await session.flush()
+                call_after_commit(lambda: user_cache.invalidate_user_id(user_id))
                 
                 await self.log_user_action(
                     user_id, 
@@ -141,7 +163,8 @@ class UserService:
                 .where(User.id == user_id)
                 .values(**update_data)
             )
-            await session.commit()
+            await session.flush()
+            call_after_commit(lambda: user_cache.invalidate_user_id(user_id))
             
             await self.log_user_action(
                 user_id, 
@@ -162,7 +185,7 @@ class UserService:
                 .where(User.id == user_id)
                 .values(last_activity=datetime.utcnow())
             )
-            await session.commit()
+            await session.flush()
     
     async def get_user_phone(self, user: User) -> Optional[str]:
         """Получить расшифрованный телефон пользователя"""
@@ -184,6 +207,20 @@ class UserService:
         ip_address: Optional[str] = None
     ):
         """Записать действие пользователя в лог"""
+        # В работающем боте запись идет через очередь пачками, и только после
+        # коммита: лог откатившейся транзакции не нужен, а пользователь или
+        # заявка, созданные в ней, до коммита не видны другим сессиям
+        if log_sink.running:
+            created_at = datetime.utcnow()
+            call_after_commit(lambda: log_sink.put_nowait(
+                user_id,
+                action,
+                str(details) if details else None,
+                ip_address,
+                created_at
+            ))
+            return
+        
         async with get_db_session() as session:
             log_entry = UserLog(
                 user_id=user_id,
@@ -192,7 +229,7 @@ class UserService:
                 ip_address=ip_address
             )
             session.add(log_entry)
-            await session.commit()
+            await session.flush()
     
     async def get_user_logs(self, user_id: int, limit: int = 50) -> List[UserLog]:
         """Получить логи действий пользователя"""
@@ -0,0 +1,11 @@
+import pytest_asyncio
+
+@pytest_asyncio.fixture
+async def db(tmp_path, monkeypatch):
+    """Инициализированная база: у каждого теста своя временная SQLite"""
+    from database.database import init_db, close_db
+
+    monkeypatch.setenv("DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    await init_db()
+    yield
+    await close_db()
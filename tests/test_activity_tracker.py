@@ -0,0 +1,47 @@
+"""Отложенная запись last_activity не теряет метки при остановке"""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from database.database import get_db_session
+from database.models import User
+from services import activity_tracker as activity_tracker_module
+from services.activity_tracker import ActivityTracker
+from services.user_service import UserService
+
+async def last_activity(user_id: int) -> datetime:
+    async with get_db_session() as session:
+        return await session.scalar(select(User.last_activity).where(User.id == user_id))
+
+@pytest.mark.asyncio
+async def test_stop_during_background_write_keeps_batch(db, monkeypatch):
+    user = await UserService().create_user(400)
+    before = await last_activity(user.id)
+    writing = asyncio.Event()
+    calls = []
+
+    @asynccontextmanager
+    async def slow_session():
+        # Первая запись зависает внутри транзакции, пока ее не отменят
+        calls.append(1)
+        async with get_db_session() as session:
+            if len(calls) == 1:
+                writing.set()
+                await asyncio.sleep(10)
+            yield session
+
+    monkeypatch.setattr(activity_tracker_module, "get_db_session", slow_session)
+    tracker = ActivityTracker(flush_interval=0.01, max_staleness=60)
+    tracker.start()
+    tracker.touch(user.id)
+
+    await asyncio.wait_for(writing.wait(), 5)
+    await tracker.stop()
+
+    assert len(calls) == 2
+    assert tracker.stats()["pending"] == 0
+    assert tracker.rows_written == 1
+    assert await last_activity(user.id) > before
@@ -0,0 +1,31 @@
+"""Выбор отчетов БКИ для диагностики"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.database import get_db_session
+from database.models import Document, DocumentType
+from services.application_service import ApplicationService
+from services.gpt_diagnosis_service import GPTDiagnosisService
+from services.user_service import UserService
+
+@pytest.mark.asyncio
+async def test_newest_report_of_each_bureau_is_analyzed(db):
+    user = await UserService().create_user(100)
+    application = await ApplicationService().create_application(user)
+    uploaded = datetime(2024, 3, 1)
+
+    async with get_db_session() as session:
+        for name, file_type, minutes in (
+            ("nbki_old.pdf", DocumentType.CREDIT_REPORT_NBKI, 0),
+            ("okb.pdf", DocumentType.CREDIT_REPORT_OKB, 1),
+            ("nbki_fixed.pdf", DocumentType.CREDIT_REPORT_NBKI, 2),
+        ):
+            session.add(Document(
+                user_id=user.id, application_id=application.id, file_name=name, file_type=file_type,
+                file_size=1000, file_path=f"documents/{name}", uploaded_at=uploaded + timedelta(minutes=minutes)
+            ))
+
+    documents = await GPTDiagnosisService()._get_bki_documents(user.id, application.id)
+
+    assert sorted(document.file_name for document in documents) == ["nbki_fixed.pdf", "okb.pdf"]
@@ -0,0 +1,107 @@
+"""Очередь диагностики: debounce и вытеснение, истечение аренды, задержка повтора"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from database.database import get_db_session
+from database.models import DiagnosisJob, JobStatus
+from services.application_service import ApplicationService
+from services.diagnosis_queue import DiagnosisQueue
+from services.user_service import UserService
+
+def make_queue(debounce=0.0, max_attempts=3):
+    return DiagnosisQueue(
+        workers=1,
+        poll_interval=0.01,
+        visibility_timeout=60,
+        max_attempts=max_attempts,
+        retry_backoff=10,
+        debounce=debounce
+    )
+
+async def create_application(telegram_id: int) -> int:
+    user = await UserService().create_user(telegram_id)
+    return (await ApplicationService().create_application(user)).id
+
+async def get_job(job_id: int) -> DiagnosisJob:
+    async with get_db_session() as session:
+        return await session.scalar(select(DiagnosisJob).where(DiagnosisJob.id == job_id))
+
+async def shift_job(job_id: int, **values):
+    async with get_db_session() as session:
+        await session.execute(update(DiagnosisJob).where(DiagnosisJob.id == job_id).values(**values))
+
+@pytest.mark.asyncio
+async def test_uploads_in_debounce_window_share_one_job(db):
+    queue = make_queue(debounce=30)
+    application_id = await create_application(600)
+
+    first = await queue.enqueue(application_id)
+    second = await queue.enqueue(application_id)
+
+    assert second.id == first.id
+    assert queue.debounced == 1
+    assert second.available_at >= first.available_at
+    # Задача ждет окончания debounce
+    assert await queue._claim("worker") is None
+
+@pytest.mark.asyncio
+async def test_superseded_job_blocks_new_one_until_released(db):
+    queue = make_queue()
+    application_id = await create_application(601)
+    await queue.enqueue(application_id)
+    running = await queue._claim("worker-a")
+
+    newer = await queue.enqueue(application_id)
+
+    assert (await get_job(running.id)).status == JobStatus.CANCELLED
+    assert queue.superseded == 1
+    # Анализ вытесненной задачи еще может идти в другом процессе
+    assert await queue._claim("worker-b") is None
+
+    await queue._release(running, "worker-a")
+    claimed = await queue._claim("worker-b")
+    assert claimed.id == newer.id
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed(db):
+    queue = make_queue(max_attempts=2)
+    application_id = await create_application(602)
+    job = await queue.enqueue(application_id)
+    await queue._claim("worker-a")
+
+    # Аренда живая - задачу никто не берет
+    assert await queue._claim("worker-b") is None
+
+    await shift_job(job.id, lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+    reclaimed = await queue._claim("worker-b")
+    assert reclaimed.id == job.id
+    assert reclaimed.locked_by == "worker-b" and reclaimed.attempts == 2
+
+    # Попытки исчерпаны - после истечения аренды задача завершается ошибкой
+    await shift_job(job.id, lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+    assert await queue._claim("worker-c") is None
+    assert (await get_job(job.id)).status == JobStatus.FAILED
+
+@pytest.mark.asyncio
+async def test_failed_attempt_is_retried_with_backoff(db):
+    queue = make_queue(max_attempts=2)
+    application_id = await create_application(603)
+    job = await queue.enqueue(application_id)
+    claimed = await queue._claim("worker")
+
+    started = datetime.utcnow()
+    assert await queue._finish(claimed, "worker", success=False, error="Ошибка GPT API") == JobStatus.PENDING
+
+    retry = await get_job(job.id)
+    delay = (retry.available_at - started).total_seconds()
+    assert 10 * 0.8 - 1 <= delay <= 10 * 1.2
+    assert retry.last_error == "Ошибка GPT API" and retry.locked_by is None
+    assert await queue._claim("worker") is None
+
+    # Вторая попытка (задержка уже 2 * backoff) - последняя
+    await shift_job(job.id, available_at=datetime.utcnow())
+    claimed = await queue._claim("worker")
+    assert claimed.attempts == 2
+    assert await queue._finish(claimed, "worker", success=False, error="Ошибка GPT API") == JobStatus.FAILED
@@ -0,0 +1,119 @@
+"""Диагностика: результат сохраняется до завершения, ошибка возвращает прежний статус"""
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select, update
+
+from benchmarks.llm_stub import canned_report
+from database.database import get_db_session
+from database.models import Application, ApplicationStatus, DocumentType
+from services.application_service import ApplicationService
+from services.gpt_diagnosis_service import GPTDiagnosisService
+from services.user_service import UserService
+
+@pytest.fixture
+def analysis(monkeypatch, tmp_path):
+    """Анализ без файлов и GPT: документы, текст и ответ модели готовые"""
+    # Лог анализа пишется в gpt_analysis_logs текущего каталога
+    monkeypatch.chdir(tmp_path)
+
+    async def documents(self, user_id, application_id=None):
+        return [SimpleNamespace(id=1, file_type=DocumentType.CREDIT_REPORT_NBKI)]
+
+    async def texts(self, documents):
+        return {"НБКИ": "Договор № 1 от 01.03.2021"}
+
+    async def chunks(self, chunk_texts, on_block=None, skip_blocks=()):
+        response = canned_report(1)
+        return {"success": True, "response": response, "responses": [response], "tokens_used": 1}
+
+    async def ready(self, application_id):
+        return True
+
+    monkeypatch.setattr(GPTDiagnosisService, "_get_bki_documents", documents)
+    monkeypatch.setattr(GPTDiagnosisService, "_extract_texts_from_documents", texts)
+    monkeypatch.setattr(GPTDiagnosisService, "_collect_tradelines", lambda self, documents: {"НБКИ": None})
+    monkeypatch.setattr(GPTDiagnosisService, "_analyze_chunks", chunks)
+    monkeypatch.setattr(ApplicationService, "check_documents_ready_for_diagnosis", ready)
+
+async def create_application(telegram_id: int):
+    user = await UserService().create_user(telegram_id)
+    return await ApplicationService().create_application(user)
+
+async def diagnosis_result(application_id: int):
+    async with get_db_session() as session:
+        return await session.scalar(
+            select(Application.diagnosis_result).where(Application.id == application_id)
+        )
+
+@pytest.mark.asyncio
+async def test_diagnosis_is_completed_with_saved_result(db, analysis):
+    application_service = ApplicationService()
+    application = await create_application(300)
+
+    assert await application_service.start_diagnosis(application.id)
+
+    application = await application_service.get_application_by_id(application.id)
+    assert application.status == ApplicationStatus.DIAGNOSIS_COMPLETED
+    assert await diagnosis_result(application.id)
+    assert len(await application_service.get_diagnosis_blocks(application.id)) == 12
+
+@pytest.mark.asyncio
+async def test_failed_save_fails_diagnosis(db, analysis, monkeypatch):
+    async def broken_save(self, application_id, report):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(ApplicationService, "save_diagnosis_blocks", broken_save)
+    application_service = ApplicationService()
+    application = await create_application(301)
+
+    # False - задача очереди завершится ошибкой и будет повторена
+    assert not await application_service.start_diagnosis(application.id)
+
+    application = await application_service.get_application_by_id(application.id)
+    assert application.status != ApplicationStatus.DIAGNOSIS_COMPLETED
+    # Результат пишется вместе с блоками одной транзакцией
+    assert await diagnosis_result(application.id) is None
+
+@pytest.mark.asyncio
+async def test_failed_rediagnosis_keeps_completed_status(db, analysis, monkeypatch):
+    application_service = ApplicationService()
+    application = await create_application(302)
+    assert await application_service.start_diagnosis(application.id)
+    saved = await diagnosis_result(application.id)
+
+    async def failed_chunks(self, chunk_texts, on_block=None, skip_blocks=()):
+        return {"success": False, "error": "Ошибка GPT API"}
+
+    monkeypatch.setattr(GPTDiagnosisService, "_analyze_chunks", failed_chunks)
+    assert not await application_service.start_diagnosis(application.id)
+
+    application = await application_service.get_application_by_id(application.id)
+    assert application.status == ApplicationStatus.DIAGNOSIS_COMPLETED
+    assert await diagnosis_result(application.id) == saved
+
+@pytest.mark.asyncio
+async def test_stale_result_is_not_saved(db, analysis, monkeypatch):
+    application_service = ApplicationService()
+    application = await create_application(303)
+    analyze = GPTDiagnosisService._analyze_chunks
+
+    async def superseded_chunks(self, chunk_texts, on_block=None, skip_blocks=()):
+        # Пока шел анализ, заявку изменил более новый запуск
+        async with get_db_session() as session:
+            await session.execute(
+                update(Application)
+                .where(Application.id == application.id)
+                .values(version=Application.version + 1)
+            )
+        return await analyze(self, chunk_texts, on_block, skip_blocks)
+
+    monkeypatch.setattr(GPTDiagnosisService, "_analyze_chunks", superseded_chunks)
+    assert not await application_service.start_diagnosis(application.id)
+
+    # Ни результат, ни статус устаревшего анализа не записаны, статус нового
+    # запуска не откачен
+    application = await application_service.get_application_by_id(application.id)
+    assert application.status == ApplicationStatus.DIAGNOSIS_IN_PROGRESS
+    assert await diagnosis_result(application.id) is None
+    assert await application_service.get_diagnosis_blocks(application.id) == []
@@ -0,0 +1,64 @@
+"""Кэш ответов GPT: попадание, истечение срока и вытеснение давно не использованных"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from database.database import get_db_session
+from database.models import LLMCacheEntry
+from services import llm_cache as llm_cache_module
+from services.llm_cache import LLMResponseCache
+
+def key(text: str) -> str:
+    return LLMResponseCache.make_key("gpt-4o", "ki-analyst-test", "промпт", text, {"temperature": 0.1})
+
+async def cached_keys() -> set:
+    async with get_db_session() as session:
+        return set((await session.execute(select(LLMCacheEntry.cache_key))).scalars())
+
+@pytest.mark.asyncio
+async def test_stored_response_is_hit(db):
+    cache = LLMResponseCache(ttl_hours=1, max_entries=10)
+    await cache.put(key("отчет"), "gpt-4o", "ki-analyst-test", '{"blocks": []}', 1500)
+
+    assert await cache.get(key("отчет")) == {"response": '{"blocks": []}', "tokens_used": 1500}
+    assert await cache.get(key("другой отчет")) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert cache.tokens_saved == 1500
+
+@pytest.mark.asyncio
+async def test_expired_response_is_missed_and_evicted(db):
+    cache = LLMResponseCache(ttl_hours=1, max_entries=10)
+    await cache.put(key("отчет"), "gpt-4o", "ki-analyst-test", "ответ", 100)
+    async with get_db_session() as session:
+        await session.execute(
+            update(LLMCacheEntry).values(expires_at=datetime.utcnow() - timedelta(seconds=1))
+        )
+
+    assert await cache.get(key("отчет")) is None
+
+    # Просроченная запись удаляется при следующем сохранении
+    await cache.put(key("новый отчет"), "gpt-4o", "ki-analyst-test", "ответ", 100)
+    assert await cached_keys() == {key("новый отчет")}
+    assert cache.evictions == 1
+
+@pytest.mark.asyncio
+async def test_least_recently_used_response_is_evicted(db):
+    cache = LLMResponseCache(ttl_hours=1, max_entries=2)
+    await cache.put(key("первый"), "gpt-4o", "ki-analyst-test", "ответ 1")
+    await cache.put(key("второй"), "gpt-4o", "ki-analyst-test", "ответ 2")
+    # Первый использован позже второго
+    assert await cache.get(key("первый"))
+
+    await cache.put(key("третий"), "gpt-4o", "ki-analyst-test", "ответ 3")
+
+    assert await cached_keys() == {key("первый"), key("третий")}
+    assert cache.evictions == 1
+
+@pytest.mark.asyncio
+async def test_unsupported_database_is_reported(db, monkeypatch):
+    monkeypatch.setattr(llm_cache_module, "_UPSERTS", {"postgresql": llm_cache_module.postgres_insert})
+    cache = LLMResponseCache(ttl_hours=1, max_entries=10)
+
+    with pytest.raises(RuntimeError, match="не поддерживает базу sqlite"):
+        await cache.put(key("отчет"), "gpt-4o", "ki-analyst-test", "ответ")
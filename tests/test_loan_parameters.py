@@ -0,0 +1,37 @@
+"""Доход и сумма кредита из заявки попадают в расчет ПДН"""
+import pytest
+
+from bot.handlers.documents import parse_rubles
+from services.application_service import ApplicationService
+from services.gpt_diagnosis_service import GPTDiagnosisService
+from services.tradeline_parser import tradelines_frame
+from services.user_service import UserService
+
+@pytest.mark.parametrize("text, expected", [
+    ("85000", 85000.0),
+    ("85 000 руб.", 85000.0),
+    ("85 тыс", 85000.0),
+    ("0", 0.0),
+    ("много", None),
+    ("-5", None),
+])
+def test_parse_rubles(text, expected):
+    assert parse_rubles(text) == expected
+
+@pytest.mark.asyncio
+async def test_pdn_uses_application_income(db):
+    application_service = ApplicationService()
+    user = await UserService().create_user(200)
+    application = await application_service.create_application(user)
+    assert await application_service.update_loan_parameters(application.id, 100000.0, 500000.0)
+
+    tradelines = tradelines_frame({
+        "bureau": ["НБКИ"], "creditor": ["Банк"], "contract_number": ["123-45"], "opened": ["2021-03-01"],
+        "closed": [None], "credit_limit": [300000.0], "balance": [250000.0], "overdue": [0.0],
+        "payment_string": ["000000"], "page": [1],
+    })
+    debt_load = await GPTDiagnosisService()._calculate_debt_load(application.id, tradelines)
+
+    assert debt_load["monthly_income"] == 100000.0
+    assert debt_load["new_loan_amount"] == 500000.0
+    assert debt_load["pdn"] is not None and debt_load["pdn"] > debt_load["pdn_current"] > 0
@@ -0,0 +1,98 @@
+"""Очередь логов: запись после коммита, повтор пачки и остановка без потерь"""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+
+from database.database import get_db_session
+from database.models import UserLog
+from services import log_sink as log_sink_module
+from services import user_service as user_service_module
+from services.log_sink import UserLogSink
+from services.user_service import UserService
+
+@pytest_asyncio.fixture
+async def sink(db, monkeypatch):
+    sink = UserLogSink(queue_size=100, batch_size=10, flush_interval=0.01, drain_timeout=1.0)
+    monkeypatch.setattr(user_service_module, "log_sink", sink)
+    monkeypatch.setattr(log_sink_module, "WRITE_RETRY_DELAY", 0.01)
+    sink.start()
+    yield sink
+    await sink.stop()
+
+async def count_logs() -> int:
+    async with get_db_session() as session:
+        return await session.scalar(select(func.count()).select_from(UserLog))
+
+def row(user_id, action="message"):
+    return {"user_id": user_id, "action": action, "details": None, "ip_address": None, "created_at": datetime.utcnow()}
+
+@pytest.mark.asyncio
+async def test_log_is_queued_after_commit(sink):
+    user_service = UserService()
+    async with get_db_session():
+        # create_user сам пишет в лог регистрацию
+        user = await user_service.create_user(500)
+        await user_service.log_user_action(user.id, "document_uploaded")
+        # Пользователь еще не закоммичен - записи в очередь не попали
+        assert sink.accepted == 0
+
+    assert sink.accepted == 2
+    await sink.stop()
+    assert await count_logs() == 2
+
+@pytest.mark.asyncio
+async def test_log_of_rolled_back_transaction_is_not_written(sink):
+    user_service = UserService()
+    user = await user_service.create_user(501)
+    accepted = sink.accepted
+
+    with pytest.raises(RuntimeError):
+        async with get_db_session():
+            await user_service.log_user_action(user.id, "document_uploaded")
+            raise RuntimeError("handler failed")
+
+    await sink.stop()
+    assert sink.accepted == accepted
+    assert await count_logs() == accepted
+
+@pytest.mark.asyncio
+async def test_bad_row_does_not_fail_whole_batch(sink):
+    user = await UserService().create_user(502)
+    await sink.stop()
+    logged, written = await count_logs(), sink.written
+    batch = [row(user.id) for _ in range(6)]
+    batch[3]["action"] = None  # NOT NULL
+
+    await sink._write(batch)
+
+    assert await count_logs() == logged + 5
+    assert sink.written == written + 5 and sink.failed == 1
+
+@pytest.mark.asyncio
+async def test_stop_finishes_batch_being_written(sink, monkeypatch):
+    user = await UserService().create_user(503)
+    await asyncio.sleep(0.1)
+    logged = await count_logs()
+    writing = asyncio.Event()
+
+    @asynccontextmanager
+    async def slow_session():
+        async with get_db_session() as session:
+            writing.set()
+            await asyncio.sleep(0.3)
+            yield session
+
+    monkeypatch.setattr(log_sink_module, "get_db_session", slow_session)
+    sink.drain_timeout = 0.01
+    for _ in range(3):
+        sink.put_nowait(user.id, "message")
+
+    await asyncio.wait_for(writing.wait(), 5)
+    await sink.stop()
+
+    assert await count_logs() == logged + 3
+    assert sink.failed == 0
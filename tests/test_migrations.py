@@ -0,0 +1,48 @@
+"""Миграции схемы на базе, созданной старой версией"""
+import json
+
+from sqlalchemy import create_engine, select, text
+
+from benchmarks.llm_stub import canned_report
+from database.migrations import add_column, _diagnosis_blocks
+from database.models import Base, Application, DiagnosisBlock, User
+
+def make_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(engine)
+    return engine
+
+def test_add_column_applies_server_default(tmp_path):
+    engine = make_engine(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE applications DROP COLUMN version"))
+        conn.execute(User.__table__.insert().values(id=1, telegram_id=1))
+        # Строка заявки из старой схемы, еще без version
+        conn.execute(text(
+            "INSERT INTO applications (id, user_id, status, created_at, updated_at) "
+            "VALUES (1, 1, 'CREATED', '2024-01-01', '2024-01-01')"
+        ))
+
+        add_column(conn, "applications", "version")
+        add_column(conn, "applications", "version")
+
+        assert conn.execute(select(Application.version)).scalar() == 1
+
+def test_diagnosis_blocks_from_stored_text_report(tmp_path):
+    engine = make_engine(tmp_path)
+    raw_response = canned_report(7, as_json=False)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert().values(id=1, telegram_id=1))
+        conn.execute(Application.__table__.insert().values(
+            id=1, user_id=1, diagnosis_result=json.dumps({"raw_response": raw_response})
+        ))
+
+        _diagnosis_blocks(conn)
+        _diagnosis_blocks(conn)
+
+        rows = conn.execute(
+            select(DiagnosisBlock.block_number, DiagnosisBlock.severity)
+            .order_by(DiagnosisBlock.block_number)
+        ).all()
+    assert [number for number, _ in rows] == list(range(1, 13))
+    assert all(severity is not None for _, severity in rows)
@@ -0,0 +1,225 @@
+"""Клиент OpenAI против локальной заглушки: повторы, лимиты, поток и обрезанные ответы"""
+import asyncio
+import time
+
+import openai
+import pytest
+import pytest_asyncio
+
+from benchmarks.llm_stub import LLMStub, start_stub
+from services.openai_client import OpenAIClient, TokenBucket, ResponseTruncatedError
+
+MESSAGES = [{"role": "user", "content": "Проанализируй кредитную историю"}]
+
+@pytest_asyncio.fixture
+async def llm_stub():
+    stub = LLMStub(latency=0.05, per_1k=0.0, output_tps=100000.0)
+    runner, base_url = await start_stub(stub)
+    yield stub, base_url
+    await runner.cleanup()
+
+def make_client(base_url: str, **overrides) -> OpenAIClient:
+    params = dict(
+        api_key="stub",
+        base_url=base_url,
+        timeout=10.0,
+        max_retries=2,
+        retry_backoff=0.01,
+        rpm_limit=10000,
+        tpm_limit=10_000_000,
+        max_concurrency=4,
+        max_connections=8,
+    )
+    params.update(overrides)
+    return OpenAIClient(**params)
+
+async def read_stream(client: OpenAIClient) -> str:
+    return "".join([delta async for delta in client.stream_chat("gpt-4o", MESSAGES)])
+
+@pytest.mark.asyncio
+async def test_retries_429_and_5xx(llm_stub):
+    stub, base_url = llm_stub
+    stub.failures = [(429, None), (500, None)]
+    client = make_client(base_url)
+
+    content, usage = await client.chat("gpt-4o", MESSAGES)
+
+    assert content.startswith("Блок 1.")
+    assert usage
+    assert stub.requests == 3
+    assert client.retries == 2 and client.errors == 0
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries(llm_stub):
+    stub, base_url = llm_stub
+    stub.failures = [(503, None)] * 3
+    client = make_client(base_url, max_retries=1)
+
+    with pytest.raises(openai.APIStatusError):
+        await client.chat("gpt-4o", MESSAGES)
+
+    assert stub.requests == 2
+    assert client.errors == 1
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_client_error_is_not_retried(llm_stub):
+    stub, base_url = llm_stub
+    stub.failures = [(400, None)]
+    client = make_client(base_url)
+
+    with pytest.raises(openai.BadRequestError):
+        await client.chat("gpt-4o", MESSAGES)
+
+    assert stub.requests == 1
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_retry_after_header_sets_minimum_delay(llm_stub):
+    stub, base_url = llm_stub
+    stub.failures = [(429, "0.5")]
+    client = make_client(base_url)
+
+    started = time.monotonic()
+    await client.chat("gpt-4o", MESSAGES)
+
+    # Без заголовка задержка была бы около retry_backoff = 0.01 с
+    assert time.monotonic() - started >= 0.5
+    assert stub.requests == 2
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_semaphore_caps_concurrent_requests(llm_stub):
+    stub, base_url = llm_stub
+    stub.latency = 0.2
+    client = make_client(base_url, max_concurrency=2)
+
+    await asyncio.gather(*[client.chat("gpt-4o", MESSAGES) for _ in range(6)])
+
+    assert stub.requests == 6
+    assert stub.max_in_flight == 2
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate_per_minute=120)  # 2 в секунду
+    assert await bucket.acquire(120) == 0
+
+    started = time.monotonic()
+    waited = await bucket.acquire(1)
+
+    assert 0.4 <= waited <= 0.7
+    assert time.monotonic() - started >= 0.4
+
+@pytest.mark.asyncio
+async def test_tokens_per_minute_limit_throttles_requests(llm_stub):
+    _, base_url = llm_stub
+    # 1000 токенов в секунду; два запроса по ~30250 токенов превышают
+    # емкость ведра на ~500 токенов, то есть на ~0.5 с
+    client = make_client(base_url, tpm_limit=60000)
+
+    await client.chat("gpt-4o", MESSAGES, max_tokens=30250)
+    assert client.throttled_seconds == 0
+    await client.chat("gpt-4o", MESSAGES, max_tokens=30250)
+
+    assert 0.3 <= client.throttled_seconds <= 1.0
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_stream_is_retried_before_first_chunk(llm_stub):
+    stub, base_url = llm_stub
+    stub.failures = [(500, None)]
+    client = make_client(base_url)
+
+    text = await read_stream(client)
+
+    assert text.startswith("Блок 1.")
+    assert stub.requests == 2
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_stream_is_not_retried_after_first_chunk(llm_stub):
+    stub, base_url = llm_stub
+    stub.abort_streams = 1
+    client = make_client(base_url)
+
+    received = []
+    with pytest.raises(Exception):
+        async for delta in client.stream_chat("gpt-4o", MESSAGES):
+            received.append(delta)
+
+    # Первая строка уже отдана: повтор продублировал бы ее
+    assert len(received) == 1 and received[0].startswith("Блок 1.")
+    assert stub.requests == 1
+    assert client.errors == 1
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_stream_dropped_before_first_chunk_is_retried(llm_stub):
+    stub, base_url = llm_stub
+    stub.abort_streams = 1
+    stub.abort_after_lines = 0
+    client = make_client(base_url)
+
+    # Обрыв соединения приходит от httpx при чтении потока
+    text = await read_stream(client)
+
+    assert text.startswith("Блок 1.")
+    assert stub.requests == 2
+    assert client.retries == 1
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_response_cut_by_max_tokens_raises(llm_stub):
+    stub, base_url = llm_stub
+    client = make_client(base_url)
+
+    with pytest.raises(ResponseTruncatedError):
+        await client.chat("gpt-4o", MESSAGES, max_tokens=50)
+    with pytest.raises(ResponseTruncatedError):
+        async for _ in client.stream_chat("gpt-4o", MESSAGES, max_tokens=50):
+            pass
+
+    # Тот же лимит дал бы тот же обрезанный ответ - клиент не повторяет
+    assert stub.requests == 2
+    assert client.truncated == 2 and client.retries == 0
+    await client.close()
+
+@pytest_asyncio.fixture
+async def gpt_service(db, llm_stub, monkeypatch):
+    from services import gpt_diagnosis_service
+
+    _, base_url = llm_stub
+    client = make_client(base_url)
+    monkeypatch.setattr(gpt_diagnosis_service, "openai_client", client)
+    # Готовый отчет заглушки длиннее 200 токенов
+    monkeypatch.setitem(gpt_diagnosis_service.GPT_PARAMS, "max_tokens", 200)
+    yield gpt_diagnosis_service.GPTDiagnosisService()
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_truncated_report_is_requested_again_with_larger_budget(gpt_service, llm_stub):
+    stub, _ = llm_stub
+
+    result = await gpt_service._send_to_gpt("НБКИ: договор № 1")
+
+    assert result["success"]
+    report = await gpt_service._parse_gpt_response(result["response"])
+    assert sorted(report) == list(range(1, 13))
+    assert stub.requests == 2
+
+@pytest.mark.asyncio
+async def test_report_truncated_twice_fails_instead_of_text_parsing(gpt_service, llm_stub, monkeypatch):
+    from services import gpt_diagnosis_service
+
+    stub, _ = llm_stub
+    monkeypatch.setattr(gpt_diagnosis_service, "GPT_RETRY_MAX_TOKENS", 300)
+
+    result = await gpt_service._send_to_gpt("НБКИ: договор № 1")
+
+    assert not result["success"]
+    assert stub.requests == 2
+    # Обрезанный JSON не разбирается как текст с пустыми блоками
+    with pytest.raises(ValueError):
+        await gpt_service._parse_gpt_response('{"blocks": [{"number": 1, "title": "Ошибки в титуле", ')
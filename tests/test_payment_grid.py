@@ -0,0 +1,57 @@
+"""Платежные строки: декодирование по кодировкам БКИ и находки блока 7"""
+from datetime import date
+
+from services.payment_grid import NO_DATA, ON_TIME, BAD_DEBT, analyze_payment_grid, current_levels, decode_grid
+from services.tradeline_parser import tradelines_frame
+
+TODAY = date(2024, 6, 1)
+
+def tradelines(*records):
+    names = ("bureau", "creditor", "contract_number", "closed", "payment_string")
+    columns = {name: [record.get(name) for record in records] for name in names}
+    columns["page"] = [1] * len(records)
+    return tradelines_frame(columns)
+
+def test_grid_is_decoded_per_bureau_with_overdue_buckets():
+    grid = decode_grid(["1A2345", "012359", "9"], ["НБКИ", "ОКБ", "Эквифакс"])
+
+    # НБКИ: 1 - в срок, A - до 30 дней; ОКБ: 0 - в срок, 1 - до 30 дней
+    assert grid.tolist() == [
+        [0, 1, 2, 3, 4, 5],
+        [0, 1, 2, 3, 5, BAD_DEBT],
+        [BAD_DEBT, NO_DATA, NO_DATA, NO_DATA, NO_DATA, NO_DATA],
+    ]
+
+def test_unknown_symbols_are_no_data():
+    # X и «-» - нет кода, кириллическая «А» вне ASCII, строчная «a» - код НБКИ
+    grid = decode_grid(["X-Аa6"], ["НБКИ"])
+
+    assert grid.tolist() == [[NO_DATA, NO_DATA, NO_DATA, 1, NO_DATA]]
+    assert current_levels(["A1", "", "01"], ["НБКИ", "ОКБ", "ОКБ"]).tolist() == [1, NO_DATA, ON_TIME]
+
+def test_findings_of_payment_grid():
+    findings = analyze_payment_grid(tradelines(
+        {"bureau": "НБКИ", "creditor": "ПАО Банк", "contract_number": "12-0045/А", "payment_string": "11A2X11A"},
+        {"bureau": "ОКБ", "creditor": "ПАО Банк", "contract_number": "120045A", "payment_string": "00000000"},
+        {"bureau": "ОКБ", "creditor": "МФО Займ", "contract_number": "77", "closed": "2024-03-10", "payment_string": "1000"},
+    ), today=TODAY)
+
+    by_type = {}
+    for finding in findings:
+        by_type.setdefault(finding["type"], []).append(finding)
+
+    episodes = {finding["contract_number"]: finding for finding in by_type["overdue_episode"]}
+    # Серии месяцев 2-3 и 7; X посередине - нет данных, а не просрочка
+    assert episodes["12-0045/А"]["months"] == [2, 3, 7]
+    assert episodes["12-0045/А"]["severity"] == "🟥"
+    assert "эпизодов просрочки 2, максимальная 30-59 дн." in episodes["12-0045/А"]["text"]
+    assert episodes["77"]["severity"] == "🟨"
+
+    # Договор закрыт 3 месяца назад, а в текущем месяце - просрочка
+    [after_closure] = by_type["overdue_after_closure"]
+    assert after_closure["contract_number"] == "77" and after_closure["months"] == [0]
+
+    # Один договор в двух БКИ: месяц 4 (X) в НБКИ неизвестен и не сравнивается
+    [mismatch] = by_type["bureau_mismatch"]
+    assert mismatch["months"] == [2, 3, 7]
+    assert {mismatch["bureau"], mismatch["other_bureau"]} == {"НБКИ", "ОКБ"}
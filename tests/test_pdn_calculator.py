@@ -0,0 +1,64 @@
+"""Кредитная нагрузка: доход не указан или нулевой, кредитные карты вместе с кредитами"""
+from datetime import date
+
+import pytest
+
+from services.pdn_calculator import annuity_payment, calculate_debt_load, format_debt_load
+from services.tradeline_parser import tradelines_frame
+
+TODAY = date(2024, 6, 1)
+RATE = 0.2
+TERM = 60
+
+def tradelines(*records):
+    columns = {
+        name: [record.get(name) for record in records]
+        for name in ("bureau", "creditor", "contract_number", "closed", "credit_limit", "balance", "overdue", "payment_string")
+    }
+    columns["page"] = [1] * len(records)
+    return tradelines_frame(columns)
+
+CARD = {
+    "bureau": "НБКИ", "creditor": "Банк А", "contract_number": "КК-001",
+    "credit_limit": 100000.0, "balance": 30000.0, "overdue": 0.0, "payment_string": "1",
+}
+LOAN = {
+    "bureau": "НБКИ", "creditor": "Банк Б", "contract_number": "ПК-002",
+    "credit_limit": 500000.0, "balance": 400000.0, "overdue": 12000.0, "payment_string": "2",
+}
+
+def calculate(frame, loan_amount=None, monthly_income=None):
+    return calculate_debt_load(frame, loan_amount, monthly_income, RATE, TERM, today=TODAY)
+
+def test_missing_income_leaves_pdn_empty():
+    result = calculate(tradelines(CARD, LOAN), loan_amount=200000.0)
+
+    assert result["pdn_current"] is None and result["pdn"] is None
+    assert result["monthly_payments"] > 0
+    assert "ПДН: нет данных о доходе" in format_debt_load(result)
+
+def test_zero_income_is_treated_as_missing():
+    result = calculate(tradelines(CARD, LOAN), loan_amount=200000.0, monthly_income=0.0)
+
+    assert result["pdn_current"] is None and result["pdn"] is None
+    assert "ПДН: нет данных о доходе" in format_debt_load(result)
+
+def test_card_and_loan_payments_are_summed():
+    # Кредит есть и в ОКБ с меньшим остатком - учитывается один раз, по большему
+    loan_okb = {**LOAN, "bureau": "ОКБ", "contract_number": "пк 002", "balance": 390000.0, "payment_string": "0"}
+    closed = {**CARD, "contract_number": "КК-003", "closed": "2023-01-10"}
+    result = calculate(tradelines(CARD, LOAN, loan_okb, closed), loan_amount=200000.0, monthly_income=100000.0)
+
+    card_payment = annuity_payment(30000.0, RATE, TERM)
+    loan_payment = annuity_payment(400000.0, RATE, TERM)
+    new_payment = annuity_payment(200000.0, RATE, TERM)
+    assert result["accounts"] == 2
+    assert result["total_exposure"] == 430000.0
+    assert result["total_limit"] == 600000.0
+    assert result["monthly_payments"] == pytest.approx(card_payment + loan_payment, abs=0.01)
+    assert result["new_loan_payment"] == pytest.approx(new_payment, abs=0.01)
+    assert result["pdn_current"] == pytest.approx((card_payment + loan_payment) / 100000.0, abs=1e-4)
+    assert result["pdn"] == pytest.approx((card_payment + loan_payment + new_payment) / 100000.0, abs=1e-4)
+    # Просрочка кредита - в корзине 30-59 по статусу последнего месяца НБКИ
+    assert result["overdue_total"] == 12000.0
+    assert result["overdue_buckets"]["30-59"] == 12000.0
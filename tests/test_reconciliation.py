@@ -0,0 +1,71 @@
+"""Сверка записей о кредитах между БКИ (блоки 6, 8 и 9)"""
+from datetime import date
+
+from services.reconciliation import contract_key, reconcile
+from services.tradeline_parser import tradelines_frame
+
+TODAY = date(2024, 6, 1)
+
+LOAN = {
+    "creditor": "ПАО Банк", "contract_number": "12-0045/А", "opened": "2021-03-05",
+    "credit_limit": 500000.0, "balance": 312450.17, "overdue": 0.0, "payment_string": "1111",
+}
+
+def tradelines(bureau, *records):
+    names = ("creditor", "contract_number", "opened", "closed", "credit_limit", "balance", "overdue", "payment_string")
+    columns = {name: [record.get(name) for record in records] for name in names}
+    columns["bureau"] = [bureau] * len(records)
+    columns["page"] = [1] * len(records)
+    return tradelines_frame(columns)
+
+def test_contract_numbers_of_different_bureaus_match():
+    # Кириллическая «А» и латинская «A», разделители и ведущие нули
+    assert contract_key("№ 12-0045/А") == contract_key("0120045A") == "120045A"
+
+def test_same_loan_in_two_bureaus_has_no_discrepancies():
+    findings = reconcile({
+        "НБКИ": tradelines("НБКИ", LOAN),
+        "ОКБ": tradelines("ОКБ", {**LOAN, "contract_number": "120045A", "balance": 312450.4}),
+    }, today=TODAY)
+
+    # Копейки при сравнении сумм не считаются расхождением
+    assert findings[6] == ("🟩", ["ошибок не выявлено"])
+    assert findings[8] == ("🟩", ["ошибок не выявлено"])
+    assert findings[9] == ("🟩", ["ошибок не выявлено"])
+
+def test_conflicting_amounts_are_reported_with_both_values():
+    severity, lines = reconcile({
+        "НБКИ": tradelines("НБКИ", LOAN),
+        "ОКБ": tradelines("ОКБ", {**LOAN, "balance": 298000.0, "overdue": 1500.0}),
+    }, today=TODAY)[6]
+
+    assert severity == "🟥"
+    assert lines == [
+        "договор № 12-0045/А (ПАО Банк): остаток задолженности различается - НБКИ: 312 450,17; ОКБ: 298 000,00",
+        "договор № 12-0045/А (ПАО Банк): просроченная задолженность различается - НБКИ: 0,00; ОКБ: 1 500,00",
+    ]
+
+def test_loan_missing_in_one_bureau_and_duplicated_in_another():
+    card = {**LOAN, "contract_number": "КК-77", "credit_limit": 100000.0, "balance": 0.0}
+    findings = reconcile({
+        "НБКИ": tradelines("НБКИ", LOAN, card),
+        "ОКБ": tradelines("ОКБ", LOAN, {**LOAN, "contract_number": "12-0045-A"}),
+    }, today=TODAY)
+
+    assert findings[6] == ("🟨", ["договор № КК-77 (ПАО Банк): есть в НБКИ, нет в ОКБ"])
+    severity, lines = findings[8]
+    assert severity == "🟥"
+    assert lines[0] == "ОКБ, договор № 12-0045/А (ПАО Банк): учтен повторно, записей 2 (стр. 1)"
+
+def test_closed_loan_with_balance_is_reported():
+    closed = {**LOAN, "closed": "2023-12-20", "balance": 15000.0}
+    severity, lines = reconcile({
+        "НБКИ": tradelines("НБКИ", closed),
+        "ОКБ": tradelines("ОКБ", {**closed, "balance": 0.0}),
+    }, today=TODAY)[9]
+
+    assert severity == "🟥"
+    assert lines == ["НБКИ, договор № 12-0045/А (ПАО Банк): закрыт 20.12.2023, но остаток 15 000,00, просрочка 0,00"]
+
+def test_unparsed_report_leaves_blocks_to_gpt():
+    assert reconcile({"НБКИ": tradelines("НБКИ", LOAN), "ОКБ": None}, today=TODAY) == {}
@@ -0,0 +1,97 @@
+"""Сокращение текста отчетов БКИ: данные договоров не теряются"""
+from services.text_reducer import TextReducer
+
+BANNER = "НАЦИОНАЛЬНОЕ БЮРО КРЕДИТНЫХ ИСТОРИЙ"
+DISCLAIMER = (
+    "Настоящий кредитный отчет предоставлен в соответствии с Федеральным законом "
+    "от 30.12.2004 № 218-ФЗ «О кредитных историях»"
+)
+
+def contract_pages(count: int):
+    """Отчет, где каждый договор занимает страницу целиком и стоит в ее начале"""
+    return [
+        "\n".join([
+            f"Договор № 10{i}-77 от 0{i}.03.2021",
+            f"Кредитор: Банк {i}",
+            f"Остаток: {i}000 руб",
+            "Просрочка: 0",
+            f"Страница {i} из {count}",
+        ])
+        for i in range(1, count + 1)
+    ]
+
+def tradeline_pages(count: int, rows: int):
+    """Отчет с таблицей договоров: шапка бюро, строки таблицы, оговорка и счетчик страниц"""
+    pages = []
+    for page in range(count):
+        lines = [BANNER, "Кредитный отчет для субъекта", "Сведения о договорах"]
+        lines += ["Кредитор", "Номер договора", "Дата открытия", "Остаток, руб.", "Платежная дисциплина"]
+        for row in range(rows):
+            lines += [
+                "ПАО Сбербанк",
+                f"{page:02d}{row:02d}-ПК/{2015 + row}",
+                f"{row + 1:02d}.0{page % 9 + 1}.2019",
+                f"{(page + 1) * (row + 1) * 1000} 000,00",
+                "000000000100000000000000",
+            ]
+        lines += [DISCLAIMER, f"Страница {page + 1} из {count}"]
+        pages.append("\n".join(lines))
+    return pages
+
+def test_contract_at_page_top_is_kept():
+    pages = contract_pages(6)
+    text = TextReducer(min_page_share=0.5, min_documents=3).reduce(pages, "НБКИ")
+
+    for i in range(1, 7):
+        assert f"Договор № 10{i}-77 от 0{i}.03.2021" in text
+        assert f"Кредитор: Банк {i}" in text
+        assert f"Остаток: {i}000 руб" in text
+    assert "Страница" not in text
+
+def test_repeated_disclaimer_is_removed_and_values_survive():
+    pages = tradeline_pages(8, rows=5)
+    text = TextReducer(min_page_share=0.5, min_documents=3).reduce(pages, "НБКИ")
+    kept = set(text.split("\n"))
+    
+    for page in pages:
+        for line in page.split("\n"):
+            if line in (DISCLAIMER, BANNER) or line.startswith("Страница"):
+                continue
+            if any(char.isdigit() for char in line):
+                assert line in kept
+    # Оговорка и шапка бюро остаются один раз, повторяющиеся значения ячеек - везде
+    assert text.count(DISCLAIMER) == 1
+    assert text.count(BANNER) == 1
+    assert text.count("ПАО Сбербанк") == 8 * 5
+
+def test_learned_disclaimer_is_removed_from_short_reports():
+    reducer = TextReducer(min_page_share=0.5, min_documents=3)
+    for _ in range(3):
+        reducer.reduce(tradeline_pages(4, rows=3), "НБКИ")
+    
+    # Одностраничный отчет: повторов внутри нет, оговорка известна по бюро
+    single = tradeline_pages(1, rows=2)
+    text = reducer.reduce(single, "НБКИ")
+    assert DISCLAIMER not in text
+    for line in single[0].split("\n"):
+        if line != DISCLAIMER and not line.startswith("Страница") and any(char.isdigit() for char in line):
+            assert line in text
+    # У другого бюро оговорка не выучена
+    assert DISCLAIMER in reducer.reduce(single, "ОКБ")
+
+def test_repeated_tradeline_field_is_never_removed():
+    field = "Договор № 7001-ПК/2020 от 15.06.2020, кредитор ПАО Сбербанк, лимит 300 000 руб"
+    pages = ["\n".join([f"Раздел {page}", field, f"Остаток: {page}000 руб"]) for page in range(4)]
+    reducer = TextReducer(min_page_share=0.5, min_documents=1)
+    
+    for _ in range(2):
+        text = reducer.reduce(pages, "НБКИ")
+        assert text.count(field) == 4
+
+def test_appendix_page_without_data_is_skipped():
+    pages = tradeline_pages(3, rows=2) + ["\n".join([BANNER, "Порядок оспаривания сведений", "Страница 4 из 4"])]
+    reducer = TextReducer(min_page_share=0.5, min_documents=3)
+    text = reducer.reduce(pages, "НБКИ")
+
+    assert "Порядок оспаривания" not in text
+    assert reducer.stats()["pages_skipped"] == 1
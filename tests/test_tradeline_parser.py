@@ -0,0 +1,107 @@
+"""Разбор таблиц договоров: заголовки НБКИ, ОКБ и Эквифакс, перенос таблицы"""
+import pandas as pd
+import pytest
+
+from services import tradeline_parser as tradeline_parser_module
+from services.tradeline_parser import _parse_tradelines, pack_tradelines, tradelines_frame, unpack_tradelines
+
+# Строка заголовка и строка договора в раскладке каждого БКИ
+LAYOUTS = {
+    "НБКИ": (
+        ["Номер договора", "Кредитор", "Дата открытия", "Дата закрытия", "Сумма кредита",
+         "Остаток задолженности", "Просроченная задолженность", "Платежная дисциплина"],
+        ["12-0045/А", "ПАО Банк", "05.03.2021", "", "500 000,00 руб.", "312 450,17", "0,00", "1 1 1 A 1"],
+    ),
+    "ОКБ": (
+        ["Источник", "№ договора", "Дата заключения", "Фактическая дата закрытия", "Лимит",
+         "Задолженность", "Просрочено", "История платежей"],
+        ["ПАО Банк", "120045А", "05.03.21", "", "500 000", "312 450,17", "0", "00010"],
+    ),
+    "Эквифакс": (
+        ["Организация", "Номер сделки", "Дата выдачи", "Дата погашения", "Сумма обязательства",
+         "Баланс", "Просроченная задолженность", "Своевременность платежей"],
+        ["ПАО Банк", "12-0045/A", "05.03.2021", "10.01.2024", "500000.00", "0", "1 200,50", "0001"],
+    ),
+}
+
+class FakePage:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def extract_tables(self):
+        return self.tables
+
+    def close(self):
+        pass
+
+class FakePdf:
+    def __init__(self, pages):
+        self.pages = [FakePage(tables) for tables in pages]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+@pytest.fixture
+def pdf_pages(monkeypatch):
+    """Подменить pdfplumber: «PDF» - список страниц, страница - список таблиц"""
+    pages = []
+
+    class FakePdfplumber:
+        @staticmethod
+        def open(stream):
+            return FakePdf(pages)
+
+    monkeypatch.setattr(tradeline_parser_module, "pdfplumber", FakePdfplumber)
+    return pages
+
+@pytest.mark.parametrize("bureau", list(LAYOUTS))
+def test_tradeline_row_of_each_bureau_layout(pdf_pages, bureau):
+    header, row = LAYOUTS[bureau]
+    pdf_pages.append([[header, row]])
+
+    frame = tradelines_frame(_parse_tradelines(b"", bureau))
+
+    assert len(frame) == 1
+    record = frame.iloc[0]
+    assert record["bureau"] == bureau
+    assert record["creditor"] == "ПАО Банк"
+    assert record["opened"] == pd.Timestamp("2021-03-05")
+    assert record["credit_limit"] == 500000.0
+    assert record["page"] == 1
+    # Пробелы внутри платежной строки убираются
+    assert " " not in record["payment_string"]
+    if bureau == "Эквифакс":
+        assert record["closed"] == pd.Timestamp("2024-01-10")
+        assert record["balance"] == 0.0 and record["overdue"] == 1200.5
+    else:
+        assert pd.isna(record["closed"])
+        assert record["balance"] == 312450.17 and record["overdue"] == 0.0
+
+def test_table_continued_on_next_page(pdf_pages):
+    header, row = LAYOUTS["НБКИ"]
+    continued = ["77/2019", "МФО Займ", "01.02.2019", "01.08.2019", "30 000", "0", "0", "1111"]
+    pdf_pages.extend([
+        [[header, row]],
+        # Продолжение без заголовка той же ширины и посторонняя таблица
+        [[continued, ["", "", "", "", "", "", "", ""]], [["Итого", "2"]]],
+    ])
+
+    frame = tradelines_frame(_parse_tradelines(b"", "НБКИ"))
+
+    assert frame["contract_number"].tolist() == ["12-0045/А", "77/2019"]
+    assert frame["page"].tolist() == [1, 2]
+
+def test_packed_tradelines_round_trip(pdf_pages):
+    # Три таблицы с разными заголовками: пустые даты и суммы тоже упаковываются
+    for bureau in LAYOUTS:
+        header, row = LAYOUTS[bureau]
+        pdf_pages.append([[header, row]])
+    frame = tradelines_frame(_parse_tradelines(b"", "ОКБ"))
+
+    unpacked = unpack_tradelines(pack_tradelines(frame))
+
+    pd.testing.assert_frame_equal(unpacked, frame, check_dtype=False)
+    assert unpack_tradelines(b"not npz") is None
@@ -0,0 +1,94 @@
+"""Unit of work: точки сохранения вложенных блоков и коммит перед запросом к Telegram"""
+import pytest
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from sqlalchemy import select, func
+
+from bot.middlewares.db_session_middleware import CommitBeforeRequestMiddleware
+from database.database import get_db_session, call_after_commit, commit_unit_of_work, outside_unit_of_work
+from database.models import User, UserLog
+from services.user_service import UserService
+
+class OfflineTelegramSession(BaseSession):
+    """Сессия бота без сети: запросы проходят middleware и ничего не отправляют"""
+
+    async def make_request(self, bot, method, timeout=None):
+        return None
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+async def _count(model) -> int:
+    async with get_db_session() as session:
+        return (await session.execute(select(func.count()).select_from(model))).scalar()
+
+@pytest.mark.asyncio
+async def test_swallowed_error_rolls_back_only_nested_block(db):
+    callbacks = []
+
+    async with get_db_session() as session:
+        session.add(User(telegram_id=1))
+        await session.flush()
+
+        try:
+            async with get_db_session() as nested:
+                nested.add(User(telegram_id=2))
+                await nested.flush()
+                call_after_commit(lambda: callbacks.append("nested"))
+                raise RuntimeError("ошибка постановки в очередь")
+        except RuntimeError:
+            pass
+
+        session.add(User(telegram_id=3))
+        call_after_commit(lambda: callbacks.append("outer"))
+
+    async with get_db_session() as session:
+        telegram_ids = set((await session.execute(select(User.telegram_id))).scalars())
+    assert telegram_ids == {1, 3}
+    assert callbacks == ["outer"]
+
+@pytest.mark.asyncio
+async def test_commit_before_request_persists_changes(db):
+    user = await UserService().create_user(10)
+
+    async with get_db_session():
+        await UserService().log_user_action(user.id, "document_uploaded", {})
+        await commit_unit_of_work()
+        # Изменения видны другим соединениям, пока апдейт еще идет
+        with outside_unit_of_work():
+            assert await _count(UserLog) >= 1
+
+@pytest.mark.asyncio
+async def test_commit_is_deferred_inside_nested_block(db):
+    async with get_db_session() as session:
+        session.add(User(telegram_id=20))
+        async with get_db_session():
+            await commit_unit_of_work()
+            assert session.in_transaction()
+
+@pytest.mark.asyncio
+async def test_handler_failing_after_request_keeps_committed_part(db):
+    # Компромисс CommitBeforeRequestMiddleware: до запроса к Telegram -
+    # закоммичено, после - откатывается вместе с after-commit обработчиками
+    bot = Bot("123456:test", session=OfflineTelegramSession())
+    bot.session.middleware(CommitBeforeRequestMiddleware())
+    callbacks = []
+
+    with pytest.raises(RuntimeError):
+        async with get_db_session() as session:
+            session.add(User(telegram_id=30))
+            call_after_commit(lambda: callbacks.append("before"))
+            await bot(SendMessage(chat_id=30, text="⏳ Обрабатываю документ..."))
+            session.add(User(telegram_id=31))
+            call_after_commit(lambda: callbacks.append("after"))
+            await session.flush()
+            raise RuntimeError("handler failed")
+
+    async with get_db_session() as session:
+        telegram_ids = set((await session.execute(select(User.telegram_id))).scalars())
+    assert telegram_ids == {30}
+    assert callbacks == ["before"]